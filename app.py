@@ -1,87 +1,650 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Blueprint, render_template, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
-import google.generativeai as genai
+from flask_sock import Sock
 from dotenv import load_dotenv
 import os
 import base64
-from PIL import Image
 import io
+import json
+import logging
+import math
+import queue
+import threading
+import time
+from urllib.parse import unquote
 
 # Import Firebase auth utilities
-from utils.firebase_auth import initialize_firebase, require_auth, optional_auth
+from utils.firebase_auth import (
+    firebase_app, require_auth, optional_auth, verify_firebase_token, get_token_cache_stats,
+    user_directory
+)
+from utils.session_store import create_session_store
+from utils.history_store import create_history_store
+from utils.context_manager import create_context_manager
+from utils.frame_processor import create_frame_processor, create_frame_deduplicator
+from utils.frame_executor import create_frame_executor
+from utils.live_session import LiveCameraSession, LiveSpeechSession, LiveAvatarSession
+from utils.batch_scheduler import create_emotion_batcher, QueueFullError
+from utils.response_cache import create_response_cache, normalize_prompt, cache_key
+from utils.avatar_generator import AvatarGenerator, clamp_rate
+from utils.avatar_state import AvatarSpeech
+from utils.speech_handler import create_speech_handler, wav_stream_header
+from utils.scheduler import create_model_scheduler, StaleRequestError
+from utils.model_client import create_model_client, ModelUnavailableError, ModelTimeoutError
+from utils.rate_limiter import create_rate_limiter
+from utils.logging_setup import configure_logging
+from utils.services import LazyService, warm_services, service_status
+from utils.metrics import (
+    REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE, HTTP_REQUESTS, HTTP_ERRORS, HTTP_LATENCY,
+    PARSE_LATENCY, IMAGE_DECODE_LATENCY, MODEL_LATENCY, ACTIVE_SESSIONS, hit_miss_counters
+)
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
-app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-change-this')
-CORS(app)
+# Records are written by a background thread (LOG_LEVEL / LOG_FORMAT)
+configure_logging()
+logger = logging.getLogger("talkbot")
+
+# Routes live on a blueprint; create_app() (bottom of this file) builds the app
+api = Blueprint("talkbot", __name__)
+sock = Sock()
+
+# Seconds a new WebSocket connection has to send its auth event
+LIVE_AUTH_TIMEOUT = float(os.getenv('LIVE_AUTH_TIMEOUT', 10))
 
 # ============================================
 # FIREBASE SETUP
 # ============================================
-print("\n" + "="*60)
-print("🔥 INITIALIZING FIREBASE")
-print("="*60)
-firebase_initialized = initialize_firebase()
-if firebase_initialized:
-    print("✅ Firebase Admin SDK initialized successfully")
-else:
-    print("⚠️  Firebase initialization failed - authentication may not work")
-print("="*60)
+# The Admin SDK is initialized on first token verification
+# (utils.firebase_auth.firebase_app), or ahead of traffic by warm_services()
 
 # ============================================
 # GEMINI SETUP
 # ============================================
-print("\n" + "="*60)
-print("🤖 INITIALIZING GEMINI AI")
-print("="*60)
+GEMINI_MODEL = "gemini-2.0-flash-exp"
 api_key = os.getenv("GEMINI_API_KEY")
 if not api_key:
-    print("⚠️  WARNING: GEMINI_API_KEY not found!")
-    print("   Please create a .env file with: GEMINI_API_KEY=your_key_here")
+    logger.warning("⚠️  GEMINI_API_KEY not found! Create a .env file with: GEMINI_API_KEY=your_key_here")
 else:
-    print(f"✅ Gemini API Key loaded: {api_key[:10]}...")
+    logger.info("✅ Gemini API Key loaded: %s...", api_key[:10])
 
-genai.configure(api_key=api_key)
-model = genai.GenerativeModel("gemini-2.0-flash-exp")
-print("✅ Gemini model initialized: gemini-2.0-flash-exp")
-print("="*60)
+def init_gemini():
+    """Configure the Gemini client (google.generativeai takes ~1s to import)"""
+    import google.generativeai as genai
+    # GEMINI_API_ENDPOINT points the client at another server (e.g. a local fake for load tests)
+    api_endpoint = os.getenv("GEMINI_API_ENDPOINT")
+    if api_endpoint:
+        genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": api_endpoint})
+        logger.warning("⚠️  Using Gemini endpoint: %s", api_endpoint)
+    else:
+        genai.configure(api_key=api_key)
+    logger.info("✅ Gemini model initialized: %s", GEMINI_MODEL)
+    # Opens no connection until the first call, so it is safe to build before fork
+    return genai.GenerativeModel(GEMINI_MODEL)
+
+model = LazyService("gemini", init_gemini)
+# Every upstream call goes through this: deadlines, retries, hedging,
+# a concurrency cap and a circuit breaker (MODEL_* / BREAKER_* variables)
+model_client = create_model_client()
+# Slots for those calls are handed out by traffic class and per user, so
+# camera frames can't starve chat (SCHED_* variables)
+model_scheduler = create_model_scheduler()
+# Sent when the breaker is open instead of waiting on a failing upstream
+CAMERA_FALLBACK_REPLY = "Sorry, I had trouble processing that. Try again!"
+
+# ============================================
+# CAMERA FRAME PIPELINE
+# ============================================
+# Frames are downscaled and re-encoded before reaching Gemini Vision, and
+# near-identical consecutive frames from one user reuse the previous reply
+frame_processor = create_frame_processor()
+frame_dedup = create_frame_deduplicator()
+def init_emotion_detector():
+    # NumPy / onnxruntime are only imported when detection is first needed
+    from utils.emotion_detector import create_emotion_detector
+    return create_emotion_detector()
+
+def init_emotion_batcher():
+    if frame_executor.get() is not None or not emotion_detector.available:
+        return None
+    return create_emotion_batcher(emotion_detector.get())
+
+# Server-side emotion detection (models loaded once per process); when no
+# classifier is configured the emotion reported by the client is used
+emotion_detector = LazyService("emotion_detector", init_emotion_detector)
+# With FRAME_WORKERS > 0, decode, resize and inference move to a process
+# pool so camera throughput scales with cores instead of the GIL; get()
+# returns None when disabled
+frame_executor = LazyService("frame_executor", create_frame_executor)
+# Otherwise frames from concurrent requests are stacked into one inference batch
+emotion_batcher = LazyService("emotion_batcher", init_emotion_batcher)
+# Longest a request waits for its emotion result before using the client's
+EMOTION_TIMEOUT = float(os.getenv('EMOTION_TIMEOUT', 1.0))
+
+# ============================================
+# RESPONSE CACHE
+# ============================================
+# Replies for deterministic prompts (first-turn chat messages, identical
+# camera prompt + frame hash); enable per endpoint with RESPONSE_CACHE_ENDPOINTS
+response_cache = create_response_cache()
+
+# ============================================
+# AVATAR / SPEECH
+# ============================================
+# Lip-sync timelines are generated at the TTS speech rate; repeated replies
+# are served from the generator's cache. Speech is synthesized offline and
+# cached on disk per sentence (TTS_* environment variables)
+avatar_generator = AvatarGenerator()
+speech_handler = LazyService("speech", create_speech_handler)
+
+def init_avatar_engine():
+    from utils.avatar_state import create_avatar_engine
+    return create_avatar_engine(avatar_generator)
+
+# Per-user avatar state for /ws/avatar clients, evaluated on a fixed tick
+# (AVATAR_* variables); built when the first avatar connects
+avatar_engine = LazyService("avatar_engine", init_avatar_engine)
+
+def avatar_speech(uid, rate=None):
+    """
+    Drive the user's live avatar through a reply (see AvatarSpeech)
+    
+    A no-op unless the user has /ws/avatar open in this process, so the
+    lip-sync timeline is only built for avatars someone is watching.
+    """
+    engine = avatar_engine.peek()
+    return engine.speech(uid, rate or 1.0) if engine else AvatarSpeech(None, uid)
+
+def avatar_emotion(uid, emotion):
+    """Show the emotion detected on a camera frame on the user's live avatar"""
+    engine = avatar_engine.peek()
+    if engine:
+        engine.set_emotion(uid, emotion)
+
+# ============================================
+# RATE LIMITING
+# ============================================
+# Token bucket per Firebase uid, separate for chat and camera; in memory by
+# default, the SQLite backend shares counters between workers (RATE_LIMIT_* variables)
+rate_limiter = LazyService("rate_limiter", create_rate_limiter)
 
 # ============================================
 # SESSION STORAGE
 # ============================================
-chat_sessions = {}
+# Bounded LRU + idle-TTL store; tune with SESSION_* environment variables
+chat_sessions = create_session_store()
+# Shared, persistent turn history so every worker can rebuild a user's chat
+history_store = LazyService("history", create_history_store)
+
+def init_turn_exporter():
+    # pyarrow is only imported when export is switched on
+    from utils.conversation_export import create_turn_exporter
+    return create_turn_exporter()
+
+# Finished turns are appended to columnar segments for offline analytics
+# (EXPORT_DIR); get() returns None when export is off
+turn_exporter = LazyService("conversation_export", init_turn_exporter)
+
+def export_turn(uid, kind, user_text, reply, **details):
+    """Queue a finished turn for export (latency, emotion, cached); never blocks"""
+    exporter = turn_exporter.get()
+    if exporter:
+        exporter.record(uid, kind, user_text, reply, **details)
+
+def export_clear(uid):
+    """Record a history clear in the export, so an import doesn't bring the turns back"""
+    exporter = turn_exporter.get()
+    if exporter:
+        exporter.record_clear(uid)
+
+def summarize_history(transcript):
+    """Condense older conversation turns into a short running summary"""
+    with model_scheduler.admit("summary", None):
+        response = model_client.call(
+            model.generate_content,
+            "Summarize this conversation between a user and an AI assistant in a short "
+            "paragraph. Keep names, facts, preferences and open questions the assistant "
+            "will need later.\n\n" + transcript,
+            hedge=True,
+            hedge_slot=lambda: model_scheduler.try_admit("summary", None),
+            label="summary"
+        )
+    return response.text.strip()
+
+# Keeps per-turn history bounded: recent turns verbatim, older turns folded
+# into a summary in the background (CONTEXT_* environment variables). The
+# summary is saved in the history store, so rebuilt sessions start from it
+context_manager = create_context_manager(summarize_history, history_store)
+
+def get_chat_session(session_id):
+    """
+    Get the user's chat session, rebuilding it from the shared history store
+    when this worker has no session yet or another worker has advanced it,
+    and bring its history within the context window budget
+    """
+    version = history_store.version(session_id)
+    chat = chat_sessions.get(session_id)
+    if chat is not None and getattr(chat, 'history_version', 0) != version:
+        chat_sessions.delete(session_id)
+
+    def new_session():
+        logger.debug("✨ Building chat session", extra={"uid": session_id, "history_version": version})
+        session = model.start_chat(history=context_manager.load_history(session_id))
+        session.history_version = version
+        return session
+
+    chat = chat_sessions.get_or_create(session_id, new_session)
+    context_manager.prepare(session_id, chat)
+    return chat
+
+def sse_event(event, payload):
+    """Format one Server-Sent Event frame"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def first_turn_cache_key(chat, user_msg):
+    """Response cache key for a chat message, or None unless it opens a conversation"""
+    if not response_cache.enabled("chat") or chat.history:
+        return None
+    return cache_key(normalize_prompt(user_msg))
+
+def save_turn(chat, session_id, user_msg, bot_reply, cached=False, latency=None, kind="chat"):
+    """
+    Record a finished turn in the shared history and the session store
+    Args:
+        cached: The reply came from the response cache, so the in-memory
+            chat history has not seen this turn yet
+        latency: Seconds the model took, for the conversation export
+        kind: "chat" or "speech", for the conversation export
+    """
+    if cached:
+        chat.history = list(chat.history) + [
+            {"role": "user", "parts": [user_msg]},
+            {"role": "model", "parts": [bot_reply]}
+        ]
+    chat.history_version = history_store.append_turn(session_id, user_msg, bot_reply)
+    chat_sessions.record_turn(session_id)
+    context_manager.after_turn(session_id, chat)
+    export_turn(session_id, kind, user_msg, bot_reply, latency=latency, cached=cached)
+
+def number_field(data, key, default=1.0):
+    """
+    Read a numeric field from a request body
+    Raises:
+        ValueError: The value is not a finite number (reported as a 400)
+    """
+    try:
+        value = float(data.get(key, default))
+    except (TypeError, ValueError):
+        value = math.nan
+    if not math.isfinite(value):
+        raise ValueError(f"'{key}' must be a number")
+    return value
+
+def lip_sync_rate(data):
+    """
+    Speech rate for lip-sync data, if the client asked for it
+    Args:
+        data: Request JSON ("lipsync": true, optional "rate")
+    Returns:
+        float: Rate clamped to the TTS bounds, or None when not requested
+    Raises:
+        ValueError: "rate" is not a number
+    """
+    if not data.get("lipsync"):
+        return None
+    return clamp_rate(number_field(data, "rate"))
+
+def pump_chat_stream(chat, session_id, user_msg, lip_sync, events, cancelled):
+    """
+    Read a streamed Gemini reply into a queue while holding a scheduler slot
+
+    Runs on its own thread, so the slot goes back as soon as the upstream
+    stream ends however slowly the SSE client reads; the reply is buffered
+    in `events` meanwhile. Puts ("chunk", text) per fragment, then
+    ("done", latency) or ("error", exception).
+    """
+    try:
+        with avatar_speech(session_id, lip_sync) as speech, model_scheduler.admit("chat", session_id):
+            start = time.perf_counter()
+            # The deadline covers the request up to the first chunk
+            response = model_client.call(chat.send_message, user_msg, stream=True, stateful=True, label="chat")
+            for chunk in response:
+                if cancelled.is_set():
+                    # The client went away: stop reading upstream
+                    return
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunk carried no text (e.g. safety metadata only)
+                    continue
+                if text:
+                    events.put(("chunk", text))
+                    speech.feed(text)
+        events.put(("done", time.perf_counter() - start))
+    except Exception as e:
+        events.put(("error", e))
+
+def stream_chat_reply(chat, session_id, user_msg, reply_cache_key=None, lip_sync=None):
+    """
+    Stream a Gemini reply as Server-Sent Events
+
+    Yields a 'chunk' event per generated text fragment, then a 'done' event
+    with the full reply once the turn has been saved to the session history.
+    With a lip_sync rate, 'lipsync' events carry the timeline for the words
+    completed so far, so the avatar can start talking before the reply ends.
+    The upstream call runs on pump_chat_stream's thread.
+    """
+    parts = []
+    lip_stream = avatar_generator.lip_sync_stream(lip_sync) if lip_sync else None
+    events = queue.Queue()
+    cancelled = threading.Event()
+    saved = False
+    threading.Thread(
+        target=pump_chat_stream, args=(chat, session_id, user_msg, lip_sync, events, cancelled),
+        name="chat-stream", daemon=True
+    ).start()
+    try:
+        while True:
+            kind, value = events.get()
+            if kind == "error":
+                raise value
+            if kind == "done":
+                latency = value
+                break
+            parts.append(value)
+            yield sse_event("chunk", {"text": value})
+            segment = lip_stream.feed(value) if lip_stream else None
+            if segment:
+                yield sse_event("lipsync", segment)
+
+        segment = lip_stream.finish() if lip_stream else None
+        if segment:
+            yield sse_event("lipsync", segment)
+
+        MODEL_LATENCY.observe(latency, call="chat")
+        bot_reply = "".join(parts) or "No reply"
+        save_turn(chat, session_id, user_msg, bot_reply, latency=latency)
+        saved = True
+        if reply_cache_key:
+            response_cache.put("chat", reply_cache_key, bot_reply)
+        logger.info("✅ Streamed reply", extra={"uid": session_id, "chars": len(bot_reply)})
+        yield sse_event("done", {"reply": bot_reply, "session_id": session_id})
+
+    except Exception as e:
+        logger.error("❌ Chat stream error: %s", e, extra={"uid": session_id})
+        # Headers (200) were sent long ago; count the failure separately
+        HTTP_ERRORS.inc(route="/api/chat", status="stream")
+        yield sse_event("error", {"error": f"Error: {str(e)}"})
+    finally:
+        cancelled.set()
+        if not saved:
+            # A broken or abandoned stream (client gone: GeneratorExit) leaves
+            # a partial model turn in the in-memory session that the history
+            # store never saw; drop it so the next request rebuilds it
+            chat_sessions.delete(session_id)
+
+def decode_frame(frame_data):
+    """
+    Decode and preprocess a camera frame
+    Args:
+        frame_data: "data:image/jpeg;base64,..." / bare base64 string (JSON path),
+            or raw image bytes / binary file object (binary upload path)
+    Returns:
+        ProcessedFrame: Resized, re-encoded frame with its perceptual hash
+    """
+    executor = frame_executor.get()
+    with IMAGE_DECODE_LATENCY.time(path="worker" if executor is not None else "inline"):
+        if not isinstance(frame_data, str):
+            if executor is not None:
+                if not isinstance(frame_data, (bytes, bytearray, memoryview)):
+                    frame_data = frame_data.read()
+                return executor.process(frame_data)
+            # Raw upload: PIL decodes lazily straight from the buffer. BytesIO
+            # shares a bytes object's buffer until written; a memoryview would be copied
+            if isinstance(frame_data, (bytes, bytearray, memoryview)):
+                frame_data = io.BytesIO(frame_data)
+            return frame_processor.process(frame_data)
+
+        if "," in frame_data:
+            header, encoded = frame_data.split(",", 1)
+        else:
+            encoded = frame_data
+
+        if executor is not None:
+            # Base64 decoding happens in the worker too
+            return executor.process(encoded.encode('ascii'), is_base64=True)
+        image_bytes = base64.b64decode(encoded)
+        return frame_processor.process(image_bytes)
+
+def resolve_emotion(frame, client_emotion):
+    """
+    Pick the emotion used in the camera prompt
+    Returns:
+        tuple: (emotion, source) - server detection when a face is found,
+            otherwise the emotion reported by the client
+    """
+    batcher = emotion_batcher.get() if frame.analysis is None else None
+    if frame.analysis is not None:
+        # Already detected by the frame worker that decoded this frame
+        if frame.analysis['face_detected']:
+            return frame.analysis['emotion'], "server"
+    elif batcher is not None:
+        future = None
+        try:
+            future = batcher.submit(frame.image)
+            result = future.result(timeout=EMOTION_TIMEOUT)
+            if result['face_detected']:
+                return result['emotion'], "server"
+        except QueueFullError:
+            logger.warning("⚠️  Emotion queue full - using client emotion")
+        except Exception as e:
+            if future is not None:
+                future.cancel()
+            logger.warning("⚠️  Emotion detection failed: %s", str(e) or type(e).__name__)
+    return client_emotion, "client"
+
+def frame_metadata(headers, fallback=None):
+    """
+    Read emotion/message metadata for a binary frame upload
+    Args:
+        headers: Request headers (X-Emotion, X-Message; values URL-encoded)
+        fallback: Optional mapping (form fields or query args) checked first
+    Returns:
+        tuple: (emotion, message)
+    """
+    fallback = fallback or {}
+    emotion = fallback.get("emotion") or unquote(headers.get("X-Emotion", "")) or "neutral"
+    message = fallback.get("message") or unquote(headers.get("X-Message", ""))
+    return emotion, message
+
+def read_camera_request():
+    """
+    Extract the frame and its metadata from a /api/camera request
+    
+    Accepts JSON ({"frame": base64, ...}), multipart/form-data (a "frame"
+    file plus form fields) or a raw image body (application/octet-stream
+    or image/*) with metadata in X-Emotion / X-Message headers.
+    
+    Returns:
+        tuple: (frame_data, emotion, message); frame_data is empty if missing
+    """
+    if request.mimetype == "multipart/form-data":
+        with PARSE_LATENCY.time(route="/api/camera", format="multipart"):
+            upload = request.files.get("frame")
+            emotion, message = frame_metadata(request.headers, request.form)
+        return (upload.stream if upload else None), emotion, message
+    
+    if request.mimetype == "application/octet-stream" or request.mimetype.startswith("image/"):
+        with PARSE_LATENCY.time(route="/api/camera", format="binary"):
+            emotion, message = frame_metadata(request.headers, request.args)
+            frame_data = request.get_data(cache=False)
+        return frame_data, emotion, message
+    
+    with PARSE_LATENCY.time(route="/api/camera", format="json"):
+        data = request.json or {}
+    return data.get("frame", ""), data.get("emotion", "neutral"), data.get("message", "")
+
+def frame_part(frame):
+    """Wrap a processed frame as an inline image part for Gemini"""
+    return {"mime_type": frame.mime_type, "data": frame.data}
+
+def build_camera_prompt(current_user, emotion, user_message):
+    """Build the personalized vision prompt for a camera frame"""
+    user_name = current_user.get('name', current_user['email'].split('@')[0])
+    return f"""You are a friendly AI assistant talking to {user_name}.
+
+The user's current emotion appears to be: {emotion}
+User says: {user_message if user_message else "Just showing the camera"}
+
+Respond warmly and empathetically in 1-2 sentences. Be supportive and engaging."""
+
+def find_camera_reply(current_user, frame, prompt, context):
+    """
+    Look for a reply that can be reused without calling the model:
+    the user's previous near-identical frame, then the shared response cache
+    Returns:
+        str: Reusable reply, or None
+    """
+    # Reuse the last reply for a near-identical frame with the same context
+    bot_reply = frame_dedup.lookup(current_user['uid'], frame.phash, context)
+    if bot_reply is not None:
+        logger.debug("♻️  Near-identical frame - reusing previous reply")
+        return bot_reply
+    
+    bot_reply = response_cache.get("camera", cache_key(normalize_prompt(prompt), frame.phash))
+    if bot_reply is not None:
+        logger.debug("⚡ Serving cached camera reply")
+        frame_dedup.remember(current_user['uid'], frame.phash, context, bot_reply)
+    return bot_reply
+
+def save_camera_reply(current_user, frame, prompt, context, bot_reply):
+    """Remember a fresh camera reply for dedupe and the response cache"""
+    frame_dedup.remember(current_user['uid'], frame.phash, context, bot_reply)
+    response_cache.put("camera", cache_key(normalize_prompt(prompt), frame.phash), bot_reply)
+
+def coalesced_camera_reply(current_user, retry_after):
+    """
+    Cheap answer for a frame over the user's rate limit: their last reply,
+    without decoding the frame or calling the model
+    """
+    return {
+        "reply": frame_dedup.last_reply(current_user['uid']) or "",
+        "user": current_user['email'],
+        "coalesced": True,
+        "retry_after": round(retry_after, 2)
+    }
+
+def camera_reply(current_user, frame, emotion, user_message):
+    """
+    Get Gemini Vision's reply for a preprocessed camera frame
+    Args:
+        current_user: User info from Firebase token
+        frame: ProcessedFrame from decode_frame()
+        emotion: Emotion reported for the frame
+        user_message: What the user said (may be empty)
+    Returns:
+        tuple: (reply text, whether a previous/cached reply was reused)
+    """
+    # Create personalized prompt
+    prompt = build_camera_prompt(current_user, emotion, user_message)
+    context = (emotion, user_message)
+    avatar_emotion(current_user['uid'], emotion)
+    
+    bot_reply = find_camera_reply(current_user, frame, prompt, context)
+    if bot_reply is not None:
+        return bot_reply, True
+    
+    try:
+        with model_scheduler.admit("camera", current_user['uid']):
+            # A hedged duplicate needs a second slot of its own
+            response = model_client.call(
+                model.generate_content, [prompt, frame_part(frame)], hedge=True,
+                hedge_slot=lambda: model_scheduler.try_admit("camera", current_user['uid']), label="camera"
+            )
+    except StaleRequestError:
+        # The frame waited too long for a slot; a late answer is worse than the last one
+        return frame_dedup.last_reply(current_user['uid']) or CAMERA_FALLBACK_REPLY, True
+    except ModelUnavailableError as e:
+        logger.warning("⚠️  %s - sending canned reply", e)
+        return CAMERA_FALLBACK_REPLY, False
+    bot_reply = response.text if response and response.text else "I can see you! How can I help?"
+    save_camera_reply(current_user, frame, prompt, context, bot_reply)
+    with avatar_speech(current_user['uid']) as speech:
+        speech.feed(bot_reply)
+    return bot_reply, False
+
+# ============================================
+# REQUEST METRICS
+# ============================================
+def record_request(route, status, elapsed):
+    """Count one finished request and its latency (Flask and ASGI paths)"""
+    HTTP_REQUESTS.inc(route=route, status=status)
+    HTTP_LATENCY.observe(elapsed, route=route)
+    if status >= 400:
+        HTTP_ERRORS.inc(route=route, status=status)
+
+@api.before_app_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@api.after_app_request
+def observe_request(response):
+    if "request_start" in g:
+        # Route templates keep label cardinality bounded
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        record_request(route, response.status_code, time.perf_counter() - g.request_start)
+    return response
+
+def cache_metrics():
+    """Hit/miss counters read from each cache's own stats at scrape time"""
+    caches = {
+        "token": get_token_cache_stats(),
+        "chat_session": chat_sessions.stats(),
+        "frame_dedup": {"hits": frame_dedup.stats["reused"], "misses": frame_dedup.stats["fresh"]}
+    }
+    for namespace, counters in response_cache.stats()["namespaces"].items():
+        caches[f"response_{namespace}"] = counters
+    handler = speech_handler.peek()
+    if handler and handler.cache:
+        caches["tts"] = handler.cache.stats
+    directory = user_directory.peek()
+    if directory:
+        caches["user_directory"] = directory.stats
+    return hit_miss_counters("talkbot_cache", "Cache", caches)
+
+ACTIVE_SESSIONS.set_function(lambda: len(chat_sessions), kind="chat")
+REGISTRY.register_collector(cache_metrics)
 
 # ============================================
 # ROUTES - PAGES
 # ============================================
-@app.route("/")
+@api.route("/")
 def home():
     """Home page"""
     return render_template("index.html")
 
-@app.route("/about")
+@api.route("/about")
 def about():
     """About page"""
     return render_template("about.html")
 
-@app.route("/future")
+@api.route("/future")
 def future():
     """Future/Roadmap page"""
     return render_template("future.html")
 
-@app.route("/contact")
+@api.route("/contact")
 def contact():
     """Contact page"""
     return render_template("contact.html")
 
-@app.route("/chat")
+@api.route("/chat")
 def chat_page():
     """Chat page - protected (frontend checks auth)"""
     return render_template("chat.html")
 
-@app.route("/camera")
+@api.route("/camera")
 def camera_page():
     """Camera page - protected (frontend checks auth)"""
     return render_template("camera.html")
@@ -89,186 +652,445 @@ def camera_page():
 # ============================================
 # API - CHAT (PROTECTED)
 # ============================================
-@app.route("/api/chat", methods=["POST"])
+@api.route("/api/chat", methods=["POST"])
 @require_auth
 def chat_api(current_user):
     """
     Chat API endpoint - protected with Firebase auth
+    Pass ?stream=1 (or "stream": true) to receive the reply as Server-Sent Events
     
     Args:
         current_user (dict): User info from Firebase token (injected by @require_auth)
     """
     try:
-        print("\n" + "="*60)
-        print("📨 CHAT REQUEST RECEIVED")
-        print("="*60)
-        print(f"👤 User: {current_user['email']}")
-        print(f"🔑 UID: {current_user['uid']}")
-        
-        data = request.json
+        with PARSE_LATENCY.time(route="/api/chat", format="json"):
+            data = request.get_json(silent=True)
         if not data:
-            print("❌ No data provided")
+            logger.info("❌ No data provided", extra={"uid": current_user['uid']})
             return jsonify({"error": "No data provided"}), 400
         
         user_msg = data.get("message", "").strip()
         # Use user's UID as session ID for personalized conversations
         session_id = current_user['uid']
         
-        print(f"💬 Message: {user_msg[:100]}{'...' if len(user_msg) > 100 else ''}")
-        print(f"📦 Session ID: {session_id}")
+        logger.info("📨 Chat request", extra={"uid": session_id, "chars": len(user_msg)})
+        logger.debug("💬 Message: %.100s", user_msg)
         
         if not user_msg:
-            print("❌ Empty message")
+            logger.info("❌ Empty message", extra={"uid": session_id})
             return jsonify({"error": "Message cannot be empty"}), 400
+        
+        try:
+            lip_sync = lip_sync_rate(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        retry_after = rate_limiter.check("chat", session_id)
+        if retry_after:
+            logger.info("⏳ Rate limited", extra={"uid": session_id, "retry_after": round(retry_after, 1)})
+            return jsonify({"error": "Too many requests", "retry_after": round(retry_after, 2)}), \
+                429, {"Retry-After": str(math.ceil(retry_after))}
 
-        # Get or create chat session for this user
-        if session_id not in chat_sessions:
-            print(f"✨ Creating new chat session for: {current_user['email']}")
-            chat_sessions[session_id] = model.start_chat(history=[])
+        # Get or rebuild chat session for this user
+        chat = get_chat_session(session_id)
+        stream = request.args.get("stream") == "1" or data.get("stream")
+        
+        # Opening messages ("hi", "hello") are served from the response cache
+        reply_cache_key = first_turn_cache_key(chat, user_msg)
+        cached_reply = response_cache.get("chat", reply_cache_key) if reply_cache_key else None
+        if cached_reply is not None:
+            logger.debug("⚡ Serving cached reply")
+            save_turn(chat, session_id, user_msg, cached_reply, cached=True)
+            with avatar_speech(session_id, lip_sync) as speech:
+                speech.feed(cached_reply)
+            if stream:
+                events = [sse_event("chunk", {"text": cached_reply})]
+                if lip_sync:
+                    events.append(sse_event("lipsync", avatar_generator.get_lip_sync_data(cached_reply, lip_sync)))
+                events.append(sse_event("done", {"reply": cached_reply, "session_id": session_id}))
+                return Response(events, mimetype="text/event-stream",
+                                headers={"Cache-Control": "no-cache"})
+            payload = {
+                "reply": cached_reply,
+                "session_id": session_id,
+                "user": current_user['email'],
+                "cached": True
+            }
+            if lip_sync:
+                payload["lip_sync"] = avatar_generator.get_lip_sync_data(cached_reply, lip_sync)
+            return jsonify(payload)
         
-        chat = chat_sessions[session_id]
+        # Streaming mode: send tokens as Server-Sent Events while generating
+        if stream:
+            return Response(
+                stream_with_context(stream_chat_reply(chat, session_id, user_msg, reply_cache_key, lip_sync)),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
         
         # Send message to Gemini
-        print("🤖 Sending to Gemini AI...")
-        response = chat.send_message(user_msg)
-        bot_reply = response.text if response and response.text else "No reply"
+        with avatar_speech(session_id, lip_sync) as speech:
+            with model_scheduler.admit("chat", session_id):
+                start = time.perf_counter()
+                response = model_client.call(chat.send_message, user_msg, stateful=True, label="chat")
+            bot_reply = response.text if response and response.text else "No reply"
+            speech.feed(bot_reply)
+        save_turn(chat, session_id, user_msg, bot_reply, latency=time.perf_counter() - start)
+        if reply_cache_key:
+            response_cache.put("chat", reply_cache_key, bot_reply)
         
-        print(f"✅ Bot reply length: {len(bot_reply)} characters")
-        print(f"💬 Preview: {bot_reply[:100]}{'...' if len(bot_reply) > 100 else ''}")
-        print("="*60 + "\n")
+        logger.info("✅ Bot reply", extra={"uid": session_id, "chars": len(bot_reply)})
+        logger.debug("💬 Preview: %.100s", bot_reply)
         
-        return jsonify({
+        payload = {
             "reply": bot_reply,
             "session_id": session_id,
             "user": current_user['email']
-        })
+        }
+        if lip_sync:
+            payload["lip_sync"] = avatar_generator.get_lip_sync_data(bot_reply, lip_sync)
+        return jsonify(payload)
+    
+    except ModelUnavailableError as e:
+        logger.warning("⚠️  Chat unavailable: %s", e)
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
     
     except Exception as e:
-        print(f"❌ CHAT ERROR: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        print("="*60 + "\n")
+        logger.exception("❌ Chat error: %s", e)
+        if isinstance(e, ModelTimeoutError):
+            # A late reply may still land in the in-memory session; rebuild it from history
+            chat_sessions.delete(current_user['uid'])
         return jsonify({"error": f"Error: {str(e)}"}), 500
 
 # ============================================
 # API - CAMERA (PROTECTED)
 # ============================================
-@app.route("/api/camera", methods=["POST"])
+@api.route("/api/camera", methods=["POST"])
 @require_auth
 def camera_api(current_user):
     """
     Camera API endpoint - protected with Firebase auth
     Handles image/video analysis with emotion detection
+    Frames may be sent as base64 JSON, multipart/form-data or raw image bytes
     
     Args:
         current_user (dict): User info from Firebase token
     """
     try:
-        print("\n" + "="*60)
-        print("📷 CAMERA REQUEST RECEIVED")
-        print("="*60)
-        print(f"👤 User: {current_user['email']}")
-        print(f"🔑 UID: {current_user['uid']}")
-        
-        data = request.json
-        frame_data = data.get("frame", "")
-        emotion = data.get("emotion", "neutral")
-        user_message = data.get("message", "")
+        uid = current_user['uid']
+        retry_after = rate_limiter.check("camera", uid)
+        if retry_after:
+            logger.debug("⏳ Over frame rate limit - coalescing", extra={"uid": uid})
+            return jsonify(coalesced_camera_reply(current_user, retry_after))
         
-        print(f"😊 Detected Emotion: {emotion}")
-        print(f"💬 User Message: {user_message[:50]}{'...' if len(user_message) > 50 else ''}")
+        frame_data, emotion, user_message = read_camera_request()
+        logger.info("📷 Camera request", extra={"uid": uid, "client_emotion": emotion})
+        logger.debug("💬 User Message: %.50s", user_message)
         
         if not frame_data:
-            print("❌ No frame data provided")
+            logger.info("❌ No frame data provided", extra={"uid": uid})
             return jsonify({"error": "No frame data"}), 400
         
         # Decode image
         try:
-            if "," in frame_data:
-                header, encoded = frame_data.split(",", 1)
-            else:
-                encoded = frame_data
-            
-            image_bytes = base64.b64decode(encoded)
-            image = Image.open(io.BytesIO(image_bytes))
-            print(f"✅ Image decoded successfully: {image.size} pixels")
+            frame = decode_frame(frame_data)
+            logger.debug("✅ Image decoded: %s pixels, %d bytes", frame.size, len(frame.data))
             
         except Exception as img_error:
-            print(f"❌ Image decode error: {str(img_error)}")
+            logger.info("❌ Image decode error: %s", img_error, extra={"uid": uid})
             return jsonify({"error": "Invalid image format"}), 400
         
-        # Create personalized prompt
-        user_name = current_user.get('name', current_user['email'].split('@')[0])
-        prompt = f"""You are a friendly AI assistant talking to {user_name}.
-
-The user's current emotion appears to be: {emotion}
-User says: {user_message if user_message else "Just showing the camera"}
-
-Respond warmly and empathetically in 1-2 sentences. Be supportive and engaging."""
-
-        print("🤖 Sending to Gemini Vision AI...")
+        emotion, emotion_source = resolve_emotion(frame, emotion)
         
-        # Send to Gemini with image
-        response = model.generate_content([prompt, image])
-        bot_reply = response.text if response and response.text else "I can see you! How can I help?"
+        start = time.perf_counter()
+        bot_reply, reused = camera_reply(current_user, frame, emotion, user_message)
+        export_turn(uid, "camera", user_message, bot_reply,
+                    latency=time.perf_counter() - start, emotion=emotion, cached=reused)
         
-        print(f"✅ AI Reply: {bot_reply[:100]}{'...' if len(bot_reply) > 100 else ''}")
-        print("="*60 + "\n")
+        logger.info("✅ Camera reply", extra={
+            "uid": uid, "emotion": emotion, "emotion_source": emotion_source, "reused": reused
+        })
+        logger.debug("💬 Preview: %.100s", bot_reply)
         
         return jsonify({
             "reply": bot_reply,
             "emotion": emotion,
-            "user": current_user['email']
+            "user": current_user['email'],
+            "reused": reused,
+            "emotion_source": emotion_source
         })
     
     except Exception as e:
-        print(f"❌ CAMERA ERROR: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        print("="*60 + "\n")
+        logger.exception("❌ Camera error: %s", e)
         return jsonify({
             "error": str(e),
-            "reply": "Sorry, I had trouble processing that. Try again!"
+            "reply": CAMERA_FALLBACK_REPLY
         }), 500
 
+# ============================================
+# WEBSOCKET - LIVE CAMERA SESSION (PROTECTED)
+# ============================================
+def analyze_live_frame(current_user, frame_bytes, emotion, user_message):
+    """Analyze one binary frame received on a live camera session"""
+    retry_after = rate_limiter.check("camera", current_user['uid'])
+    if retry_after:
+        return coalesced_camera_reply(current_user, retry_after)
+    frame = decode_frame(frame_bytes)
+    emotion, emotion_source = resolve_emotion(frame, emotion)
+    start = time.perf_counter()
+    bot_reply, reused = camera_reply(current_user, frame, emotion, user_message)
+    export_turn(current_user['uid'], "camera", user_message, bot_reply,
+                latency=time.perf_counter() - start, emotion=emotion, cached=reused)
+    return {"reply": bot_reply, "emotion": emotion, "reused": reused, "emotion_source": emotion_source}
+
+def authenticate_ws(ws):
+    """
+    Wait for a WebSocket's {"type": "auth", "token": ...} event
+    Returns:
+        tuple: (user dict or None, auth event dict); an error event has
+            already been sent when the user is None
+    """
+    try:
+        auth_event = json.loads(ws.receive(timeout=LIVE_AUTH_TIMEOUT) or "{}")
+    except (ValueError, TypeError):
+        auth_event = {}
+    if not isinstance(auth_event, dict):
+        auth_event = {}
+    
+    user = None
+    if auth_event.get("type") == "auth":
+        user = verify_firebase_token(str(auth_event.get("token", "")))
+    
+    if not user:
+        ws.send(json.dumps({"type": "error", "error": "Invalid or expired token"}))
+    return user, auth_event
+
+def camera_ws(ws):
+    """
+    Live camera session over WebSocket
+    
+    The first event must be {"type": "auth", "token": "<Firebase ID token>"}.
+    After that the client streams binary JPEG frames plus emotion/message
+    events, and replies are pushed back as they are generated (see
+    utils/live_session.py for the protocol).
+    """
+    user, _ = authenticate_ws(ws)
+    if not user:
+        return
+    
+    logger.info("📡 Live camera session opened", extra={"uid": user['uid']})
+    ws.send(json.dumps({"type": "ready", "user": user['email']}))
+    session = LiveCameraSession(ws, user, analyze_live_frame)
+    ACTIVE_SESSIONS.inc(kind="camera_ws")
+    try:
+        session.run()
+    finally:
+        ACTIVE_SESSIONS.dec(kind="camera_ws")
+    logger.info("📡 Live camera session closed", extra={"uid": user['uid'], **session.stats})
+
+# flask-sock's decorator returns None; registering this way keeps the handler
+# importable, so asgi.py can serve the same /ws/* routes
+sock.route("/ws/camera", bp=api)(camera_ws)
+
+# ============================================
+# WEBSOCKET - LIVE AVATAR STATE (PROTECTED)
+# ============================================
+def avatar_ws(ws):
+    """
+    Server-driven avatar over WebSocket
+    
+    The first event must be {"type": "auth", "token": "<Firebase ID token>"},
+    optionally with a "style". The 'ready' reply carries the field layout
+    and lookup tables; after that the avatar's emotion, style, speaking
+    state and mouth shape arrive as binary delta frames on the engine tick
+    (see utils/avatar_state.py and utils/live_session.py for the protocol).
+    """
+    user, auth_event = authenticate_ws(ws)
+    if not user:
+        return
+    
+    engine = avatar_engine.get()
+    logger.info("🧑 Avatar session opened", extra={"uid": user['uid']})
+    ws.send(json.dumps({"type": "ready", "user": user['email'], **engine.describe()}))
+    session = LiveAvatarSession(ws, user, engine, auth_event.get("style"))
+    ACTIVE_SESSIONS.inc(kind="avatar_ws")
+    try:
+        session.run()
+    finally:
+        ACTIVE_SESSIONS.dec(kind="avatar_ws")
+    logger.info("🧑 Avatar session closed", extra={"uid": user['uid'], **session.stats})
+
+sock.route("/ws/avatar", bp=api)(avatar_ws)
+
+# ============================================
+# WEBSOCKET - STREAMING SPEECH INPUT (PROTECTED)
+# ============================================
+def answer_utterance(current_user, text, send):
+    """Run a recognized utterance through the chat pipeline, streaming the reply"""
+    session_id = current_user['uid']
+    logger.info("🎙️  Utterance", extra={"uid": session_id, "chars": len(text)})
+    retry_after = rate_limiter.check("chat", session_id)
+    if retry_after:
+        send({"type": "error", "error": "Too many requests", "retry_after": round(retry_after, 2)})
+        return
+    chat = get_chat_session(session_id)
+    parts = []
+    try:
+        # Spoken messages are interactive: they share the chat class
+        with avatar_speech(session_id) as speech, model_scheduler.admit("chat", session_id):
+            start = time.perf_counter()
+            for chunk in model_client.call(chat.send_message, text, stream=True, stateful=True, label="speech"):
+                try:
+                    piece = chunk.text
+                except ValueError:
+                    continue
+                if piece:
+                    parts.append(piece)
+                    send({"type": "chunk", "text": piece})
+                    speech.feed(piece)
+    except Exception:
+        # Same recovery as a broken SSE stream: rebuild from history next time
+        chat_sessions.delete(session_id)
+        raise
+    latency = time.perf_counter() - start
+    MODEL_LATENCY.observe(latency, call="speech")
+    
+    bot_reply = "".join(parts) or "No reply"
+    save_turn(chat, session_id, text, bot_reply, latency=latency, kind="speech")
+    send({"type": "reply", "transcript": text, "reply": bot_reply})
+
+def speech_ws(ws):
+    """
+    Streaming speech input over WebSocket
+    
+    The first event must be {"type": "auth", "token": "<Firebase ID token>",
+    "sample_rate": 16000}. The client then streams 16-bit mono PCM chunks
+    and gets partial transcripts back; when voice activity detection closes
+    an utterance it is answered through the chat pipeline (see
+    utils/live_session.py for the protocol).
+    """
+    user, auth_event = authenticate_ws(ws)
+    if not user:
+        return
+    if not speech_handler.can_recognize:
+        ws.send(json.dumps({"type": "error", "error": "Speech recognition is not available"}))
+        return
+    
+    try:
+        sample_rate = int(auth_event.get("sample_rate", 16000))
+    except (TypeError, ValueError):
+        sample_rate = 16000
+    
+    logger.info("🎙️  Speech session opened", extra={"uid": user['uid'], "sample_rate": sample_rate})
+    ws.send(json.dumps({"type": "ready", "user": user['email'], "sample_rate": sample_rate}))
+    session = LiveSpeechSession(ws, user, speech_handler.speech_stream(sample_rate), answer_utterance)
+    ACTIVE_SESSIONS.inc(kind="speech_ws")
+    try:
+        session.run()
+    finally:
+        ACTIVE_SESSIONS.dec(kind="speech_ws")
+    logger.info("🎙️  Speech session closed", extra={"uid": user['uid'], **session.stats})
+
+sock.route("/ws/speech", bp=api)(speech_ws)
+
+# ============================================
+# API - TEXT TO SPEECH (PROTECTED)
+# ============================================
+@api.route("/api/tts", methods=["POST"])
+@require_auth
+def tts_api(current_user):
+    """
+    Synthesize speech for a reply, streamed sentence by sentence
+    
+    Body: {"text": ..., "language": "en-US", "rate": 1.0, "pitch": 1.0}
+    ?format=wav (default) streams a WAV file; ?format=pcm streams raw
+    16-bit little-endian samples described by the X-Sample-Rate/X-Channels
+    headers.
+    """
+    if not speech_handler.can_synthesize:
+        return jsonify({"error": "Speech synthesis is not available"}), 503
+    
+    with PARSE_LATENCY.time(route="/api/tts", format="json"):
+        data = request.json or {}
+    text = str(data.get("text", "")).strip()
+    if not text:
+        return jsonify({"error": "Text cannot be empty"}), 400
+    try:
+        rate, pitch = number_field(data, "rate"), number_field(data, "pitch")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        config = speech_handler.text_to_speech_config(
+            text,
+            language=data.get("language", "en-US"),
+            rate=rate,
+            pitch=pitch
+        )
+        (sample_rate, channels, sample_width), pcm = speech_handler.stream_speech(config)
+    except Exception as e:
+        logger.exception("❌ TTS error: %s", e)
+        return jsonify({"error": f"Error: {str(e)}"}), 500
+    
+    headers = {
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+        "X-Sample-Rate": str(sample_rate),
+        "X-Channels": str(channels)
+    }
+    if request.args.get("format") == "pcm":
+        return Response(pcm, mimetype="application/octet-stream", headers=headers)
+    
+    def wav_stream():
+        yield wav_stream_header(sample_rate, channels, sample_width)
+        yield from pcm
+    
+    return Response(wav_stream(), mimetype="audio/wav", headers=headers)
+
 # ============================================
 # API - USER PROFILE (PROTECTED)
 # ============================================
-@app.route("/api/user/profile", methods=["GET"])
+@api.route("/api/user/profile", methods=["GET"])
 @require_auth
 def get_profile(current_user):
     """Get current user profile with session info"""
+    # Token claims answer this without a Firebase call; a user record that is
+    # already cached (and newer than the token) reflects later profile edits
+    directory = user_directory.peek()
+    record = (directory.cached(current_user['uid']) if directory else None) or {}
     return jsonify({
         'uid': current_user['uid'],
-        'email': current_user['email'],
-        'name': current_user.get('name'),
-        'picture': current_user.get('picture'),
-        'email_verified': current_user.get('email_verified', False),
-        'has_active_session': current_user['uid'] in chat_sessions
+        'email': record.get('email') or current_user['email'],
+        'name': record.get('display_name') or current_user.get('name'),
+        'picture': record.get('photo_url') or current_user.get('picture'),
+        'email_verified': record.get('email_verified', current_user.get('email_verified', False)),
+        'has_active_session': current_user['uid'] in chat_sessions or history_store.exists(current_user['uid'])
     })
 
 # ============================================
 # API - CLEAR CHAT HISTORY (PROTECTED)
 # ============================================
-@app.route("/api/chat/clear", methods=["POST"])
+@api.route("/api/chat/clear", methods=["POST"])
 @require_auth
 def clear_chat(current_user):
     """Clear user's chat history"""
     try:
         session_id = current_user['uid']
-        if session_id in chat_sessions:
-            del chat_sessions[session_id]
-            print(f"🗑️  Cleared chat history for: {current_user['email']}")
+        had_session = chat_sessions.delete(session_id)
+        context_manager.forget(session_id)
+        export_clear(session_id)
+        if history_store.clear(session_id) or had_session:
+            logger.info("🗑️  Cleared chat history", extra={"uid": session_id})
             return jsonify({"message": "Chat history cleared successfully"})
         return jsonify({"message": "No chat history to clear"})
     except Exception as e:
-        print(f"❌ Error clearing chat: {str(e)}")
+        logger.exception("❌ Error clearing chat: %s", e)
         return jsonify({"error": str(e)}), 500
 
 # ============================================
 # API - PUBLIC INFO (OPTIONAL AUTH)
 # ============================================
-@app.route("/api/info", methods=["GET"])
+@api.route("/api/info", methods=["GET"])
 @optional_auth
 def public_info(current_user):
     """
@@ -279,7 +1101,7 @@ def public_info(current_user):
         return jsonify({
             'message': f'Hello {current_user["email"]}! You are authenticated.',
             'authenticated': True,
-            'has_chat_history': current_user['uid'] in chat_sessions,
+            'has_chat_history': history_store.exists(current_user['uid']),
             'total_active_sessions': len(chat_sessions)
         })
     else:
@@ -292,40 +1114,88 @@ def public_info(current_user):
 # ============================================
 # HEALTH CHECK
 # ============================================
-@app.route("/health")
+@api.route("/health")
 def health():
     """Health check endpoint"""
+    # Report lazily built services without building them
+    batcher, executor, handler = emotion_batcher.peek(), frame_executor.peek(), speech_handler.peek()
+    directory, exporter, avatar = user_directory.peek(), turn_exporter.peek(), avatar_engine.peek()
+    limiter = rate_limiter.peek()
     return jsonify({
         "status": "healthy",
         "services": {
             "flask": "running",
             "gemini": "configured" if api_key else "not configured",
-            "firebase_auth": "initialized" if firebase_initialized else "not initialized"
+            "firebase_auth": "initialized" if firebase_app.peek() else "not initialized"
         },
-        "model": "gemini-2.0-flash-exp",
-        "active_sessions": len(chat_sessions)
+        "model": GEMINI_MODEL,
+        "active_sessions": len(chat_sessions),
+        "session_store": chat_sessions.stats(),
+        "token_cache": get_token_cache_stats(),
+        "frame_dedup": dict(frame_dedup.stats),
+        "response_cache": response_cache.stats(),
+        "context_window": dict(context_manager.stats),
+        "emotion_batcher": batcher.stats() if batcher else None,
+        "frame_executor": dict(executor.stats, workers=executor.workers) if executor else None,
+        "tts_cache": dict(handler.cache.stats) if handler and handler.cache else None,
+        "model_client": model_client.snapshot(),
+        "rate_limiter": limiter.stats if limiter else None,
+        "user_directory": directory.snapshot() if directory else None,
+        "conversation_export": exporter.snapshot() if exporter else None,
+        "scheduler": model_scheduler.snapshot(),
+        "avatar_engine": avatar.snapshot() if avatar else None,
+        "lazy_services": service_status()
     })
 
+@api.route("/metrics")
+def metrics():
+    """Prometheus metrics for this process"""
+    return Response(REGISTRY.expose(), content_type=METRICS_CONTENT_TYPE)
+
 # ============================================
 # ERROR HANDLERS
 # ============================================
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def not_found(e):
     """Handle 404 errors"""
     return jsonify({"error": "Endpoint not found"}), 404
 
-@app.errorhandler(500)
+@api.app_errorhandler(500)
 def server_error(e):
     """Handle 500 errors"""
-    print(f"❌ Server error: {str(e)}")
-    import traceback
-    traceback.print_exc()
+    logger.error("❌ Server error: %s", e)
     return jsonify({"error": "Internal server error"}), 500
 
+# ============================================
+# APPLICATION FACTORY
+# ============================================
+def create_app():
+    """
+    Build the Flask application
+    
+    Cheap to call: Gemini, Firebase, the emotion/speech models and worker
+    pools are built on first use (utils/services.py). Call warm_services()
+    to build them ahead of traffic.
+    """
+    flask_app = Flask(__name__)
+    flask_app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-change-this')
+    CORS(flask_app)
+    flask_app.register_blueprint(api)
+    return flask_app
+
+# For `gunicorn app:app`, asgi.py and the dev server below
+app = create_app()
+
 # ============================================
 # RUN
 # ============================================
 if __name__ == "__main__":
+    # The dev server has no preload step; build everything before the banner
+    from utils.conversation_export import import_on_startup
+    import_on_startup()
+    warm_services()
+    firebase_initialized = firebase_app.get()
+    
     print("\n" + "="*60)
     print("🚀 TALKBOT SERVER STARTING")
     print("="*60)
@@ -333,7 +1203,7 @@ if __name__ == "__main__":
     print("   ✅ Flask: Running")
     print(f"   {'✅' if api_key else '❌'} Gemini AI: {'Configured' if api_key else 'NOT CONFIGURED'}")
     print(f"   {'✅' if firebase_initialized else '❌'} Firebase Auth: {'Initialized' if firebase_initialized else 'NOT INITIALIZED'}")
-    print(f"   ✅ Model: gemini-2.0-flash-exp")
+    print(f"   ✅ Model: {GEMINI_MODEL}")
     print("\n" + "="*60)
     print("🌐 AVAILABLE ENDPOINTS")
     print("="*60)
@@ -346,18 +1216,23 @@ if __name__ == "__main__":
     print("   • http://localhost:5000/chat")
     print("   • http://localhost:5000/camera")
     print("\n   🔐 PROTECTED API ENDPOINTS:")
-    print("   • POST   /api/chat          - Send chat message")
+    print("   • POST   /api/chat          - Send chat message (?stream=1 for SSE)")
     print("   • POST   /api/camera        - Analyze camera image")
     print("   • GET    /api/user/profile  - Get user profile")
     print("   • POST   /api/chat/clear    - Clear chat history")
+    print("   • WS     /ws/camera         - Live camera session")
+    print("   • WS     /ws/speech         - Streaming speech input")
+    print("   • POST   /api/tts           - Synthesize speech (streamed audio)")
     print("\n   🌍 PUBLIC API ENDPOINTS:")
     print("   • GET    /api/info          - Get service info")
     print("   • GET    /health            - Health check")
+    print("   • GET    /metrics           - Prometheus metrics")
     print("\n" + "="*60)
     print("💾 DATA STORAGE")
     print("="*60)
     print("   • User accounts: Firebase Authentication")
-    print("   • Chat sessions: In-memory (cleared on restart)")
+    print("   • Chat history: Shared store (SQLite or Redis)")
+    print("   • Chat sessions: In-memory cache rebuilt from history on demand")
     print("   • Active sessions: " + str(len(chat_sessions)))
     print("="*60)
     
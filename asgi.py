@@ -0,0 +1,478 @@
+"""
+TalkBot ASGI Server
+Async serving path for the model-bound API endpoints
+
+/api/chat and /api/camera run on the event loop with Gemini's async
+client, so an in-flight model call holds a coroutine instead of a worker
+thread. Every other route (pages, profile, health, SSE streaming) is
+passed through to the Flask app unchanged. The /ws/* WebSockets run the
+Flask app's handlers on a thread per connection, bridged to the ASGI
+connection (WsgiToAsgi only speaks HTTP).
+
+Run with:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from urllib.parse import parse_qsl
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from simple_websocket import ConnectionClosed
+
+from app import (
+    app, model, model_client, response_cache, get_chat_session, first_turn_cache_key, save_turn,
+    decode_frame, frame_metadata, frame_part, build_camera_prompt,
+    find_camera_reply, save_camera_reply, resolve_emotion,
+    avatar_generator, lip_sync_rate, chat_sessions, CAMERA_FALLBACK_REPLY,
+    rate_limiter, coalesced_camera_reply, record_request, export_turn,
+    model_scheduler, frame_dedup, avatar_speech, avatar_emotion,
+    camera_ws, avatar_ws, speech_ws
+)
+from utils.firebase_auth import authenticate_async
+from utils.model_client import ModelUnavailableError, ModelTimeoutError
+from utils.scheduler import StaleRequestError
+from utils.metrics import PARSE_LATENCY
+
+logger = logging.getLogger("talkbot.asgi")
+
+# Largest request body accepted on the async endpoints (camera frames)
+MAX_BODY_BYTES = int(os.getenv('ASGI_MAX_BODY_BYTES', 16 * 1024 * 1024))
+
+
+class ThreadedWsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs every WSGI request on one shared thread by default; a
+    # streamed (SSE) reply would hold it, and concurrent requests fail.
+    # Relies on asgiref internals: keep the version pinned in requirements.txt
+    # (tests/test_asgi.py drives the Flask fallback through this)
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False)
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    """WsgiToAsgi that serves each Flask request on its own pool thread"""
+
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+flask_app = ThreadedWsgiToAsgi(app)
+
+
+class AsyncRequest:
+    """Minimal request wrapper handed to the async handlers"""
+
+    def __init__(self, scope, body=None):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query_string = scope.get('query_string', b'').decode('latin-1')
+        self.headers = {
+            name.decode('latin-1').lower(): value.decode('latin-1')
+            for name, value in scope.get('headers', [])
+        }
+        self.body = body  # set once read, after authentication
+
+    def json(self):
+        """Parse the body as JSON (once), or None if empty/invalid"""
+        if not hasattr(self, '_json'):
+            try:
+                self._json = json.loads(self.body) if self.body else None
+            except ValueError:
+                self._json = None
+        return self._json
+
+    @property
+    def mimetype(self):
+        return self.headers.get('content-type', '').split(';')[0].strip().lower()
+
+    @property
+    def args(self):
+        return dict(parse_qsl(self.query_string))
+
+    def wants_stream(self, data):
+        """Whether the client asked for SSE streaming (served by Flask)"""
+        if 'stream=1' in self.query_string.split('&'):
+            return True
+        return isinstance(data, dict) and bool(data.get('stream'))
+
+
+# ============================================
+# ASYNC HANDLERS
+# ============================================
+async def chat_handler(request, current_user):
+    """Async /api/chat - same contract as the Flask view"""
+    try:
+        with PARSE_LATENCY.time(route="/api/chat", format="json"):
+            data = request.json()
+        if not data:
+            return {"error": "No data provided"}, 400
+
+        user_msg = data.get("message", "").strip()
+        session_id = current_user['uid']
+        if not user_msg:
+            return {"error": "Message cannot be empty"}, 400
+        try:
+            lip_sync = lip_sync_rate(data)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+        retry_after = await asyncio.to_thread(rate_limiter.check, "chat", session_id)
+        if retry_after:
+            return (
+                {"error": "Too many requests", "retry_after": round(retry_after, 2)},
+                429, {"Retry-After": str(math.ceil(retry_after))}
+            )
+
+        # History store access is blocking I/O - keep it off the loop
+        chat = await asyncio.to_thread(get_chat_session, session_id)
+
+        reply_cache_key = first_turn_cache_key(chat, user_msg)
+        bot_reply = response_cache.get("chat", reply_cache_key) if reply_cache_key else None
+        cached = bot_reply is not None
+
+        latency = None
+        with avatar_speech(session_id, lip_sync) as speech:
+            if not cached:
+                async with model_scheduler.admit_async("chat", session_id):
+                    start = time.perf_counter()
+                    response = await model_client.call_async(
+                        chat.send_message_async, user_msg, stateful=True, label="chat"
+                    )
+                    latency = time.perf_counter() - start
+                bot_reply = response.text if response and response.text else "No reply"
+                if reply_cache_key:
+                    response_cache.put("chat", reply_cache_key, bot_reply)
+            speech.feed(bot_reply)
+
+        await asyncio.to_thread(save_turn, chat, session_id, user_msg, bot_reply, cached, latency)
+
+        payload = {
+            "reply": bot_reply,
+            "session_id": session_id,
+            "user": current_user['email']
+        }
+        if cached:
+            payload["cached"] = True
+        if lip_sync:
+            payload["lip_sync"] = avatar_generator.get_lip_sync_data(bot_reply, lip_sync)
+        return payload, 200
+
+    except ModelUnavailableError as e:
+        logger.warning("⚠️  Async chat unavailable: %s", e)
+        return {"error": str(e)}, 503, {"Retry-After": "5"}
+
+    except Exception as e:
+        logger.exception("❌ Async chat error: %s", e)
+        if isinstance(e, ModelTimeoutError):
+            # A late reply may still land in the in-memory session; rebuild it from history
+            chat_sessions.delete(current_user['uid'])
+        return {"error": f"Error: {str(e)}"}, 500
+
+
+async def camera_handler(request, current_user):
+    """Async /api/camera - same contract as the Flask view"""
+    try:
+        retry_after = await asyncio.to_thread(rate_limiter.check, "camera", current_user['uid'])
+        if retry_after:
+            return coalesced_camera_reply(current_user, retry_after), 200
+
+        if request.mimetype == 'application/octet-stream' or request.mimetype.startswith('image/'):
+            # Raw image body, metadata in headers (lowercase keys in ASGI)
+            headers = {'X-Emotion': request.headers.get('x-emotion', ''),
+                       'X-Message': request.headers.get('x-message', '')}
+            emotion, user_message = frame_metadata(headers, request.args)
+            frame_data = request.body
+        else:
+            with PARSE_LATENCY.time(route="/api/camera", format="json"):
+                data = request.json() or {}
+            frame_data = data.get("frame", "")
+            emotion = data.get("emotion", "neutral")
+            user_message = data.get("message", "")
+
+        if not frame_data:
+            return {"error": "No frame data"}, 400
+
+        try:
+            frame = await asyncio.to_thread(decode_frame, frame_data)
+        except Exception as img_error:
+            logger.info("❌ Image decode error: %s", img_error)
+            return {"error": "Invalid image format"}, 400
+
+        emotion, emotion_source = await asyncio.to_thread(resolve_emotion, frame, emotion)
+        prompt = build_camera_prompt(current_user, emotion, user_message)
+        avatar_emotion(current_user['uid'], emotion)
+
+        context = (emotion, user_message)
+        start = time.perf_counter()
+        bot_reply = find_camera_reply(current_user, frame, prompt, context)
+        reused = bot_reply is not None
+
+        if not reused:
+            try:
+                async with model_scheduler.admit_async("camera", current_user['uid']):
+                    # A hedged duplicate needs a second slot of its own
+                    response = await model_client.call_async(
+                        model.generate_content_async, [prompt, frame_part(frame)], hedge=True,
+                        hedge_slot=lambda: model_scheduler.try_admit("camera", current_user['uid']), label="camera"
+                    )
+            except StaleRequestError:
+                response = None
+                bot_reply = frame_dedup.last_reply(current_user['uid']) or CAMERA_FALLBACK_REPLY
+                reused = True
+            except ModelUnavailableError as e:
+                logger.warning("⚠️  %s - sending canned reply", e)
+                response = None
+                bot_reply = CAMERA_FALLBACK_REPLY
+            if response is not None:
+                bot_reply = response.text if response.text else "I can see you! How can I help?"
+                save_camera_reply(current_user, frame, prompt, context, bot_reply)
+                with avatar_speech(current_user['uid']) as speech:
+                    speech.feed(bot_reply)
+        export_turn(current_user['uid'], "camera", user_message, bot_reply,
+                    latency=time.perf_counter() - start, emotion=emotion, cached=reused)
+
+        return {
+            "reply": bot_reply,
+            "emotion": emotion,
+            "user": current_user['email'],
+            "reused": reused,
+            "emotion_source": emotion_source
+        }, 200
+
+    except Exception as e:
+        logger.exception("❌ Async camera error: %s", e)
+        return {
+            "error": str(e),
+            "reply": CAMERA_FALLBACK_REPLY
+        }, 500
+
+
+# Handlers are called with the authenticated user and return
+# (payload, status) or (payload, status, headers), like a Flask view
+ASYNC_ROUTES = {
+    ('POST', '/api/chat'): chat_handler,
+    ('POST', '/api/camera'): camera_handler
+}
+
+
+# ============================================
+# WEBSOCKETS
+# ============================================
+WS_ROUTES = {
+    '/ws/camera': camera_ws,
+    '/ws/avatar': avatar_ws,
+    '/ws/speech': speech_ws
+}
+
+# Queued in place of a message once the client has gone
+_DISCONNECTED = object()
+
+
+class AsgiWebSocket:
+    """
+    The part of simple_websocket.Server the /ws/* handlers use, over an
+    ASGI connection; called from the handler's thread
+    """
+
+    def __init__(self, loop, send):
+        self._loop = loop
+        self._send = send
+        self._inbox = queue.Queue()
+        self.connected = True
+
+    def feed(self, message):
+        """Event loop side: hand over a received message (None: disconnected)"""
+        if message is None:
+            self.connected = False
+            self._inbox.put(_DISCONNECTED)
+        else:
+            self._inbox.put(message)
+
+    def receive(self, timeout=None):
+        """Next text (str) or binary (bytes) message, or None on timeout"""
+        try:
+            message = self._inbox.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if message is _DISCONNECTED:
+            self._inbox.put(_DISCONNECTED)
+            raise ConnectionClosed()
+        return message
+
+    def send(self, data):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            message = {'type': 'websocket.send', 'bytes': bytes(data)}
+        else:
+            message = {'type': 'websocket.send', 'text': data}
+        self._call(message)
+
+    def close(self, reason=1000, message=None):
+        if self.connected:
+            self._call({'type': 'websocket.close', 'code': int(reason)})
+            self.connected = False
+
+    def _call(self, message):
+        if not self.connected:
+            raise ConnectionClosed()
+        try:
+            asyncio.run_coroutine_threadsafe(self._send(message), self._loop).result()
+        except Exception:
+            self.connected = False
+            raise ConnectionClosed()
+
+
+async def serve_websocket(handler, receive, send):
+    """Accept the connection and run a Flask WebSocket handler against it"""
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    await send({'type': 'websocket.accept'})
+
+    loop = asyncio.get_running_loop()
+    ws = AsgiWebSocket(loop, send)
+    finished = loop.create_future()
+
+    def run():
+        try:
+            with app.app_context():
+                handler(ws)
+        except ConnectionClosed:
+            pass
+        except Exception as e:
+            logger.exception("❌ WebSocket handler error: %s", e)
+        finally:
+            loop.call_soon_threadsafe(finished.set_result, None)
+
+    # A thread per connection, like flask-sock under gunicorn's gthread workers
+    threading.Thread(target=run, name=f"ws-{handler.__name__}", daemon=True).start()
+
+    while not finished.done():
+        incoming = asyncio.ensure_future(receive())
+        await asyncio.wait({incoming, finished}, return_when=asyncio.FIRST_COMPLETED)
+        if not incoming.done():
+            # The handler returned
+            incoming.cancel()
+            break
+        message = incoming.result()
+        if message['type'] == 'websocket.disconnect':
+            ws.feed(None)
+            break
+        ws.feed(message['text'] if message.get('text') is not None else message.get('bytes'))
+
+    await finished
+    if ws.connected:
+        ws.connected = False
+        await send({'type': 'websocket.close', 'code': 1000})
+
+
+# ============================================
+# ASGI PLUMBING
+# ============================================
+async def read_body(receive):
+    """Read the full request body, or None if it exceeds MAX_BODY_BYTES"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def send_json(send, payload, status, headers=None):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('latin-1')),
+            (b'access-control-allow-origin', b'*')
+        ] + [
+            (name.lower().encode('latin-1'), str(value).encode('latin-1'))
+            for name, value in (headers or {}).items()
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def replay_receive(body):
+    """Build a receive() that hands an already-read body to the Flask app"""
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        return {'type': 'http.disconnect'}
+
+    return receive
+
+
+async def application(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] == 'websocket':
+        handler = WS_ROUTES.get(scope['path'])
+        if handler is None:
+            await receive()
+            await send({'type': 'websocket.close', 'code': 1008})
+            return
+        await serve_websocket(handler, receive, send)
+        return
+
+    handler = None
+    if scope['type'] == 'http':
+        handler = ASYNC_ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        await flask_app(scope, receive, send)
+        return
+
+    start = time.perf_counter()
+    request = AsyncRequest(scope)
+    # Every async route is protected: check the token before buffering up
+    # to MAX_BODY_BYTES of body for a client that may not be signed in
+    current_user, error = await authenticate_async(request)
+    if error:
+        await send_json(send, *error)
+        record_request(scope['path'], error[1], time.perf_counter() - start)
+        return
+
+    body = await read_body(receive)
+    if body is None:
+        await send_json(send, {"error": "Request body too large"}, 413)
+        record_request(scope['path'], 413, time.perf_counter() - start)
+        return
+
+    request.body = body
+    # SSE streaming and multipart uploads stay on the Flask path
+    delegate = request.mimetype == 'multipart/form-data'
+    if not delegate and request.mimetype in ('', 'application/json'):
+        delegate = request.wants_stream(request.json())
+    if delegate:
+        await flask_app(scope, replay_receive(body), send)
+        return
+
+    payload, status, *headers = await handler(request, current_user)
+    await send_json(send, payload, status, *headers)
+    record_request(scope['path'], status, time.perf_counter() - start)
@@ -0,0 +1,4 @@
+"""
+TalkBot Benchmarks
+Offline load tests for the request path (see README: Benchmarks)
+"""
@@ -0,0 +1,136 @@
+"""
+Avatar Benchmark
+Bandwidth and engine CPU of server-driven avatars
+
+Runs the avatar engine in-process with --users simulated connections
+(no sockets). A fraction of them (--talking) keeps receiving replies; the
+rest sit idle with an occasional emotion change. Reports, per connection,
+the bytes/s of the binary delta frames next to what the same updates
+would cost as full JSON states, plus the process CPU time per tick
+(state evaluation and frame encoding for every connection).
+
+Usage:
+    python -m benchmarks.avatar --users 200 --talking 0.25 --duration 10
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.avatar_generator import AvatarGenerator, VISEMES
+from utils.avatar_state import AvatarEngine, EMOTIONS, FIELDS, STATES, pack_update
+
+REPLY = (
+    "Thanks for sharing! That sounds like a great plan. Tell me more about "
+    "what you would like to do next, and I will help you get started."
+)
+
+
+class Connection:
+    """Stands in for a LiveAvatarSession: encodes every delivered state"""
+
+    def __init__(self, styles):
+        self.styles = styles
+        self.sent = None
+        self.frames = 0
+        self.binary_bytes = 0
+        self.json_bytes = 0
+        self.lock = threading.Lock()
+
+    def deliver(self, tick, values):
+        with self.lock:
+            frame = pack_update(tick, values, self.sent)
+            self.sent = values
+            if frame is None:
+                return
+            self.frames += 1
+            self.binary_bytes += len(frame)
+            state = dict(zip((name for name, _ in FIELDS), values))
+            state.update(state=STATES[state['state']], emotion=EMOTIONS[state['emotion']],
+                         style=self.styles[state['style']], viseme=VISEMES[state['viseme']])
+            self.json_bytes += len(json.dumps({'type': 'avatar', 'tick': tick, **state}))
+
+
+def run(users, talking, duration, tick_hz, seed):
+    rng = random.Random(seed)
+    generator = AvatarGenerator()
+    engine = AvatarEngine(generator.avatar_styles, tick_hz=tick_hz)
+    connections = {}
+    for i in range(users):
+        uid = f"user-{i}"
+        connections[uid] = Connection(engine.styles)
+        engine.subscribe(uid, connections[uid].deliver, rng.choice(generator.avatar_styles))
+    speakers = set(list(connections)[:int(users * talking)])
+
+    process_start = time.process_time()
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        for uid in speakers:
+            if rng.random() < 0.05:
+                with engine.speech(uid, 1.0) as speech:
+                    speech.feed(REPLY)
+        for uid in rng.sample(list(connections), max(1, users // 50)):
+            engine.set_emotion(uid, rng.choice(EMOTIONS))
+        time.sleep(0.1)
+    cpu = time.process_time() - process_start
+    snapshot = engine.snapshot()
+    engine.close()
+
+    def per_second(group, attr):
+        group = list(group)
+        return sum(getattr(connections[uid], attr) for uid in group) / max(1, len(group)) / duration
+
+    idle = set(connections) - speakers
+    return {
+        'users': users,
+        'talking': len(speakers),
+        'tick_hz': tick_hz,
+        'ticks': snapshot['ticks'],
+        'late_ticks': snapshot['late_ticks'],
+        'cpu_ms_per_tick': round(cpu * 1000 / max(1, snapshot['ticks']), 3),
+        'talking_binary_Bps': round(per_second(speakers, 'binary_bytes'), 1),
+        'talking_json_Bps': round(per_second(speakers, 'json_bytes'), 1),
+        'talking_frames_per_s': round(per_second(speakers, 'frames'), 1),
+        'idle_binary_Bps': round(per_second(idle, 'binary_bytes'), 1),
+        'idle_json_Bps': round(per_second(idle, 'json_bytes'), 1)
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200, help='simulated avatar connections')
+    parser.add_argument('--talking', type=float, default=0.25, help='fraction of users receiving replies')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run')
+    parser.add_argument('--tick-hz', type=float, default=20, help='engine tick rate')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results as JSON')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = run(args.users, args.talking, args.duration, args.tick_hz, args.seed)
+
+    print(f"\n{result['users']} avatars ({result['talking']} talking) at {result['tick_hz']:g} Hz")
+    print(f"{'':<10}{'binary B/s':>14}{'JSON B/s':>14}")
+    for group in ('talking', 'idle'):
+        print(f"{group:<10}{result[group + '_binary_Bps']:>14.1f}{result[group + '_json_Bps']:>14.1f}")
+    print(f"\nCPU: {result['cpu_ms_per_tick']:.3f} ms per tick "
+          f"({result['late_ticks']} late of {result['ticks']} ticks)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""
+Benchmark Fakes
+Local stand-ins for Gemini and Firebase Auth so load tests need no network
+
+FakeGenerativeModel replaces genai.GenerativeModel with configurable
+latency and chunked streaming; ID tokens are HS256 JWTs signed with a
+shared secret and checked in place of auth.verify_id_token, and
+auth.get_users answers user lookups locally.
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+
+# Shared by the load driver (signing) and the server under test (verifying)
+DEFAULT_SECRET = 'talkbot-benchmark-secret'
+
+
+# ============================================
+# FAKE GEMINI
+# ============================================
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModelTiming:
+    def __init__(self, latency_ms=300, ttfb_ms=100, chunks=8):
+        """
+        Args:
+            latency_ms: Time for a whole reply
+            ttfb_ms: Time to the first streamed chunk
+            chunks: Chunks a streamed reply is split into
+        """
+        self.latency = latency_ms / 1000
+        self.ttfb = min(ttfb_ms, latency_ms) / 1000
+        self.chunks = max(1, chunks)
+
+    @property
+    def chunk_gap(self):
+        return (self.latency - self.ttfb) / self.chunks
+
+
+def _reply_text(prompt):
+    words = str(prompt).split()[:12]
+    return "Thanks for sharing! " + " ".join(words) + " - tell me more about that."
+
+
+def _split(text, chunks):
+    size = max(1, -(-len(text) // chunks))
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class FakeChatSession:
+    def __init__(self, model, history):
+        self.model = model
+        self.history = list(history or [])
+
+    def _record(self, message, reply):
+        self.history = self.history + [
+            {'role': 'user', 'parts': [message]},
+            {'role': 'model', 'parts': [reply]}
+        ]
+
+    def send_message(self, message, stream=False):
+        timing = self.model.timing
+        reply = _reply_text(message)
+        if not stream:
+            time.sleep(timing.latency)
+            self._record(message, reply)
+            return FakeResponse(reply)
+
+        # Like the real client: the call returns once the first chunk arrives
+        time.sleep(timing.ttfb)
+        pieces = _split(reply, timing.chunks)
+
+        def chunks():
+            for i, piece in enumerate(pieces):
+                if i:
+                    time.sleep(timing.chunk_gap)
+                yield FakeResponse(piece)
+            self._record(message, reply)
+
+        return chunks()
+
+    async def send_message_async(self, message):
+        await asyncio.sleep(self.model.timing.latency)
+        reply = _reply_text(message)
+        self._record(message, reply)
+        return FakeResponse(reply)
+
+
+class FakeGenerativeModel:
+    timing = FakeModelTiming()
+
+    def __init__(self, model_name='gemini-2.0-flash-exp', **kwargs):
+        self.model_name = model_name
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self, history)
+
+    def generate_content(self, contents, **kwargs):
+        time.sleep(self.timing.latency)
+        return FakeResponse(_reply_text(contents[0] if isinstance(contents, list) else contents))
+
+    async def generate_content_async(self, contents, **kwargs):
+        await asyncio.sleep(self.timing.latency)
+        return FakeResponse(_reply_text(contents[0] if isinstance(contents, list) else contents))
+
+
+# ============================================
+# LOCALLY SIGNED ID TOKENS
+# ============================================
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def sign_token(uid, secret=DEFAULT_SECRET, ttl=3600):
+    """
+    Create an HS256 JWT shaped like a Firebase ID token
+    Args:
+        uid: User id (also used for the email/name claims)
+        secret: Shared HMAC secret
+        ttl: Seconds until the `exp` claim
+    Returns:
+        str: Encoded token
+    """
+    now = int(time.time())
+    header = _b64(json.dumps({'alg': 'HS256', 'typ': 'JWT'}).encode())
+    payload = _b64(json.dumps({
+        'uid': uid, 'sub': uid, 'email': f"{uid}@bench.local", 'name': uid,
+        'email_verified': True, 'iat': now, 'exp': now + ttl
+    }).encode())
+    signature = hmac.new(secret.encode(), f"{header}.{payload}".encode(), hashlib.sha256).digest()
+    return f"{header}.{payload}.{_b64(signature)}"
+
+
+def make_token_verifier(secret=DEFAULT_SECRET):
+    """Build a drop-in for firebase_admin.auth.verify_id_token"""
+    from firebase_admin import auth
+
+    def verify_id_token(id_token, *args, **kwargs):
+        try:
+            header, payload, signature = id_token.split('.')
+            expected = hmac.new(secret.encode(), f"{header}.{payload}".encode(), hashlib.sha256).digest()
+            valid = hmac.compare_digest(expected, _unb64(signature))
+            claims = json.loads(_unb64(payload)) if valid else None
+        except ValueError as e:
+            raise auth.InvalidIdTokenError(f"Malformed token: {e}")
+        if claims is None:
+            raise auth.InvalidIdTokenError("Bad token signature")
+        if claims.get('exp', 0) <= time.time():
+            raise auth.ExpiredIdTokenError("Token expired", None)
+        return claims
+
+    return verify_id_token
+
+
+def fake_get_users(identifiers, app=None):
+    """
+    Drop-in for firebase_admin.auth.get_users
+
+    Every uid exists; emails resolve when they look like the ones
+    sign_token() puts in its claims (<uid>@bench.local).
+    """
+    from firebase_admin import auth
+
+    time.sleep(FakeGenerativeModel.timing.ttfb / 4)  # one round trip
+    if len(identifiers) > 100:
+        raise ValueError("`identifiers` parameter must have <= 100 entries.")
+    users, not_found = [], []
+    for identifier in identifiers:
+        uid = getattr(identifier, 'uid', None)
+        email = getattr(identifier, 'email', None)
+        if uid is None and email and email.endswith('@bench.local'):
+            uid = email[:-len('@bench.local')]
+        if uid is None:
+            not_found.append(identifier)
+            continue
+        users.append(auth.UserRecord({
+            'localId': uid, 'email': f"{uid}@bench.local", 'displayName': uid, 'emailVerified': True
+        }))
+    return auth.GetUsersResult(users, not_found)
+
+
+def install(timing=None, secret=None):
+    """
+    Swap the fakes in; call before importing app
+    Args:
+        timing: FakeModelTiming for every model call
+        secret: JWT secret (default: BENCH_JWT_SECRET or DEFAULT_SECRET)
+    """
+    import google.generativeai as genai
+    from firebase_admin import auth
+
+    if timing is not None:
+        FakeGenerativeModel.timing = timing
+    genai.GenerativeModel = FakeGenerativeModel
+    auth.verify_id_token = make_token_verifier(secret or os.getenv('BENCH_JWT_SECRET', DEFAULT_SECRET))
+    auth.get_users = fake_get_users
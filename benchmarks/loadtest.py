@@ -0,0 +1,372 @@
+"""
+Load Test Driver
+Drives /api/chat, /api/camera, /api/chat/clear and /api/user/profile at a target concurrency
+
+Starts benchmarks.server (real app, fake Gemini, locally signed tokens)
+unless --url points at a running one, then reports p50/p95/p99 latency per
+operation, throughput and the server's RSS growth. Results are saved as
+JSON; compared against a saved baseline, a regression beyond the
+tolerance exits with status 1 so CI fails.
+
+Usage:
+    python -m benchmarks.loadtest --duration 20 --concurrency 16 --output bench.json
+    python -m benchmarks.loadtest --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fakes import DEFAULT_SECRET, sign_token  # noqa: E402
+
+MESSAGES = [
+    "hi", "hello", "How are you today?", "Tell me a joke about cats.",
+    "What should I cook for dinner tonight?", "Can you help me plan a trip to Lisbon?",
+    "Explain how rainbows form in two sentences.", "I feel a bit stressed about work."
+]
+EMOTIONS = ["neutral", "happy", "sad", "surprised"]
+
+
+# ============================================
+# OPERATIONS
+# ============================================
+def make_frames(count=16, size=(320, 240)):
+    """Distinct noisy JPEG frames, so dedupe and caches see realistic misses"""
+    frames = []
+    for i in range(count):
+        image = Image.effect_noise(size, 40 + i * 5).convert('RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=80)
+        frames.append(buffer.getvalue())
+    return frames
+
+
+def op_chat(session, base, token, rng, frames):
+    response = session.post(f"{base}/api/chat", json={"message": rng.choice(MESSAGES)},
+                            headers={"Authorization": f"Bearer {token}"}, timeout=60)
+    return response.status_code == 200
+
+
+def op_stream(session, base, token, rng, frames):
+    response = session.post(f"{base}/api/chat?stream=1", json={"message": rng.choice(MESSAGES)},
+                            headers={"Authorization": f"Bearer {token}"}, timeout=60, stream=True)
+    body = b"".join(response.iter_content(chunk_size=None))
+    return response.status_code == 200 and b"event: done" in body
+
+
+def op_camera(session, base, token, rng, frames):
+    response = session.post(f"{base}/api/camera", data=rng.choice(frames), headers={
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "image/jpeg",
+        "X-Emotion": rng.choice(EMOTIONS)
+    }, timeout=60)
+    return response.status_code == 200
+
+
+def op_clear(session, base, token, rng, frames):
+    response = session.post(f"{base}/api/chat/clear",
+                            headers={"Authorization": f"Bearer {token}"}, timeout=60)
+    return response.status_code == 200
+
+
+def op_profile(session, base, token, rng, frames):
+    response = session.get(f"{base}/api/user/profile",
+                           headers={"Authorization": f"Bearer {token}"}, timeout=60)
+    return response.status_code == 200
+
+
+OPERATIONS = {
+    'chat': op_chat, 'stream': op_stream, 'camera': op_camera, 'clear': op_clear, 'profile': op_profile
+}
+
+
+def parse_mix(text):
+    """'chat=6,camera=3,clear=1' -> {'chat': 6.0, 'camera': 3.0, 'clear': 1.0}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r} (choose from {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# ============================================
+# SERVER UNDER TEST
+# ============================================
+def read_rss_mb(pid):
+    """Resident set size of a process in MiB (Linux /proc), or None"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class RssSampler:
+    """Tracks the peak RSS of the server process in the background"""
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = read_rss_mb(self.pid)
+            if rss:
+                self.peak = max(self.peak, rss)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def start_server(args):
+    command = [
+        sys.executable, '-m', 'benchmarks.server', '--port', str(args.port),
+        '--model-latency-ms', str(args.model_latency_ms),
+        '--ttfb-ms', str(args.ttfb_ms), '--chunks', str(args.chunks)
+    ]
+    if args.asgi:
+        command.append('--asgi')
+    env = dict(os.environ, BENCH_JWT_SECRET=args.secret)
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    base = f"http://127.0.0.1:{args.port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Benchmark server exited with status {process.returncode}")
+        try:
+            if requests.get(f"{base}/health", timeout=1).status_code == 200:
+                return process, base
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("Benchmark server did not become healthy within 60s")
+
+
+# ============================================
+# LOAD GENERATION
+# ============================================
+def run_load(base, tokens, mix, concurrency, duration, frames, seed):
+    """
+    Run closed-loop workers for `duration` seconds
+    Returns:
+        tuple: ([(operation, seconds, ok), ...], wall time in seconds)
+    """
+    names, weights = list(mix), list(mix.values())
+    results = []
+    stop_at = time.perf_counter() + duration
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        session = requests.Session()
+        while time.perf_counter() < stop_at:
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                ok = OPERATIONS[name](session, base, rng.choice(tokens), rng, frames)
+            except requests.RequestException:
+                ok = False
+            results.append((name, time.perf_counter() - start, ok))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return results, time.perf_counter() - started
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(1, rank)) - 1]
+
+
+def summarize(results, wall_time):
+    operations = {}
+    for name in sorted({r[0] for r in results}):
+        latencies = sorted(r[1] * 1000 for r in results if r[0] == name)
+        errors = sum(1 for r in results if r[0] == name and not r[2])
+        operations[name] = {
+            'count': len(latencies),
+            'errors': errors,
+            'error_rate': round(errors / len(latencies), 4),
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'throughput_rps': round(len(latencies) / wall_time, 2)
+        }
+    return {
+        'requests': len(results),
+        'errors': sum(1 for r in results if not r[2]),
+        'duration_s': round(wall_time, 2),
+        'throughput_rps': round(len(results) / wall_time, 2) if wall_time else 0.0,
+        'operations': operations
+    }
+
+
+# ============================================
+# BASELINE COMPARISON
+# ============================================
+def compare(current, baseline, tolerance, slack_ms, rss_tolerance_mb):
+    """
+    Find regressions against a baseline run
+    Args:
+        tolerance: Allowed relative slowdown / throughput drop (0.2 = 20%)
+        slack_ms: Absolute latency noise allowed on top of the tolerance
+        rss_tolerance_mb: Extra RSS growth allowed over the baseline's
+    Returns:
+        list: Human-readable regression descriptions (empty when none)
+    """
+    failures = []
+    for name, base in baseline.get('operations', {}).items():
+        cur = current['operations'].get(name)
+        if cur is None:
+            continue
+        # p99 is reported but not gated: too few samples in a short run
+        for key in ('p50_ms', 'p95_ms'):
+            limit = base[key] * (1 + tolerance) + slack_ms
+            if cur[key] > limit:
+                failures.append(f"{name} {key}: {cur[key]:.1f} > {limit:.1f} (baseline {base[key]:.1f})")
+        if cur['error_rate'] > base['error_rate'] + 0.01:
+            failures.append(f"{name} error rate: {cur['error_rate']:.2%} (baseline {base['error_rate']:.2%})")
+
+    floor = baseline['throughput_rps'] * (1 - tolerance)
+    if current['throughput_rps'] < floor:
+        failures.append(f"throughput: {current['throughput_rps']:.1f} rps < {floor:.1f} "
+                        f"(baseline {baseline['throughput_rps']:.1f})")
+
+    cur_rss = (current.get('rss_mb') or {}).get('growth')
+    base_rss = (baseline.get('rss_mb') or {}).get('growth')
+    if cur_rss is not None and base_rss is not None and cur_rss > base_rss + rss_tolerance_mb:
+        failures.append(f"RSS growth: {cur_rss:.1f} MiB > {base_rss + rss_tolerance_mb:.1f} "
+                        f"(baseline {base_rss:.1f})")
+    return failures
+
+
+def print_report(report):
+    print(f"\n{'operation':<10}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rps':>9}")
+    for name, op in report['operations'].items():
+        print(f"{name:<10}{op['count']:>8}{op['errors']:>8}{op['p50_ms']:>10.1f}"
+              f"{op['p95_ms']:>10.1f}{op['p99_ms']:>10.1f}{op['throughput_rps']:>9.1f}")
+    print(f"\nTotal: {report['requests']} requests, {report['errors']} errors, "
+          f"{report['throughput_rps']:.1f} req/s over {report['duration_s']:.1f}s")
+    rss = report.get('rss_mb')
+    if rss:
+        print(f"Server RSS: {rss['start']:.1f} -> {rss['end']:.1f} MiB "
+              f"(peak {rss['peak']:.1f}, growth {rss['growth']:+.1f})")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='drive an already running server instead of starting one')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--asgi', action='store_true', help='start the server on the ASGI path')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=3, help='unmeasured seconds first')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('chat=5,stream=2,camera=3,clear=1'))
+    parser.add_argument('--model-latency-ms', type=float, default=300)
+    parser.add_argument('--ttfb-ms', type=float, default=100)
+    parser.add_argument('--chunks', type=int, default=8)
+    parser.add_argument('--secret', default=os.getenv('BENCH_JWT_SECRET', DEFAULT_SECRET))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--save-baseline', help='write results JSON as the new baseline')
+    parser.add_argument('--baseline', help='compare against this results JSON')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--slack-ms', type=float, default=5)
+    parser.add_argument('--rss-tolerance-mb', type=float, default=50)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    process = None
+    if args.url:
+        base = args.url.rstrip('/')
+    else:
+        process, base = start_server(args)
+
+    try:
+        tokens = [sign_token(f"bench-user-{i}", args.secret) for i in range(args.users)]
+        frames = make_frames()
+        if args.warmup > 0:
+            run_load(base, tokens, args.mix, args.concurrency, args.warmup, frames, args.seed + 10000)
+
+        rss_start = read_rss_mb(process.pid) if process else None
+        sampler = RssSampler(process.pid).start() if process else None
+        results, wall_time = run_load(base, tokens, args.mix, args.concurrency, args.duration, frames, args.seed)
+        if sampler:
+            sampler.stop()
+        rss_end = read_rss_mb(process.pid) if process else None
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+
+    report = summarize(results, wall_time)
+    report['config'] = {
+        'concurrency': args.concurrency, 'duration': args.duration, 'users': args.users,
+        'mix': args.mix, 'asgi': args.asgi, 'model_latency_ms': args.model_latency_ms,
+        'ttfb_ms': args.ttfb_ms, 'chunks': args.chunks
+    }
+    if rss_start is not None and rss_end is not None:
+        report['rss_mb'] = {
+            'start': round(rss_start, 1), 'end': round(rss_end, 1),
+            'peak': round(max(sampler.peak, rss_end), 1), 'growth': round(rss_end - rss_start, 1)
+        }
+    print_report(report)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Results written to {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failures = compare(report, baseline, args.tolerance, args.slack_ms, args.rss_tolerance_mb)
+        if failures:
+            print("\n❌ Regressions against baseline:")
+            for failure in failures:
+                print(f"   • {failure}")
+            return 1
+        print("\n✅ No regressions against baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+Benchmark Server
+Runs the real app with the fakes installed, for loadtest.py to drive
+
+Usage:
+    python -m benchmarks.server --port 5055 [--asgi] [--model-latency-ms 300]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+
+# Run from anywhere: the app modules live one directory up
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fakes import FakeModelTiming, install  # noqa: E402
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--asgi', action='store_true', help='serve asgi:application with uvicorn')
+    parser.add_argument('--model-latency-ms', type=float, default=300)
+    parser.add_argument('--ttfb-ms', type=float, default=100)
+    parser.add_argument('--chunks', type=int, default=8)
+    return parser.parse_args(argv)
+
+
+def configure_environment():
+    """Isolated state per run; limits off so the driver measures the request path"""
+    data_dir = tempfile.mkdtemp(prefix='talkbot-bench-')
+    defaults = {
+        'GEMINI_API_KEY': 'benchmark',
+        'HISTORY_DB_PATH': os.path.join(data_dir, 'history.sqlite3'),
+        'RATE_LIMIT_CHAT': '0',
+        'RATE_LIMIT_CAMERA': '0',
+        'RATE_LIMIT_BACKEND': 'memory',
+        'TTS_CACHE_DIR': os.path.join(data_dir, 'tts_cache'),
+        'LOG_LEVEL': 'WARNING'
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_environment()
+    install(FakeModelTiming(args.model_latency_ms, args.ttfb_ms, args.chunks))
+
+    if args.asgi:
+        import uvicorn
+        from asgi import application
+        uvicorn.run(application, host=args.host, port=args.port, log_level='warning')
+    else:
+        from werkzeug.serving import run_simple
+        from app import app
+        # The dev server's per-request access log would dominate the profile
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        run_simple(args.host, args.port, app, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Startup Benchmark
+Measures how long a fresh process takes to import the app and serve
+
+Each run is a new interpreter, so nothing is cached in sys.modules. Two
+modes are reported as the median over --runs:
+    lazy     import app, then the first request builds what it needs
+    warmed   import app, warm_services() for every service (an upper
+             bound on gunicorn's preload / post_worker_init warm-up),
+             then the first request
+The fakes are installed inside the timed first-request / warm step because
+installing them imports the same Gemini and Firebase SDKs the real first
+request would. The fake model answers instantly, so request times are
+server overhead only.
+
+Usage:
+    python -m benchmarks.startup --runs 5 --output startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PHASES = ['import_ms', 'warm_ms', 'first_request_ms', 'second_request_ms']
+
+
+def measure(warm):
+    """Time one startup in this (fresh) process; returns {phase: ms}"""
+    from benchmarks.fakes import FakeModelTiming, install, sign_token
+    from benchmarks.server import configure_environment
+
+    configure_environment()
+    timings = {}
+
+    start = time.perf_counter()
+    import app
+    timings['import_ms'] = (time.perf_counter() - start) * 1000
+
+    client = app.app.test_client()
+    headers = {'Authorization': f"Bearer {sign_token('startup-user')}"}
+
+    start = time.perf_counter()
+    install(FakeModelTiming(latency_ms=0, ttfb_ms=0, chunks=1))
+    if warm:
+        from utils.services import warm_services
+        warm_services()
+        timings['warm_ms'] = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+
+    for phase in ('first_request_ms', 'second_request_ms'):
+        response = client.post('/api/chat', json={'message': 'hello'}, headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/chat returned {response.status_code}: {response.get_data(as_text=True)}")
+        timings[phase] = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+
+    return timings
+
+
+def run_child(warm):
+    command = [sys.executable, '-m', 'benchmarks.startup', '--child']
+    if warm:
+        command.append('--warm')
+    output = subprocess.run(command, cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    # The last line is the result; anything before it is app output
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(samples):
+    return {
+        phase: round(statistics.median(sample[phase] for sample in samples), 1)
+        for phase in PHASES if all(phase in sample for sample in samples)
+    }
+
+
+def print_report(report):
+    print(f"\n{'mode':<8}" + "".join(f"{phase[:-3]:>18}" for phase in PHASES))
+    for mode, result in report['modes'].items():
+        cells = "".join(
+            f"{result[phase]:>15.1f} ms" if phase in result else f"{'-':>18}" for phase in PHASES
+        )
+        print(f"{mode:<8}{cells}")
+    print(f"\nMedian of {report['runs']} fresh processes per mode")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes per mode')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--warm', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.child:
+        print(json.dumps(measure(args.warm)))
+        return 0
+
+    report = {'runs': args.runs, 'modes': {}}
+    for mode, warm in (('lazy', False), ('warmed', True)):
+        samples = [run_child(warm) for _ in range(args.runs)]
+        report['modes'][mode] = summarize(samples)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
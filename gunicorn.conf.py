@@ -0,0 +1,73 @@
+"""
+Gunicorn Configuration
+Used automatically by `gunicorn app:app` when run from the project root
+
+With GUNICORN_PRELOAD=1 the master imports the app once and builds the
+read-only services listed in PRELOAD_SERVICES before forking, so workers
+share those pages copy-on-write instead of each loading its own copy.
+Everything that owns threads, processes, sockets or database handles is
+built in each worker after the fork. Exported conversation segments are
+sealed and (with EXPORT_IMPORT_ON_START=1) imported once, in the master.
+
+Environment:
+    PORT                Port to bind (default: 5000)
+    WEB_CONCURRENCY     Worker processes (default: 2; 1 when serving /ws/avatar,
+                        whose state lives in the worker)
+    GUNICORN_THREADS    Threads per worker, one per open WebSocket (default: 50)
+    GUNICORN_PRELOAD    1 to import the app in the master (default: 0)
+    PRELOAD_SERVICES    Services built in the master when preloading
+                        (default: gemini,speech)
+    WARM_SERVICES       Services each worker builds before taking traffic
+                        (default: gemini,firebase,rate_limiter,history, plus
+                        frame_executor when FRAME_WORKERS > 0); the rest are
+                        built by the first request that needs them
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 50))
+worker_class = 'gthread'
+preload_app = os.getenv('GUNICORN_PRELOAD', '0') == '1'
+
+# Safe to share across fork: the Gemini client opens no connection until its
+# first call, and the speech models are plain read-only memory. The Firebase
+# key refresher, emotion batcher thread, frame worker pool, onnxruntime
+# sessions and SQLite / Redis handles must not be inherited.
+PRELOAD_SERVICES = [
+    name.strip() for name in os.getenv('PRELOAD_SERVICES', 'gemini,speech').split(',') if name.strip()
+]
+
+# Cheap and on every request's path: the model client, token verification,
+# rate limiting and history. ML models and the avatar engine are left to the
+# requests that need them, so a worker that never sees a camera frame doesn't
+# pay for them. The frame worker pool is the exception: setting
+# FRAME_WORKERS > 0 opts in to it, and its process spawn and model loading
+# would otherwise land on the first camera frames.
+DEFAULT_WARM_SERVICES = 'gemini,firebase,rate_limiter,history'
+if int(os.getenv('FRAME_WORKERS', 0)) > 0:
+    DEFAULT_WARM_SERVICES += ',frame_executor'
+WARM_SERVICES = [
+    name.strip() for name in os.getenv('WARM_SERVICES', DEFAULT_WARM_SERVICES).split(',')
+    if name.strip()
+]
+
+
+def when_ready(server):
+    # Once per deployment, before any worker serves a request
+    from utils.conversation_export import import_on_startup
+    import_on_startup()
+
+    if not preload_app:
+        return
+    from utils.services import warm_services
+    timings = warm_services(PRELOAD_SERVICES)
+    server.log.info("Preloaded services in master: %s", ", ".join(timings) or "none")
+
+
+def post_worker_init(worker):
+    # Runs once the worker has the app loaded; build what every request
+    # needs now so the first request a worker serves is not the slow one
+    from utils.services import warm_services
+    warm_services(WARM_SERVICES)
@@ -160,7 +160,8 @@ class AvatarRenderer {
   }
 
   // Main draw function
-  draw(speaking = false, emotion = 'neutral') {
+  // mouth (0-255) comes from a LiveAvatar state; without it the mouth is animated locally
+  draw(speaking = false, emotion = 'neutral', mouth = null) {
     const avatar = AvatarLibrary.getCurrentAvatar();
     this.ctx.clearRect(0, 0, this.canvas.width, this.canvas.height);
 
@@ -174,7 +175,7 @@ class AvatarRenderer {
     // Draw based on features
     this.drawHead(cx, cy, scale, avatar);
     this.drawEyes(cx, cy, scale, avatar, speaking);
-    this.drawMouth(cx, cy, scale, avatar, speaking, emotion);
+    this.drawMouth(cx, cy, scale, avatar, speaking, emotion, mouth);
     this.drawAccessories(cx, cy, scale, avatar);
   }
 
@@ -367,13 +368,14 @@ class AvatarRenderer {
     this.ctx.fill();
   }
 
-  drawMouth(cx, cy, scale, avatar, speaking, emotion) {
+  drawMouth(cx, cy, scale, avatar, speaking, emotion, mouth = null) {
     this.ctx.strokeStyle = '#ffffff';
     this.ctx.lineWidth = 6 * scale;
     this.ctx.lineCap = 'round';
 
     if (speaking) {
-      const mouthOpen = Math.abs(Math.sin(Date.now() / 150)) * 20 * scale;
+      const openness = mouth === null ? Math.abs(Math.sin(Date.now() / 150)) : mouth / 255;
+      const mouthOpen = openness * 20 * scale;
       this.ctx.beginPath();
       this.ctx.ellipse(cx, cy + 50 * scale, 30 * scale, 15 * scale + mouthOpen, 0, 0, Math.PI * 2);
       this.ctx.stroke();
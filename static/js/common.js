@@ -37,6 +37,50 @@ const API = {
         return this.call('/chat', 'POST', { message, session_id: sessionId });
     },
     
+    // Streaming chat endpoint (Server-Sent Events over fetch)
+    // onChunk(text) is called for each fragment; resolves with the full reply
+    // Pass onLipSync to also receive lip-sync timeline segments as words complete
+    async chatStream(message, idToken, onChunk, onLipSync, rate = 1.0) {
+        const body = onLipSync ? { message, lipsync: true, rate } : { message };
+        const response = await fetch(`${this.baseURL}/api/chat?stream=1`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Authorization': `Bearer ${idToken}`
+            },
+            body: JSON.stringify(body)
+        });
+        
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const frame = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                
+                const event = (frame.match(/^event: (.*)$/m) || [])[1];
+                const data = JSON.parse((frame.match(/^data: (.*)$/m) || [])[1] || '{}');
+                
+                if (event === 'chunk' && onChunk) onChunk(data.text);
+                if (event === 'lipsync' && onLipSync) onLipSync(data);
+                if (event === 'error') throw new Error(data.error);
+                if (event === 'done') return data.reply;
+            }
+        }
+        throw new Error('Stream ended unexpectedly');
+    },
+    
     // Camera endpoint
     camera(frameData, emotion, message) {
         return this.call('/camera', 'POST', {
@@ -46,6 +90,27 @@ const API = {
         });
     },
     
+    // Camera endpoint, binary upload (raw JPEG body, metadata in headers)
+    // Avoids base64 + JSON overhead; frameBlob comes from Camera.captureFrameBlob
+    async cameraBinary(frameBlob, emotion, message, idToken) {
+        const response = await fetch(`${this.baseURL}/api/camera`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/octet-stream',
+                'Authorization': `Bearer ${idToken}`,
+                'X-Emotion': encodeURIComponent(emotion || 'neutral'),
+                'X-Message': encodeURIComponent(message || '')
+            },
+            body: frameBlob
+        });
+        
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        
+        return await response.json();
+    },
+    
     // Health check
     health() {
         return this.call('/health', 'GET');
@@ -238,17 +303,31 @@ const Camera = {
     },
     
     // Capture frame from video
-    captureFrame(videoElement, quality = 0.8) {
+    // Frames are scaled so the longest edge is at most maxEdge pixels
+    // (the server downscales to the same bound before calling the model)
+    captureFrame(videoElement, quality = 0.8, maxEdge = 768) {
+        const scale = Math.min(1, maxEdge / Math.max(videoElement.videoWidth, videoElement.videoHeight));
         const canvas = document.createElement('canvas');
-        canvas.width = videoElement.videoWidth;
-        canvas.height = videoElement.videoHeight;
+        canvas.width = Math.round(videoElement.videoWidth * scale);
+        canvas.height = Math.round(videoElement.videoHeight * scale);
         
         const ctx = canvas.getContext('2d');
-        ctx.drawImage(videoElement, 0, 0);
+        ctx.drawImage(videoElement, 0, 0, canvas.width, canvas.height);
         
         return canvas.toDataURL('image/jpeg', quality);
     },
     
+    // Capture frame as a JPEG Blob for binary upload
+    captureFrameBlob(videoElement, quality = 0.8, maxEdge = 768) {
+        const scale = Math.min(1, maxEdge / Math.max(videoElement.videoWidth, videoElement.videoHeight));
+        const canvas = document.createElement('canvas');
+        canvas.width = Math.round(videoElement.videoWidth * scale);
+        canvas.height = Math.round(videoElement.videoHeight * scale);
+        canvas.getContext('2d').drawImage(videoElement, 0, 0, canvas.width, canvas.height);
+        
+        return new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', quality));
+    },
+    
     // Get available devices
     async getDevices() {
         if (!this.isSupported()) {
@@ -363,6 +442,171 @@ const Animate = {
     }
 };
 
+// Live camera session over WebSocket (one auth, then binary frames)
+const LiveCamera = {
+    socket: null,
+    
+    // onReply(data) receives {reply, emotion, reused, frame} events
+    connect(idToken, onReply, onError = console.error) {
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        this.socket = new WebSocket(`${protocol}//${window.location.host}/ws/camera`);
+        this.socket.binaryType = 'arraybuffer';
+        
+        this.socket.onopen = () => {
+            this.socket.send(JSON.stringify({ type: 'auth', token: idToken }));
+        };
+        
+        this.socket.onmessage = (event) => {
+            const data = JSON.parse(event.data);
+            if (data.type === 'reply') onReply(data);
+            if (data.type === 'error') onError(data);
+        };
+        
+        return this.socket;
+    },
+    
+    // Frames sent while the server is busy are dropped server-side,
+    // so it is safe to call this at the camera frame rate
+    async sendFrame(videoElement, quality = 0.8) {
+        if (!this.socket || this.socket.readyState !== WebSocket.OPEN) return;
+        const blob = await Camera.captureFrameBlob(videoElement, quality);
+        this.socket.send(blob);
+    },
+    
+    setEmotion(emotion) {
+        this.socket?.send(JSON.stringify({ type: 'emotion', emotion }));
+    },
+    
+    sendMessage(message) {
+        this.socket?.send(JSON.stringify({ type: 'message', message }));
+    },
+    
+    close() {
+        this.socket?.close();
+        this.socket = null;
+    }
+};
+
+// ============================================
+// LIVE AVATAR (WebSocket /ws/avatar)
+// ============================================
+// The server runs the avatar (emotion, style, thinking/talking, mouth shape)
+// and sends only the fields that change, as binary frames:
+// uint8 kind, uint16 tick, uint16 field mask, then the masked fields
+const LiveAvatar = {
+    socket: null,
+    layout: null,
+    state: {},
+    
+    // onState(state, changed) is called with the decoded state after every frame;
+    // draw only when it fires instead of animating every browser frame
+    connect(idToken, onState, style = null, onError = console.error) {
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        this.socket = new WebSocket(`${protocol}//${window.location.host}/ws/avatar`);
+        this.socket.binaryType = 'arraybuffer';
+        
+        this.socket.onopen = () => {
+            this.socket.send(JSON.stringify({ type: 'auth', token: idToken, style }));
+        };
+        
+        this.socket.onmessage = (event) => {
+            if (typeof event.data !== 'string') {
+                if (this.layout) onState(this.state, this.apply(new DataView(event.data)));
+                return;
+            }
+            const data = JSON.parse(event.data);
+            if (data.type === 'ready') this.layout = data;
+            if (data.type === 'error') onError(data);
+        };
+        
+        return this.socket;
+    },
+    
+    // Decode one frame into this.state; returns the names of the fields it carried
+    apply(view) {
+        const mask = view.getUint16(3, true);
+        const changed = [];
+        let offset = 5;
+        this.layout.fields.forEach(([name, code], i) => {
+            if (!(mask & (1 << i))) return;
+            const value = code === 'H' ? view.getUint16(offset, true) : view.getUint8(offset);
+            offset += code === 'H' ? 2 : 1;
+            const table = this.layout.tables[name];
+            this.state[name] = table ? table[value] : value;
+            changed.push(name);
+        });
+        return changed;
+    },
+    
+    setStyle(style) {
+        this.socket?.send(JSON.stringify({ type: 'style', style }));
+    },
+    
+    close() {
+        this.socket?.close();
+        this.socket = this.layout = null;
+        this.state = {};
+    }
+};
+
+// ============================================
+// LIVE SPEECH (WebSocket /ws/speech)
+// ============================================
+const LiveSpeech = {
+    socket: null,
+    audioContext: null,
+    stream: null,
+    
+    // handlers: { onPartial(text), onFinal(text), onChunk(text), onReply(data), onError(data) }
+    // Utterances are closed server-side when the speaker pauses, then answered by the chat
+    async start(idToken, handlers = {}, sampleRate = 16000) {
+        this.stream = await navigator.mediaDevices.getUserMedia({ audio: true });
+        this.audioContext = new AudioContext({ sampleRate });
+        
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        this.socket = new WebSocket(`${protocol}//${window.location.host}/ws/speech`);
+        this.socket.onopen = () => {
+            this.socket.send(JSON.stringify({ type: 'auth', token: idToken, sample_rate: sampleRate }));
+        };
+        this.socket.onmessage = (event) => {
+            const data = JSON.parse(event.data);
+            if (data.type === 'partial') handlers.onPartial?.(data.text);
+            if (data.type === 'final') handlers.onFinal?.(data.text);
+            if (data.type === 'chunk') handlers.onChunk?.(data.text);
+            if (data.type === 'reply') handlers.onReply?.(data);
+            if (data.type === 'error') (handlers.onError || console.error)(data);
+        };
+        
+        // Send ~128 ms chunks of 16-bit PCM
+        const source = this.audioContext.createMediaStreamSource(this.stream);
+        const processor = this.audioContext.createScriptProcessor(2048, 1, 1);
+        processor.onaudioprocess = (event) => {
+            if (this.socket?.readyState !== WebSocket.OPEN) return;
+            const input = event.inputBuffer.getChannelData(0);
+            const pcm = new Int16Array(input.length);
+            for (let i = 0; i < input.length; i++) {
+                pcm[i] = Math.max(-1, Math.min(1, input[i])) * 0x7FFF;
+            }
+            this.socket.send(pcm.buffer);
+        };
+        source.connect(processor);
+        processor.connect(this.audioContext.destination);
+        return this.socket;
+    },
+    
+    // Close the current utterance without waiting for silence (push-to-talk release)
+    endUtterance() {
+        this.socket?.send(JSON.stringify({ type: 'end' }));
+    },
+    
+    stop() {
+        this.stream?.getTracks().forEach(track => track.stop());
+        this.audioContext?.close();
+        this.socket?.close();
+        this.socket = this.audioContext = this.stream = null;
+    }
+};
+
 // Add CSS animations
 const style = document.createElement('style');
 style.textContent = `
@@ -385,6 +629,9 @@ window.TalkBot = {
     UI,
     Voice,
     Camera,
+    LiveCamera,
+    LiveAvatar,
+    LiveSpeech,
     Utils,
     Animate
 };
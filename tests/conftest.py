@@ -0,0 +1,10 @@
+"""
+Test configuration
+Puts the repository root on sys.path so tests import `utils` and `benchmarks`
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
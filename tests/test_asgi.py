@@ -0,0 +1,79 @@
+"""
+ASGI entry point tests
+Drive asgi.application in-process, with the fakes from benchmarks/fakes.py,
+so a change in asgiref's internals fails here instead of under uvicorn
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from benchmarks.fakes import FakeModelTiming, install, sign_token
+from benchmarks.server import configure_environment
+
+
+@pytest.fixture(scope='module')
+def application():
+    configure_environment()
+    install(FakeModelTiming(latency_ms=10, ttfb_ms=5, chunks=2))
+    import asgi
+    return asgi.application
+
+
+def request(application, method, path, body=b'', headers=(), query=''):
+    """Run one HTTP request through the ASGI app; returns (status, headers, body)"""
+    headers = [*headers, ('Content-Length', str(len(body)))]
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': query.encode(), 'root_path': '',
+        'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+        'client': ('127.0.0.1', 40000), 'server': ('127.0.0.1', 5000)
+    }
+    incoming = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return incoming.pop(0) if incoming else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asyncio.wait_for(application(scope, receive, send), timeout=10))
+    start = next(message for message in sent if message['type'] == 'http.response.start')
+    content = b''.join(message.get('body', b'') for message in sent if message['type'] == 'http.response.body')
+    return start['status'], dict(start['headers']), content
+
+
+def auth_headers(uid):
+    return [('Authorization', f"Bearer {sign_token(uid)}"), ('Content-Type', 'application/json')]
+
+
+def test_health_falls_back_to_flask(application):
+    status, _, content = request(application, 'GET', '/health')
+    assert status == 200
+    assert json.loads(content)['status'] == 'healthy'
+
+
+def test_profile_falls_back_to_flask(application):
+    status, _, content = request(application, 'GET', '/api/user/profile', headers=auth_headers('asgi-1'))
+    assert status == 200
+    assert json.loads(content)['uid'] == 'asgi-1'
+
+
+def test_streamed_chat_is_served_by_flask(application):
+    body = json.dumps({'message': 'hi'}).encode()
+    status, headers, content = request(
+        application, 'POST', '/api/chat', body, auth_headers('asgi-2'), query='stream=1'
+    )
+    assert status == 200
+    assert headers[b'content-type'].startswith(b'text/event-stream')
+    assert b'event: done' in content
+
+
+def test_async_chat_route(application):
+    body = json.dumps({'message': 'hello'}).encode()
+    status, _, content = request(application, 'POST', '/api/chat', body, auth_headers('asgi-3'))
+    assert status == 200
+    assert json.loads(content)['reply']
@@ -0,0 +1,126 @@
+"""
+Avatar state tests
+The binary update format (decoded by static/js/common.js) and the
+per-user lip-sync timeline
+"""
+
+from utils.avatar_generator import AI, MBP, O, REST
+from utils.avatar_state import (
+    DELTA, FIELDS, IDLE, KEYFRAME, MOUTH_OPEN, NO_WORD, TALKING, THINKING,
+    AvatarState, pack_update, unpack_update
+)
+
+STYLES = {'default': 0, 'friendly': 1}
+FIELD_INDEX = {name: i for i, (name, _) in enumerate(FIELDS)}
+
+
+def values(**fields):
+    defaults = dict(state=IDLE, emotion=0, style=0, viseme=REST, mouth=0, word=NO_WORD)
+    defaults.update(fields)
+    return tuple(defaults[name] for name, _ in FIELDS)
+
+
+def test_keyframe_round_trip():
+    state = values(state=TALKING, emotion=2, style=1, viseme=AI, mouth=230, word=7)
+    frame = pack_update(42, state)
+
+    assert frame[0] == KEYFRAME
+    # Header, then one byte per B field and two for the word index
+    assert len(frame) == 5 + len(FIELDS) + 1
+    assert unpack_update(frame) == (KEYFRAME, 42, state)
+
+
+def test_delta_carries_only_changed_fields():
+    before = values(state=TALKING, viseme=AI, mouth=230, word=3)
+    after = values(state=TALKING, viseme=O, mouth=200, word=3)
+    frame = pack_update(43, after, before)
+
+    assert frame[0] == DELTA
+    mask = int.from_bytes(frame[3:5], 'little')
+    assert mask == 1 << FIELD_INDEX['viseme'] | 1 << FIELD_INDEX['mouth']
+    assert len(frame) == 5 + 2
+    assert unpack_update(frame, before) == (DELTA, 43, after)
+
+
+def test_unchanged_state_sends_nothing():
+    state = values(state=TALKING, mouth=100)
+    assert pack_update(44, state, state) is None
+
+
+def test_no_word_survives_the_round_trip():
+    before = values(state=TALKING, word=12)
+    after = values(state=IDLE, word=NO_WORD)
+    _, _, decoded = unpack_update(pack_update(45, after, before), before)
+    assert decoded[FIELD_INDEX['word']] == NO_WORD == 0xFFFF
+
+
+def test_tick_wraps_at_16_bits():
+    state = values()
+    assert unpack_update(pack_update(65535, state))[1] == 65535
+    assert unpack_update(pack_update(65536 + 5, state))[1] == 5
+
+
+def segment(visemes, start, end, word_start):
+    return {'visemes': visemes, 'start': start, 'end': end, 'word_start': word_start}
+
+
+def field(state_values, name):
+    return state_values[FIELD_INDEX[name]]
+
+
+def test_evaluate_follows_the_timeline():
+    avatar = AvatarState('friendly')
+    avatar.speak(segment([AI, MBP], [0, 100], [100, 200], [0]), now=10.0, append=False)
+
+    talking = avatar.evaluate(10.09, STYLES)
+    assert field(talking, 'state') == TALKING
+    assert field(talking, 'viseme') == AI
+    assert field(talking, 'mouth') == MOUTH_OPEN[AI]
+    assert field(talking, 'word') == 0
+    assert field(talking, 'style') == 1
+    # Blending from the open AI shape towards closed MBP
+    blending = avatar.evaluate(10.13, STYLES)
+    assert field(blending, 'viseme') == MBP
+    assert 0 < field(blending, 'mouth') < MOUTH_OPEN[AI]
+
+    # Past the last word, but more may follow
+    waiting = avatar.evaluate(10.25, STYLES)
+    assert field(waiting, 'state') == TALKING and field(waiting, 'word') == NO_WORD
+
+    avatar.finish_speech()
+    assert avatar.evaluate(10.3, STYLES) == values(style=1)
+
+
+def test_appended_segment_continues_the_timeline():
+    avatar = AvatarState('default')
+    avatar.speak(segment([AI], [0], [200], [0]), now=10.0, append=False)
+    # The next words arrive while the first are still being spoken
+    avatar.speak(segment([O], [200], [400], [200]), now=10.1, append=True)
+
+    assert field(avatar.evaluate(10.15, STYLES), 'viseme') == AI
+    later = avatar.evaluate(10.3, STYLES)
+    assert field(later, 'viseme') == O
+    assert field(later, 'word') == 1
+
+
+def test_appended_segment_after_catching_up_resumes_from_now():
+    avatar = AvatarState('default')
+    avatar.speak(segment([AI], [0], [200], [0]), now=10.0, append=False)
+    # Every word was spoken by 10.2; the next ones only arrive at 11.0
+    avatar.speak(segment([O], [200], [400], [200]), now=11.0, append=True)
+
+    # They start playing now rather than being skipped as already past
+    resumed = avatar.evaluate(11.01, STYLES)
+    assert field(resumed, 'state') == TALKING
+    assert field(resumed, 'viseme') == O
+    assert field(resumed, 'word') == 1
+    avatar.finish_speech()
+    assert field(avatar.evaluate(11.25, STYLES), 'state') == IDLE
+
+
+def test_thinking_until_the_first_words():
+    avatar = AvatarState('default')
+    avatar.thinking_until = 20.0
+    assert field(avatar.evaluate(10.0, STYLES), 'state') == THINKING
+    avatar.speak(segment([AI], [0], [100], [0]), now=10.0, append=False)
+    assert field(avatar.evaluate(10.05, STYLES), 'state') == TALKING
@@ -0,0 +1,160 @@
+"""
+Conversation export tests
+Segments written by TurnExporter to a tmp dir, imported back with import_history
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from utils.conversation_export import TurnExporter, import_history, read_turns, seal_orphans, segment_paths
+from utils.history_store import ConversationHistory, SQLiteListClient
+
+
+class Worker:
+    """One process's exporter, published into the shared directory under its own pid"""
+
+    def __init__(self, tmp_path, pid):
+        self.pid = pid
+        self.exporter = TurnExporter(str(tmp_path / f"worker-{pid}"), flush_seconds=0.05)
+
+    def turn(self, uid, text, kind='chat'):
+        self.exporter.record(uid, kind, text, f"re: {text}")
+        # Distinct millisecond timestamps, so the order between workers is known
+        time.sleep(0.005)
+
+    def clear(self, uid):
+        self.exporter.record_clear(uid)
+        time.sleep(0.005)
+
+    def publish(self, directory, stamp):
+        self.exporter.close()
+        [path] = segment_paths(self.exporter.directory)
+        os.replace(path, os.path.join(directory, f"turns-{stamp}-{self.pid}-0001.arrow"))
+
+
+@pytest.fixture
+def export_dir(tmp_path):
+    directory = tmp_path / 'export'
+    directory.mkdir()
+    return str(directory)
+
+
+def make_history(tmp_path, max_turns=50):
+    return ConversationHistory(SQLiteListClient(str(tmp_path / 'history.sqlite3')), max_turns=max_turns)
+
+
+def texts(history, uid):
+    return [record['parts'][0] for record in history.load(uid) if record['role'] == 'user']
+
+
+def test_clear_in_a_later_segment_drops_older_turns(tmp_path, export_dir):
+    first, second = Worker(tmp_path, 1001), Worker(tmp_path, 1002)
+    first.turn('u1', 'before')
+    second.clear('u1')
+    first.turn('u1', 'after')
+    # The segment holding the clear is read after both turns
+    first.publish(export_dir, '20260101T000000')
+    second.publish(export_dir, '20260101T000001')
+
+    history = make_history(tmp_path)
+    result = import_history(history, export_dir)
+
+    assert result == {'users': 1, 'turns': 1, 'skipped': 0}
+    assert texts(history, 'u1') == ['after']
+
+
+def test_turn_from_before_an_earlier_read_clear_is_dropped(tmp_path, export_dir):
+    first, second = Worker(tmp_path, 1001), Worker(tmp_path, 1002)
+    second.turn('u1', 'before')
+    first.clear('u1')
+    second.turn('u1', 'after')
+    first.turn('u2', 'other user')
+    first.publish(export_dir, '20260101T000000')
+    second.publish(export_dir, '20260101T000001')
+
+    history = make_history(tmp_path)
+    import_history(history, export_dir)
+
+    assert texts(history, 'u1') == ['after']
+    assert texts(history, 'u2') == ['other user']
+
+
+def test_users_the_store_has_seen_are_skipped(tmp_path, export_dir):
+    worker = Worker(tmp_path, 1001)
+    for uid in ('u1', 'u2', 'u3'):
+        worker.turn(uid, f"exported {uid}")
+    worker.publish(export_dir, '20260101T000000')
+
+    history = make_history(tmp_path)
+    history.append_turn('u1', 'live', 'reply')
+    # A cleared history is empty but still has a version
+    history.append_turn('u2', 'gone', 'reply')
+    history.clear('u2')
+
+    result = import_history(history, export_dir)
+
+    assert result == {'users': 1, 'turns': 1, 'skipped': 2}
+    assert texts(history, 'u1') == ['live']
+    assert texts(history, 'u2') == []
+    assert texts(history, 'u3') == ['exported u3']
+
+
+def test_only_the_newest_turns_are_kept(tmp_path, export_dir):
+    worker = Worker(tmp_path, 1001)
+    for i in range(10):
+        worker.turn('u1', f"m{i}")
+    worker.turn('u1', 'frame', kind='camera')
+    worker.publish(export_dir, '20260101T000000')
+
+    history = make_history(tmp_path, max_turns=3)
+    result = import_history(history, export_dir)
+
+    # Camera turns are not chat history; the three newest chat turns, in order
+    assert result['turns'] == 3
+    assert texts(history, 'u1') == ['m7', 'm8', 'm9']
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_seal_orphans_recovers_batches_before_a_torn_one(tmp_path, export_dir):
+    exporter = TurnExporter(str(tmp_path / 'crashed'), flush_rows=10 ** 6, flush_seconds=60)
+    exporter.record('u1', 'chat', 'kept', 'reply')
+    exporter.flush()
+    exporter.record('u1', 'chat', 'torn', 'reply')
+    exporter.flush()
+
+    # A worker that died mid-write: its last batch is cut short
+    orphan = os.path.join(export_dir, f"turns-20260101T000000-{dead_pid()}-0001.arrow.partial")
+    shutil.copy(exporter._segment[0], orphan)
+    with open(orphan, 'r+b') as f:
+        f.truncate(os.path.getsize(orphan) - 16)
+    exporter.close()
+
+    assert seal_orphans(export_dir) == 1
+    assert not os.path.exists(orphan)
+    turns = read_turns(export_dir, ['text']).column('text').to_pylist()
+    assert turns == ['kept', 'reply']
+
+
+def test_seal_orphans_leaves_live_writers_alone(tmp_path, export_dir):
+    exporter = TurnExporter(str(tmp_path / 'live'), flush_rows=10 ** 6, flush_seconds=60)
+    exporter.record('u1', 'chat', 'hello', 'reply')
+    exporter.flush()
+    # Another process that is still running (our parent)
+    partial = os.path.join(export_dir, f"turns-20260101T000000-{os.getppid()}-0001.arrow.partial")
+    shutil.copy(exporter._segment[0], partial)
+    exporter.close()
+
+    assert seal_orphans(export_dir) == 0
+    assert os.path.exists(partial)
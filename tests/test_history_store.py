@@ -0,0 +1,126 @@
+"""
+History store tests
+Two SQLiteListClients on one tmp file stand in for two workers sharing a host
+"""
+
+import threading
+
+import pytest
+
+from utils.history_store import ConversationHistory, SQLiteListClient
+
+
+@pytest.fixture
+def clients(tmp_path):
+    path = str(tmp_path / 'history.sqlite3')
+    return SQLiteListClient(path), SQLiteListClient(path)
+
+
+def redis_range(items, start, end):
+    """What Redis LRANGE returns for inclusive, possibly negative indices"""
+    length = len(items)
+    start = max(length + start, 0) if start < 0 else start
+    end = length + end if end < 0 else min(end, length - 1)
+    return items[start:end + 1] if start <= end else []
+
+
+RANGES = [(0, -1), (-3, -1), (2, 4), (-100, 1), (5, 2), (8, 100), (-1, -1), (0, 0), (20, 30), (-2, -5)]
+
+
+@pytest.mark.parametrize('start, end', RANGES)
+def test_lrange_matches_redis(clients, start, end):
+    writer, reader = clients
+    items = [str(i).encode() for i in range(10)]
+    writer.rpush('list', *items)
+    assert reader.lrange('list', start, end) == redis_range(items, start, end)
+
+
+@pytest.mark.parametrize('start, end', RANGES)
+def test_ltrim_matches_redis(clients, start, end):
+    writer, reader = clients
+    items = [str(i).encode() for i in range(10)]
+    writer.rpush('list', *items)
+    writer.ltrim('list', start, end)
+    assert reader.lrange('list', 0, -1) == redis_range(items, start, end)
+    assert reader.llen('list') == len(redis_range(items, start, end))
+
+
+def test_pipeline_is_all_or_nothing(clients):
+    writer, reader = clients
+    writer.set('counter', 'not a number')
+    pipe = writer.pipeline(transaction=True)
+    pipe.rpush('list', b'a', b'b')
+    pipe.incr('counter')
+    with pytest.raises(ValueError):
+        pipe.execute()
+
+    assert reader.llen('list') == 0
+    assert reader.get('counter') == b'not a number'
+
+    pipe = writer.pipeline(transaction=True)
+    pipe.rpush('list', b'a', b'b').ltrim('list', -1, -1).incr('version')
+    assert pipe.execute() == [2, True, 1]
+    assert reader.lrange('list', 0, -1) == [b'b']
+
+
+def test_workers_writing_at_once_lose_nothing(clients):
+    first, second = (ConversationHistory(client, max_turns=5) for client in clients)
+    versions = []
+    lock = threading.Lock()
+
+    def write(history, name):
+        for i in range(20):
+            version = history.append_turn('u1', f"{name} {i}", 'reply')
+            with lock:
+                versions.append(version)
+
+    threads = [threading.Thread(target=write, args=(history, name))
+               for history, name in ((first, 'first'), (second, 'second'))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Every write got its own version, and the list was trimmed as one
+    assert sorted(versions) == list(range(1, 41))
+    history = second.load('u1')
+    assert len(history) == 10
+    assert [record['role'] for record in history] == ['user', 'model'] * 5
+    assert first.position('u1') == (80, 0)
+
+
+def test_version_never_goes_back(clients):
+    first, second = (ConversationHistory(client) for client in clients)
+    first.append_turn('u1', 'hi', 'hello')
+    before = second.version('u1')
+
+    assert second.clear('u1')
+    assert first.version('u1') > before
+    assert not first.exists('u1')
+    # Clearing an empty history still tells other workers to rebuild
+    assert not first.clear('u1')
+    assert second.version('u1') == before + 2
+
+    first.append_turn('u1', 'hi', 'hello')
+    assert second.version('u1') == before + 3
+    assert second.load('u1') == [{'role': 'user', 'parts': ['hi']}, {'role': 'model', 'parts': ['hello']}]
+
+
+def test_summary_position_survives_trimming_and_clears(clients):
+    first, second = (ConversationHistory(client, max_turns=2) for client in clients)
+    for i in range(3):
+        first.append_turn('u1', f"m{i}", f"r{i}")
+
+    # Six records written, the oldest two trimmed away
+    total, clears = second.position('u1')
+    assert (total, clears) == (6, 0)
+    second.save_summary('u1', 'summary of m0 and m1', covers=4, clears=clears)
+
+    summary, history = first.load_context('u1')
+    assert summary == 'summary of m0 and m1'
+    assert [record['parts'][0] for record in history] == ['m2', 'r2']
+
+    first.clear('u1')
+    assert second.position('u1') == (6, 1)
+    assert second.load_context('u1') == (None, [])
+
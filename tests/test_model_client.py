@@ -0,0 +1,194 @@
+"""
+Model client tests
+Run the resilience policy against the local fake Gemini from benchmarks/fakes.py
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from benchmarks.fakes import FakeGenerativeModel, FakeModelTiming
+from utils.model_client import (
+    CircuitBreaker, CircuitOpenError, ModelClient, ModelOverloadedError, ModelTimeoutError
+)
+from utils.scheduler import ModelScheduler
+
+
+def make_model(latency_ms=50):
+    model = FakeGenerativeModel()
+    model.timing = FakeModelTiming(latency_ms=latency_ms, ttfb_ms=latency_ms)
+    return model
+
+
+def make_client(**kwargs):
+    options = dict(timeout=2.0, retries=2, backoff=0.0, max_concurrency=8)
+    options.update(kwargs)
+    return ModelClient(**options)
+
+
+class Flaky:
+    """Fails the first `failures` calls with `error`, then delegates to fn"""
+
+    def __init__(self, fn, failures, error=ConnectionError):
+        self.fn = fn
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error("upstream failed")
+        return self.fn(*args, **kwargs)
+
+
+def test_call_returns_model_reply():
+    client = make_client()
+    response = client.call(make_model().generate_content, "hello there")
+    assert "hello there" in response.text
+    assert client.stats['calls'] == 1
+
+
+def test_stateless_timeout_is_retried():
+    client = make_client(attempt_timeout=0.1)
+    with pytest.raises(ModelTimeoutError):
+        client.call(make_model(latency_ms=300).generate_content, "hi")
+    assert client.stats['retries'] == 2
+    assert client.stats['timeouts'] == 3
+
+
+def test_stateful_timeout_is_not_retried():
+    client = make_client(attempt_timeout=0.1)
+    chat = make_model(latency_ms=300).start_chat()
+    with pytest.raises(ModelTimeoutError):
+        client.call(chat.send_message, "hi", stateful=True)
+    assert client.stats['retries'] == 0
+
+    # The abandoned attempt still completes: the message is in the session once
+    time.sleep(0.4)
+    assert [turn['role'] for turn in chat.history] == ['user', 'model']
+
+
+def test_stateful_call_retries_upstream_errors():
+    client = make_client()
+    chat = make_model().start_chat()
+    send = Flaky(chat.send_message, failures=2)
+    response = client.call(send, "hi", stateful=True)
+    assert response.text
+    assert send.calls == 3
+    assert len(chat.history) == 2
+
+
+def test_non_retryable_error_is_raised_at_once():
+    client = make_client()
+    send = Flaky(make_model().generate_content, failures=1, error=ValueError)
+    with pytest.raises(ValueError):
+        client.call(send, "hi")
+    assert send.calls == 1
+    assert client.breaker.state == 'closed'
+
+
+def test_breaker_opens_and_fails_fast():
+    client = make_client(retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+    send = Flaky(make_model().generate_content, failures=10)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            client.call(send, "hi")
+    with pytest.raises(CircuitOpenError):
+        client.call(send, "hi")
+    assert send.calls == 2
+    assert client.snapshot()['breaker'] == 'open'
+
+
+def test_hedge_answers_from_the_faster_request():
+    client = make_client(hedge_delay=0.05)
+    model = make_model()
+    calls = []
+
+    def generate(prompt):
+        calls.append(prompt)
+        # The first request is stuck upstream, the duplicate is not
+        time.sleep(1.0 if len(calls) == 1 else 0.01)
+        return model.generate_content(prompt)
+
+    model.timing = FakeModelTiming(latency_ms=10, ttfb_ms=10)
+    start = time.monotonic()
+    assert client.call(generate, "hi", hedge=True).text
+    assert time.monotonic() - start < 0.5
+    assert client.stats['hedge_wins'] == 1
+
+
+def test_hedge_takes_its_own_scheduler_slot():
+    scheduler = ModelScheduler(slots=2)
+    model = make_model(latency_ms=200)
+    client = make_client(hedge_delay=0.05)
+
+    with scheduler.admit("default", "u1"):
+        client.call(model.generate_content, "hi", hedge=True,
+                    hedge_slot=lambda: scheduler.try_admit("default", "u1"))
+        assert client.stats['hedged'] == 1
+    time.sleep(0.3)
+    assert scheduler.snapshot()['free'] == 2
+
+
+def test_hedge_is_skipped_without_a_free_scheduler_slot():
+    scheduler = ModelScheduler(slots=1)
+    model = make_model(latency_ms=200)
+    client = make_client(hedge_delay=0.05)
+
+    with scheduler.admit("default", "u1"):
+        client.call(model.generate_content, "hi", hedge=True,
+                    hedge_slot=lambda: scheduler.try_admit("default", "u1"))
+    assert client.stats['hedged'] == 0
+    assert scheduler.snapshot()['free'] == 1
+
+
+def test_stateful_call_is_never_hedged():
+    client = make_client(hedge_delay=0.01)
+    chat = make_model(latency_ms=100).start_chat()
+    client.call(chat.send_message, "hi", hedge=True, stateful=True)
+    assert client.stats['hedged'] == 0
+    assert len(chat.history) == 2
+
+
+def test_async_stateful_timeout_is_not_retried():
+    client = make_client(attempt_timeout=0.1)
+    chat = make_model(latency_ms=300).start_chat()
+
+    async def run():
+        with pytest.raises(ModelTimeoutError):
+            await client.call_async(chat.send_message_async, "hi", stateful=True)
+
+    asyncio.run(run())
+    assert client.stats['retries'] == 0
+
+
+def test_sync_and_async_calls_share_the_concurrency_limit():
+    client = make_client(timeout=0.2, retries=0, max_concurrency=1)
+    model = make_model(latency_ms=400)
+
+    def blocking_call():
+        # Times out, but the slot stays taken until the request returns
+        with pytest.raises(ModelTimeoutError):
+            client.call(model.generate_content, "hi")
+
+    worker = threading.Thread(target=blocking_call)
+    worker.start()
+    time.sleep(0.05)
+
+    async def run():
+        with pytest.raises(ModelOverloadedError):
+            await client.call_async(model.generate_content_async, "hi")
+
+    asyncio.run(run())
+    worker.join()
+    assert client.stats['overloaded'] == 1
+
+    # The slot is back once the blocking request returned
+    time.sleep(0.3)
+    async def run_again():
+        return await client.call_async(make_model().generate_content_async, "hi")
+
+    assert asyncio.run(run_again()).text
@@ -0,0 +1,168 @@
+"""
+Scheduler tests
+Fair-share ordering, share caps, deadline drops and async cancellation
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.scheduler import ModelScheduler, StaleRequestError
+
+
+def wait_until(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.005)
+
+
+def waiting(scheduler, cls):
+    return scheduler.snapshot()['classes'][cls]['waiting']
+
+
+class Waiters:
+    """Queues admit() calls one at a time and records the order they run in"""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.order = []
+        self.threads = []
+
+    def add(self, cls, uid):
+        expected = waiting(self.scheduler, cls) + 1
+        thread = threading.Thread(target=self._run, args=(cls, uid))
+        thread.start()
+        self.threads.append(thread)
+        # Queue in a known order: wait until this one is waiting
+        wait_until(lambda: waiting(self.scheduler, cls) == expected)
+
+    def _run(self, cls, uid):
+        with self.scheduler.admit(cls, uid):
+            self.order.append((cls, uid))
+
+    def join(self):
+        for thread in self.threads:
+            thread.join(timeout=2)
+        return self.order
+
+
+def test_users_in_a_class_take_turns():
+    scheduler = ModelScheduler(slots=1, classes={'chat': {}})
+    release = scheduler.try_admit('chat', 'holder')
+    waiters = Waiters(scheduler)
+    for uid in ('a', 'a', 'a', 'b'):
+        waiters.add('chat', uid)
+
+    release()
+    # b queued last but doesn't wait behind all of a's calls
+    assert [uid for _, uid in waiters.join()] == ['a', 'b', 'a', 'a']
+
+
+def test_classes_share_slots_by_weight():
+    scheduler = ModelScheduler(slots=1, classes={'chat': {'weight': 3}, 'camera': {'weight': 1}})
+    release = scheduler.try_admit('camera', 'holder')
+    waiters = Waiters(scheduler)
+    for i in range(4):
+        waiters.add('camera', f"c{i}")
+        waiters.add('chat', f"u{i}")
+
+    release()
+    order = [cls for cls, _ in waiters.join()]
+    assert order[:4].count('chat') >= 3
+    assert sorted(order) == ['camera'] * 4 + ['chat'] * 4
+
+
+def test_class_is_capped_at_its_share():
+    scheduler = ModelScheduler(slots=4, classes={'chat': {}, 'camera': {'max_share': 0.5}})
+    held = [scheduler.try_admit('camera', 'u1'), scheduler.try_admit('camera', 'u2')]
+    assert all(held)
+
+    # Two slots are free, but camera already holds its half
+    assert scheduler.try_admit('camera', 'u3') is None
+    with pytest.raises(StaleRequestError):
+        with scheduler.admit('camera', 'u3', max_wait=0.05):
+            pass
+    chat = scheduler.try_admit('chat', 'u4')
+    assert chat is not None
+
+    for release in held + [chat]:
+        release()
+    assert scheduler.snapshot()['free'] == 4
+
+
+def test_call_waiting_past_its_deadline_is_dropped():
+    scheduler = ModelScheduler(slots=1, classes={'camera': {'max_wait': 0.05}})
+    release = scheduler.try_admit('camera', 'holder')
+
+    with pytest.raises(StaleRequestError):
+        with scheduler.admit('camera', 'u1'):
+            pass
+    assert scheduler.stats['stale'] == 1
+    assert waiting(scheduler, 'camera') == 0
+
+    release()
+    with scheduler.admit('camera', 'u1'):
+        assert scheduler.snapshot()['free'] == 0
+    assert scheduler.snapshot()['free'] == 1
+
+
+def test_try_admit_does_not_jump_the_queue():
+    scheduler = ModelScheduler(slots=2, classes={'chat': {}})
+    first = scheduler.try_admit('chat', 'u1')
+    second = scheduler.try_admit('chat', 'u2')
+    waiters = Waiters(scheduler)
+    waiters.add('chat', 'u3')
+
+    first()
+    second()
+    waiters.join()
+    assert scheduler.snapshot()['free'] == 2
+    assert scheduler.try_admit('chat', 'u4') is not None
+
+
+def test_cancelled_async_waiter_gives_a_granted_slot_back():
+    scheduler = ModelScheduler(slots=1, classes={'chat': {}})
+
+    async def run():
+        release = scheduler.try_admit('chat', 'holder')
+
+        async def wait_for_slot():
+            async with scheduler.admit_async('chat', 'u1'):
+                pytest.fail("cancelled waiter ran")
+
+        task = asyncio.create_task(wait_for_slot())
+        while waiting(scheduler, 'chat') == 0:
+            await asyncio.sleep(0.005)
+
+        # The slot is granted to the waiter, which is cancelled before it
+        # gets to run: the slot must not leak
+        release()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    snapshot = scheduler.snapshot()
+    assert snapshot['free'] == 1
+    assert snapshot['classes']['chat'] == {'waiting': 0, 'in_flight': 0, 'weight': 1.0}
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    scheduler = ModelScheduler(slots=1, classes={'chat': {}})
+
+    async def run():
+        release = scheduler.try_admit('chat', 'holder')
+        task = asyncio.create_task(scheduler.admit_async('chat', 'u1').__aenter__())
+        while waiting(scheduler, 'chat') == 0:
+            await asyncio.sleep(0.005)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert waiting(scheduler, 'chat') == 0
+        release()
+
+    asyncio.run(run())
+    assert scheduler.snapshot()['free'] == 1
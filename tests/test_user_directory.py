@@ -0,0 +1,119 @@
+"""
+User directory tests
+Batching, caching and invalidation against fake_get_users from benchmarks/fakes.py
+"""
+
+import threading
+import time
+
+from firebase_admin import auth
+
+from benchmarks.fakes import fake_get_users
+from utils.user_directory import MAX_LOOKUP_BATCH, UserDirectory, user_profile
+
+
+class FakeLookup:
+    """firebase_lookup over fake_get_users, recording every backend call"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, keys):
+        self.calls.append(list(keys))
+        identifiers = [
+            auth.UidIdentifier(value) if kind == 'uid' else auth.EmailIdentifier(value)
+            for kind, value in keys
+        ]
+        return [user_profile(record) for record in fake_get_users(identifiers).users]
+
+
+def make_directory(**kwargs):
+    lookup = FakeLookup()
+    options = dict(ttl=60, negative_ttl=60, batch_wait_ms=20)
+    options.update(kwargs)
+    return UserDirectory(lookup=lookup, **options), lookup
+
+
+def test_concurrent_lookups_share_one_call():
+    directory, lookup = make_directory()
+    results = {}
+
+    def get(uid):
+        results[uid] = directory.get_by_uid(uid, timeout=2)
+
+    threads = [threading.Thread(target=get, args=(f"u{i}",)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(lookup.calls) < 5
+    assert sum(len(call) for call in lookup.calls) == 20
+    assert results['u7']['email'] == 'u7@bench.local'
+    directory.close()
+
+
+def test_get_many_splits_into_full_batches():
+    directory, lookup = make_directory()
+    uids = [f"u{i}" for i in range(250)]
+
+    profiles = directory.get_many(uids, timeout=5)
+
+    assert len(profiles) == 250 and all(profiles.values())
+    assert all(len(call) <= MAX_LOOKUP_BATCH for call in lookup.calls)
+    assert len(lookup.calls) == 3
+    directory.close()
+
+
+def test_cached_profile_is_served_until_the_ttl():
+    directory, lookup = make_directory(ttl=0.2)
+    directory.get_by_uid('u1', timeout=2)
+    # Found profiles are cached under their email too
+    assert directory.get_by_email('U1@bench.local', timeout=2)['uid'] == 'u1'
+    assert len(lookup.calls) == 1
+
+    time.sleep(0.3)
+    directory.get_by_uid('u1', timeout=2)
+    assert len(lookup.calls) == 2
+    assert directory.stats['expired'] == 1
+    directory.close()
+
+
+def test_unknown_user_is_cached_for_the_negative_ttl():
+    directory, lookup = make_directory(negative_ttl=0.2)
+    assert directory.get_by_email('nobody@example.com', timeout=2) is None
+    assert directory.get_by_email('nobody@example.com', timeout=2) is None
+    assert len(lookup.calls) == 1
+    assert directory.stats['not_found'] == 1
+
+    time.sleep(0.3)
+    assert directory.get_by_email('nobody@example.com', timeout=2) is None
+    assert len(lookup.calls) == 2
+    directory.close()
+
+
+def test_newer_token_invalidates_the_profile():
+    directory, lookup = make_directory()
+    before = time.time() - 10
+    directory.get_by_uid('u1', timeout=2)
+
+    # A token issued before the fetch leaves the profile alone
+    assert not directory.invalidate('u1', issued_at=before)
+    assert directory.cached('u1') is not None
+
+    assert directory.invalidate('u1', issued_at=time.time() + 1)
+    assert directory.cached('u1') is None
+    directory.get_by_email('u1@bench.local', timeout=2)
+    assert len(lookup.calls) == 2
+    directory.close()
+
+
+def test_cached_never_looks_up():
+    directory, lookup = make_directory()
+    assert directory.cached('u1') is None
+    assert lookup.calls == []
+
+    directory.get_by_uid('u1', timeout=2)
+    assert directory.cached('u1')['uid'] == 'u1'
+    assert len(lookup.calls) == 1
+    directory.close()
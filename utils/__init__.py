@@ -1,7 +1,19 @@
 # Utils package initialization
-from .emotion_detector import EmotionDetector
-from .avatar_generator import AvatarGenerator
-from .speech_handler import SpeechHandler
+# Exports are imported on first access so `import utils.<module>` does not
+# pay for NumPy / onnxruntime / vosk
+_EXPORTS = {
+    'EmotionDetector': '.emotion_detector',
+    'AvatarGenerator': '.avatar_generator',
+    'SpeechHandler': '.speech_handler',
+}
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        import importlib
+        return getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = ['EmotionDetector', 'AvatarGenerator', 'SpeechHandler']
 # utils/__init__.py
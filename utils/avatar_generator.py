@@ -3,44 +3,211 @@ Avatar Generator Utility
 Handles AI avatar rendering and animation
 """
 
+import re
+from functools import lru_cache
+from itertools import accumulate
+
+# Mouth shapes (Preston Blair set); timelines carry the index into this tuple
+VISEMES = ('rest', 'AI', 'E', 'O', 'U', 'MBP', 'FV', 'L', 'WQ', 'etc')
+REST, AI, E, O, U, MBP, FV, L, WQ, ETC = range(len(VISEMES))
+
+# Letter pairs that make one mouth shape; checked before single letters
+_DIGRAPHS = {
+    'th': L, 'sh': ETC, 'ch': ETC, 'ph': FV, 'wh': WQ, 'qu': WQ,
+    'oo': U, 'ou': O, 'ow': O, 'ee': E, 'ea': E, 'ie': E,
+    'ai': AI, 'ay': AI, 'ck': ETC, 'ng': ETC, 'gh': ETC
+}
+_LETTERS = {
+    'a': AI, 'i': AI, 'e': E, 'y': E, 'o': O, 'u': U,
+    'b': MBP, 'm': MBP, 'p': MBP, 'f': FV, 'v': FV,
+    'l': L, 'w': WQ, 'q': WQ
+}
+_VOWELS = set('aeiouy')
+
+# Duration of each mouth shape in ms at speech rate 1.0
+_BASE_MS = {AI: 110, E: 100, O: 110, U: 100, MBP: 80, FV: 80, L: 70, WQ: 80, ETC: 60}
+# Closed-mouth pauses for punctuation
+_PAUSE_MS = {',': 180, ';': 180, ':': 180, '.': 320, '!': 320, '?': 320, '\n': 320}
+
+_TOKEN = re.compile(r"[A-Za-z0-9']+|[,;:]|[.!?]+|\n")
+_BREAKS = set(',;:.!?')
+
+
+def clamp_rate(rate):
+    """Same bounds as SpeechHandler.text_to_speech_config"""
+    return max(0.5, min(2.0, float(rate)))
+
+
+@lru_cache(maxsize=4096)
+def word_visemes(word):
+    """
+    Map one word to mouth shapes
+    Args:
+        word: Word as written
+    Returns:
+        tuple: ((viseme, duration_ms at rate 1.0), ...) with repeats merged
+    """
+    letters = word.lower().replace("'", '')
+    # Silent final 'e' ("make", "love")
+    if len(letters) > 2 and letters.endswith('e') and letters[-2] not in _VOWELS:
+        letters = letters[:-1]
+
+    shapes = []
+    i = 0
+    while i < len(letters):
+        viseme = _DIGRAPHS.get(letters[i:i + 2])
+        if viseme is not None:
+            i += 2
+        else:
+            viseme = _LETTERS.get(letters[i], ETC)
+            i += 1
+        if shapes and shapes[-1][0] == viseme:
+            shapes[-1] = (viseme, shapes[-1][1] + _BASE_MS[viseme] // 2)
+        else:
+            shapes.append((viseme, _BASE_MS[viseme]))
+    return tuple(shapes)
+
+
+def _timeline(text, rate, offset=0.0):
+    """
+    Build columnar lip-sync arrays for a run of text
+    Args:
+        text: Text made of complete words
+        rate: Clamped speech rate
+        offset: Start of this text in ms from the start of speech
+    Returns:
+        tuple: (columns dict, end offset in ms)
+    """
+    visemes, durations = [], []
+    words, word_first, word_last = [], [], []
+    for token in _TOKEN.findall(text):
+        pause = _PAUSE_MS.get(token[0])
+        if pause is not None:
+            if visemes and visemes[-1] == REST:
+                durations[-1] = max(durations[-1], pause)
+            else:
+                visemes.append(REST)
+                durations.append(pause)
+            continue
+        shapes = word_visemes(token)
+        if not shapes:
+            continue
+        words.append(token)
+        word_first.append(len(visemes))
+        visemes.extend(shape[0] for shape in shapes)
+        durations.extend(shape[1] for shape in shapes)
+        word_last.append(len(visemes) - 1)
+
+    # Cumulative boundaries in float ms, rounded once so no drift builds up
+    bounds = [round(b) for b in accumulate((d / rate for d in durations), initial=offset)]
+    starts, ends = bounds[:-1], bounds[1:]
+    columns = {
+        'visemes': visemes,
+        'start': starts,
+        'end': ends,
+        'words': words,
+        'word_start': [starts[i] for i in word_first],
+        'word_end': [ends[j] for j in word_last]
+    }
+    end = offset + sum(durations) / rate
+    return columns, end
+
+
+@lru_cache(maxsize=256)
+def _cached_timeline(text, rate):
+    columns, end = _timeline(text, rate)
+    return {key: tuple(values) for key, values in columns.items()}, round(end)
+
+
+class LipSyncStream:
+    """
+    Incremental lip-sync for a reply that arrives in chunks
+
+    feed() returns the timeline for the words completed by each chunk, with
+    times measured from the start of speech, so animation can begin before
+    the whole reply exists; finish() flushes the last word.
+    """
+
+    def __init__(self, rate=1.0):
+        self.rate = clamp_rate(rate)
+        self._tail = ''
+        self._elapsed = 0.0
+
+    def feed(self, chunk):
+        """
+        Args:
+            chunk: Next fragment of the reply text
+        Returns:
+            dict: Timeline segment (same layout as get_lip_sync_data), or None
+        """
+        text = self._tail + chunk
+        # Only text up to the last space/punctuation is made of finished words
+        cut = len(text)
+        while cut and not (text[cut - 1].isspace() or text[cut - 1] in _BREAKS):
+            cut -= 1
+        self._tail = text[cut:]
+        return self._segment(text[:cut]) if cut else None
+
+    def finish(self):
+        """Timeline for any text left after the last chunk, or None"""
+        text, self._tail = self._tail, ''
+        return self._segment(text)
+
+    def _segment(self, text):
+        columns, self._elapsed = _timeline(text, self.rate, self._elapsed)
+        if not columns['visemes']:
+            return None
+        columns['duration'] = round(self._elapsed)
+        columns['rate'] = self.rate
+        return columns
+
+
 class AvatarGenerator:
     def __init__(self):
         self.avatar_styles = ['default', 'friendly', 'professional', 'playful']
+        # Default for users who haven't picked a style; each live avatar keeps
+        # its own (see utils/avatar_state.py)
         self.current_style = 'default'
-    
-    def generate_avatar_data(self, emotion='neutral', speaking=False):
+
+    def generate_avatar_data(self, emotion='neutral', speaking=False, style=None):
         """
         Generate avatar rendering data
         Args:
             emotion: Current emotion
             speaking: Whether avatar is speaking
+            style: The user's style (default: current_style)
         Returns:
             dict: Avatar state data
         """
         return {
             'emotion': emotion,
             'speaking': speaking,
-            'style': self.current_style,
+            'style': style if style in self.avatar_styles else self.current_style,
             'animation': 'talking' if speaking else 'idle'
         }
-    
+
     def set_style(self, style):
-        """Set avatar style"""
+        """Set the default avatar style"""
         if style in self.avatar_styles:
             self.current_style = style
             return True
         return False
-    
-    def get_lip_sync_data(self, text):
+
+    def get_lip_sync_data(self, text, rate=1.0):
         """
         Generate lip sync timing data
         Args:
             text: Text being spoken
+            rate: Speech rate from SpeechHandler.text_to_speech_config
         Returns:
-            list: Timing data for lip movements
+            dict: Columnar timeline - parallel 'visemes' (indexes into VISEMES),
+                'start' and 'end' arrays in ms, per-word 'words', 'word_start'
+                and 'word_end' arrays, plus total 'duration' and 'rate'
         """
-        words = text.split()
-        return [
-            {'word': word, 'duration': len(word) * 100}
-            for word in words
-        ]
\ No newline at end of file
+        rate = clamp_rate(rate)
+        columns, duration = _cached_timeline(text, rate)
+        return {**columns, 'duration': duration, 'rate': rate}
+
+    def lip_sync_stream(self, rate=1.0):
+        """Incremental lip-sync generator for a streamed reply"""
+        return LipSyncStream(rate)
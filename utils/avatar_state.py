@@ -0,0 +1,371 @@
+"""
+Avatar State Utility
+Per-user avatar state machine driven on a fixed server tick
+
+Each user with an open /ws/avatar connection gets an AvatarState that
+combines their emotion, style, whether the bot is thinking or talking and
+the lip-sync timeline of the reply being spoken. One engine thread
+evaluates every state on a fixed tick; each connection is sent only the
+fields that changed since the last frame it received, packed into a few
+bytes. An idle avatar sends nothing, a talking one a mouth shape and
+openness per tick, and adding fields costs bandwidth only when they change.
+
+Update frame (little-endian):
+    uint8   kind    1 = keyframe (every field), 2 = delta
+    uint16  tick    engine tick, wraps at 65536
+    uint16  mask    bit i set -> FIELDS[i] follows
+    ...             the fields whose bit is set, in FIELDS order
+"""
+
+import logging
+import os
+import struct
+import threading
+import time
+from bisect import bisect_right
+from functools import lru_cache
+
+from .avatar_generator import VISEMES, REST, AI, E, O, U, MBP, FV, L, WQ, ETC, LipSyncStream
+
+logger = logging.getLogger(__name__)
+
+# (name, struct code); append new fields at the end so old clients keep decoding
+FIELDS = (
+    ('state', 'B'),     # index into STATES
+    ('emotion', 'B'),   # index into EMOTIONS
+    ('style', 'B'),     # index into the engine's styles
+    ('viseme', 'B'),    # index into VISEMES
+    ('mouth', 'B'),     # mouth openness 0-255
+    ('word', 'H')       # index of the word being spoken in the reply, NO_WORD when silent
+)
+STATES = ('idle', 'thinking', 'talking')
+IDLE, THINKING, TALKING = range(len(STATES))
+EMOTIONS = ('neutral', 'happy', 'sad', 'angry', 'surprised', 'fearful', 'disgusted')
+NO_WORD = 0xFFFF
+
+KEYFRAME, DELTA = 1, 2
+_HEADER = struct.Struct('<BHH')
+FULL_MASK = (1 << len(FIELDS)) - 1
+
+# Openness per mouth shape, indexed like VISEMES
+MOUTH_OPEN = [0] * len(VISEMES)
+for _viseme, _open in ((AI, 230), (E, 150), (O, 200), (U, 110), (MBP, 0), (FV, 60),
+                       (L, 120), (WQ, 90), (ETC, 100)):
+    MOUTH_OPEN[_viseme] = _open
+# Time to move from one mouth shape to the next
+BLEND_MS = 60
+
+_EMOTION_INDEX = {name: i for i, name in enumerate(EMOTIONS)}
+
+
+@lru_cache(maxsize=None)
+def _frame_struct(mask):
+    return struct.Struct(_HEADER.format + ''.join(
+        code for i, (_, code) in enumerate(FIELDS) if mask >> i & 1
+    ))
+
+
+def pack_update(tick, values, previous=None):
+    """
+    Encode the fields that differ from what the receiver already has
+    Args:
+        tick: Engine tick number
+        values: Field values in FIELDS order
+        previous: Values last sent to this receiver (None: keyframe)
+    Returns:
+        bytes: Update frame, or None if nothing changed
+    """
+    if previous is None:
+        return _frame_struct(FULL_MASK).pack(KEYFRAME, tick & 0xFFFF, FULL_MASK, *values)
+    mask = 0
+    changed = []
+    for i, (value, old) in enumerate(zip(values, previous)):
+        if value != old:
+            mask |= 1 << i
+            changed.append(value)
+    if not mask:
+        return None
+    return _frame_struct(mask).pack(DELTA, tick & 0xFFFF, mask, *changed)
+
+
+def unpack_update(data, previous=None):
+    """
+    Decode an update frame (the client's side of pack_update)
+    Returns:
+        tuple: (kind, tick, values in FIELDS order)
+    """
+    kind, tick, mask = _HEADER.unpack_from(data)
+    values = list(previous or (0,) * len(FIELDS))
+    fields = iter(_frame_struct(mask).unpack(data)[3:])
+    for i in range(len(FIELDS)):
+        if mask >> i & 1:
+            values[i] = next(fields)
+    return kind, tick, tuple(values)
+
+
+class AvatarState:
+    """One user's avatar, shared by all of their connections"""
+
+    def __init__(self, style):
+        self.style = style
+        self.emotion = 0
+        self.thinking_until = 0.0
+        self.subscribers = []
+        self.values = None  # as of the last tick
+        self._clear_timeline()
+
+    def _clear_timeline(self):
+        self._visemes, self._start, self._end, self._word_start = [], [], [], []
+        self._origin = None  # monotonic time the timeline's 0 ms maps to
+        self._open = False   # more segments may follow
+
+    def speak(self, segment, now, append):
+        """Add a lip-sync segment; without append it starts a new timeline"""
+        if not append or self._origin is None:
+            self._clear_timeline()
+            self._origin = now
+        else:
+            end = self._end[-1] if self._end else 0
+            if (now - self._origin) * 1000 > end:
+                # Spoke every word before the next ones arrived: resume from here
+                self._origin = now - end / 1000
+        self._visemes.extend(segment['visemes'])
+        self._start.extend(segment['start'])
+        self._end.extend(segment['end'])
+        self._word_start.extend(segment['word_start'])
+        self._open = True
+        self.thinking_until = 0.0
+
+    def finish_speech(self):
+        self._open = False
+        self.thinking_until = 0.0
+
+    def evaluate(self, now, style_index):
+        """Field values at `now`, in FIELDS order"""
+        state, viseme, mouth, word = IDLE, REST, 0, NO_WORD
+        if self._origin is not None:
+            elapsed = (now - self._origin) * 1000
+            i = bisect_right(self._end, elapsed)
+            if i < len(self._end):
+                state = TALKING
+                viseme = self._visemes[i]
+                target = MOUTH_OPEN[viseme]
+                before = MOUTH_OPEN[self._visemes[i - 1]] if i else 0
+                blend = min(BLEND_MS, (self._end[i] - self._start[i]) / 2) or 1
+                mouth = round(before + (target - before) * min(1.0, max(0.0, elapsed - self._start[i]) / blend))
+                word = min(bisect_right(self._word_start, elapsed) - 1, NO_WORD - 1)
+                if word < 0:
+                    word = NO_WORD
+            elif self._open:
+                # Waiting for the rest of the reply
+                state = TALKING
+            else:
+                self._clear_timeline()
+        if state == IDLE and now < self.thinking_until:
+            state = THINKING
+        return (state, self.emotion, style_index.get(self.style, 0), viseme, mouth, word)
+
+
+class AvatarSpeech:
+    """
+    Feeds one reply into a user's avatar as it is generated
+
+    Usage:
+        with avatar_engine.speech(uid, rate) as speech:
+            for text in chunks:
+                speech.feed(text)
+    The avatar shows 'thinking' until the first words arrive and goes back
+    to idle once they have been spoken; a reply that fails stops after the
+    words that made it. Without a connected avatar every call is a no-op.
+    """
+
+    def __init__(self, engine, uid, rate=1.0):
+        self._engine = engine
+        self.uid = uid
+        self._stream = LipSyncStream(rate) if engine else None
+        self._started = False
+
+    def __enter__(self):
+        if self._stream:
+            deadline = time.monotonic() + self._engine.thinking_timeout
+            self._engine._update(self.uid, setattr, 'thinking_until', deadline)
+        return self
+
+    def feed(self, text):
+        if self._stream:
+            self._push(self._stream.feed(text))
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._stream:
+            if exc_type is None:
+                self._push(self._stream.finish())
+            self._engine._update(self.uid, AvatarState.finish_speech)
+        return False
+
+    def _push(self, segment):
+        if segment:
+            self._engine._update(self.uid, AvatarState.speak, segment, time.monotonic(), self._started)
+            self._started = True
+
+
+class AvatarEngine:
+    def __init__(self, styles, default_style='default', tick_hz=20, thinking_timeout=30.0):
+        """
+        Args:
+            styles: Style names clients may pick (AvatarGenerator.avatar_styles)
+            default_style: Style of a user who hasn't picked one
+            tick_hz: State evaluations per second
+            thinking_timeout: Longest a reply may keep the avatar 'thinking'
+        """
+        self.styles = tuple(styles)
+        self.default_style = default_style
+        self.tick_hz = tick_hz
+        self.thinking_timeout = thinking_timeout
+        self.tick = 0
+        self._style_index = {name: i for i, name in enumerate(self.styles)}
+        self._states = {}  # uid -> AvatarState
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._closed = False
+        self._thread = None
+        self.stats = {'ticks': 0, 'changes': 0, 'late_ticks': 0}
+
+    # ---- connections ----
+
+    def subscribe(self, uid, deliver, style=None):
+        """
+        Start sending a user's avatar state to one connection
+        Args:
+            uid: User id
+            deliver: Called as deliver(tick, values) from the engine thread
+                whenever the state changes; must not block
+            style: Style to switch the user's avatar to (optional)
+        """
+        with self._lock:
+            state = self._states.get(uid)
+            if state is None:
+                state = self._states[uid] = AvatarState(self.default_style)
+            if style in self._style_index:
+                state.style = style
+            state.subscribers.append(deliver)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='avatar-engine', daemon=True)
+                self._thread.start()
+            self._wake.notify()
+            values, tick = state.values, self.tick
+        if values is not None:
+            # The user's other connections are mid-stream; catch this one up
+            deliver(tick, values)
+
+    def unsubscribe(self, uid, deliver):
+        """Stop sending to a connection; the state goes with the last one"""
+        with self._lock:
+            state = self._states.get(uid)
+            if state is None:
+                return
+            if deliver in state.subscribers:
+                state.subscribers.remove(deliver)
+            if not state.subscribers:
+                del self._states[uid]
+
+    def describe(self):
+        """Tables a client needs to decode update frames"""
+        return {
+            'tick_hz': self.tick_hz,
+            'fields': [list(field) for field in FIELDS],
+            'tables': {'state': STATES, 'emotion': EMOTIONS, 'style': self.styles, 'viseme': VISEMES}
+        }
+
+    # ---- inputs ----
+
+    def connected(self, uid):
+        return uid in self._states
+
+    def set_style(self, uid, style):
+        """Switch one user's style; False if the style is unknown"""
+        if style not in self._style_index:
+            return False
+        self._update(uid, setattr, 'style', style)
+        return True
+
+    def set_emotion(self, uid, emotion):
+        self._update(uid, setattr, 'emotion', _EMOTION_INDEX.get(emotion, 0))
+
+    def speech(self, uid, rate=1.0):
+        """AvatarSpeech for a reply to this user (a no-op one if they have no avatar open)"""
+        return AvatarSpeech(self if uid in self._states else None, uid, rate)
+
+    def _update(self, uid, method, *args):
+        with self._lock:
+            state = self._states.get(uid)
+            if state is not None:
+                method(state, *args)
+
+    # ---- engine ----
+
+    def snapshot(self):
+        with self._lock:
+            return dict(
+                self.stats, tick_hz=self.tick_hz, users=len(self._states),
+                connections=sum(len(state.subscribers) for state in self._states.values())
+            )
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._wake.notify_all()
+
+    def _run(self):
+        period = 1.0 / self.tick_hz
+        next_tick = time.monotonic()
+        while True:
+            with self._lock:
+                while not self._states and not self._closed:
+                    self._wake.wait()
+                    next_tick = time.monotonic()
+                if self._closed:
+                    return
+                self.tick += 1
+                now = time.monotonic()
+                changed = []
+                for state in self._states.values():
+                    values = state.evaluate(now, self._style_index)
+                    if values != state.values:
+                        state.values = values
+                        changed.append((values, tuple(state.subscribers)))
+                self.stats['ticks'] += 1
+                self.stats['changes'] += len(changed)
+                tick = self.tick
+
+            for values, subscribers in changed:
+                for deliver in subscribers:
+                    try:
+                        deliver(tick, values)
+                    except Exception as e:
+                        logger.warning("⚠️  Avatar update failed: %s", e)
+
+            next_tick += period
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Fell behind: skip the missed ticks rather than bunch them up
+                self.stats['late_ticks'] += 1
+                next_tick = time.monotonic()
+
+
+def create_avatar_engine(generator):
+    """
+    Build the avatar engine from environment variables
+
+    AVATAR_TICK_HZ              state evaluations (and at most frames) per second
+    AVATAR_THINKING_TIMEOUT     seconds a reply may keep the avatar thinking
+    """
+    engine = AvatarEngine(
+        generator.avatar_styles,
+        default_style=generator.current_style,
+        tick_hz=float(os.getenv('AVATAR_TICK_HZ', 20)),
+        thinking_timeout=float(os.getenv('AVATAR_THINKING_TIMEOUT', 30))
+    )
+    logger.info("✅ Avatar engine: %g Hz", engine.tick_hz)
+    return engine
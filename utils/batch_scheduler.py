@@ -0,0 +1,154 @@
+"""
+Batch Scheduler Utility
+Coalesces concurrent inference requests into micro-batches
+
+Callers on many request threads submit single items and get a Future
+back. A worker thread collects items until the batch is full or the
+oldest item has waited `max_wait_ms`, runs them through the batch
+function in one call, and resolves each caller's Future with its result.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class QueueFullError(RuntimeError):
+    """Raised by submit() when the batcher's queue is at capacity"""
+
+
+class MicroBatcher:
+    def __init__(self, process_batch, max_batch_size=16, max_wait_ms=10, max_queue=1024, name='batcher'):
+        """
+        Args:
+            process_batch: Callable taking a list of items and returning a list
+                of results in the same order
+            max_batch_size: Largest batch handed to process_batch (throughput knob)
+            max_wait_ms: Longest an item waits for company before its batch runs (latency knob)
+            max_queue: Items allowed to wait before submit() starts rejecting
+            name: Worker thread name
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue = max_queue
+
+        self._queue = deque()  # (item, future, enqueued_at)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stats = {
+            'submitted': 0,
+            'rejected': 0,
+            'batches': 0,
+            'items': 0,
+            'errors': 0,
+            'max_queue_depth': 0,
+            'queue_wait_ms_total': 0.0
+        }
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item):
+        """
+        Queue one item for the next batch
+        Returns:
+            Future: Resolves to this item's result
+        Raises:
+            QueueFullError: If max_queue items are already waiting
+        """
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Batcher is closed")
+            if len(self._queue) >= self.max_queue:
+                self._stats['rejected'] += 1
+                raise QueueFullError("Batch queue is full")
+            self._queue.append((item, future, time.monotonic()))
+            self._stats['submitted'] += 1
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], len(self._queue))
+            self._cond.notify()
+        return future
+
+    def stats(self):
+        """Queue depth and batching counters"""
+        with self._cond:
+            batches = self._stats['batches']
+            items = self._stats['items']
+            return {
+                'queue_depth': len(self._queue),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'avg_batch_size': round(items / batches, 2) if batches else 0.0,
+                'avg_queue_wait_ms': round(self._stats['queue_wait_ms_total'] / items, 3) if items else 0.0,
+                **{k: v for k, v in self._stats.items() if k != 'queue_wait_ms_total'}
+            }
+
+    def close(self):
+        """Stop the worker after draining queued items"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+
+            # Wait for more items until the batch fills or the oldest item's deadline passes
+            deadline = self._queue[0][2] + self.max_wait
+            while len(self._queue) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            count = min(len(self._queue), self.max_batch_size)
+            batch = [self._queue.popleft() for _ in range(count)]
+            now = time.monotonic()
+            self._stats['batches'] += 1
+            self._stats['items'] += count
+            self._stats['queue_wait_ms_total'] += sum(now - entry[2] for entry in batch) * 1000
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            # Skip items whose callers already gave up
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.process_batch([entry[0] for entry in batch])
+            except Exception as e:
+                with self._cond:
+                    self._stats['errors'] += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+
+def create_emotion_batcher(detector):
+    """
+    Build the micro-batcher in front of the emotion detector from environment variables
+
+    EMOTION_BATCH_SIZE      max frames per inference batch
+    EMOTION_BATCH_WAIT_MS   max time a frame waits for its batch to fill
+    EMOTION_QUEUE_MAX       max frames waiting before new ones are rejected
+    """
+    return MicroBatcher(
+        detector.detect_emotions,
+        max_batch_size=int(os.getenv('EMOTION_BATCH_SIZE', 16)),
+        max_wait_ms=float(os.getenv('EMOTION_BATCH_WAIT_MS', 10)),
+        max_queue=int(os.getenv('EMOTION_QUEUE_MAX', 256)),
+        name='emotion-batcher'
+    )
@@ -0,0 +1,198 @@
+"""
+Context Window Manager Utility
+Keeps chat history bounded by compacting older turns into a running summary
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .session_store import content_text, content_role, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PREFIX = "[Summary of our earlier conversation]\n"
+SUMMARY_ACK = "Got it, I'll keep that context in mind."
+
+
+def is_summary(content):
+    """Whether a history entry is the synthetic summary turn"""
+    return content_role(content) == 'user' and content_text(content).startswith(SUMMARY_PREFIX)
+
+
+def history_tokens(history):
+    return sum(estimate_tokens(content_text(c)) for c in history)
+
+
+class ContextWindowManager:
+    """
+    Bounds the history resent to the model on every turn
+
+    The last `keep_turns` turns stay verbatim. Once `compact_after` more turns
+    have piled up behind them, a background worker folds the older turns (and
+    any previous summary) into one summary turn; the result is swapped into
+    the session on its next request, so summarization never runs on the
+    request path. `token_budget` is a hard cap enforced by dropping the
+    oldest verbatim turns if the summary hasn't landed yet; it is the only
+    token limit on a session's history.
+
+    With a history store, applied summaries are saved with the records they
+    cover, and load_history() starts rebuilt sessions from the summary plus
+    the newer turns, so a summary outlives the worker that made it.
+    """
+
+    def __init__(self, summarize, keep_turns=6, compact_after=4, token_budget=4000, max_workers=2,
+                 store=None):
+        self.summarize = summarize
+        self.keep_turns = keep_turns
+        self.compact_after = compact_after
+        self.token_budget = token_budget
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='summarize')
+        self._pending = {}  # session_id -> (future, snapshot of compacted entries, stored position)
+        self._lock = threading.Lock()
+        self.stats = {'summaries': 0, 'summary_errors': 0, 'summaries_discarded': 0, 'truncated_turns': 0}
+
+    def load_history(self, session_id):
+        """
+        History to start a session with: the stored summary (if any)
+        followed by the stored turns it doesn't cover
+        """
+        summary, history = self.store.load_context(session_id)
+        if summary is None:
+            return history
+        return self._summary_turns(summary) + history
+
+    def prepare(self, session_id, chat):
+        """
+        Bring a session's history within bounds before sending a message
+        Applies a finished background summary, then enforces the token budget
+        """
+        with self._lock:
+            pending = self._pending.get(session_id)
+            if pending is not None and pending[0].done():
+                del self._pending[session_id]
+            else:
+                pending = None
+        if pending is not None and self._apply_summary(chat, *pending[:2]):
+            self._save_summary(session_id, chat, pending[2])
+        self._enforce_budget(chat)
+
+    def after_turn(self, session_id, chat):
+        """Schedule background compaction once enough turns sit behind the verbatim window"""
+        history = chat.history
+        start = 2 if history and is_summary(history[0]) else 0
+        verbatim_turns = (len(history) - start) // 2
+        if verbatim_turns < self.keep_turns + self.compact_after:
+            return
+
+        with self._lock:
+            if session_id in self._pending:
+                return
+        # Where the snapshot ends in the stored history: keep_turns exchanges before its end
+        position = None
+        if self.store is not None:
+            try:
+                total, clears = self.store.position(session_id)
+                position = (total - self.keep_turns * 2, clears)
+            except Exception as e:
+                logger.warning("⚠️  Could not read history position: %s", e)
+
+        with self._lock:
+            if session_id in self._pending:
+                return
+            snapshot = list(history[:len(history) - self.keep_turns * 2])
+            future = self._executor.submit(self._summarize, snapshot)
+            self._pending[session_id] = (future, snapshot, position)
+
+    def forget(self, session_id):
+        """Drop any pending summary for a cleared session"""
+        with self._lock:
+            self._pending.pop(session_id, None)
+
+    def _summarize(self, snapshot):
+        transcript = []
+        for content in snapshot:
+            text = content_text(content)
+            if is_summary(content):
+                transcript.append(f"Earlier summary: {text[len(SUMMARY_PREFIX):]}")
+            elif not (content_role(content) == 'model' and text == SUMMARY_ACK):
+                transcript.append(f"{content_role(content).title()}: {text}")
+        return self.summarize("\n".join(transcript))
+
+    @staticmethod
+    def _summary_turns(summary):
+        return [
+            {'role': 'user', 'parts': [SUMMARY_PREFIX + summary]},
+            {'role': 'model', 'parts': [SUMMARY_ACK]}
+        ]
+
+    def _apply_summary(self, chat, future, snapshot):
+        """Swap a finished summary into the session; returns whether it was applied"""
+        try:
+            summary = future.result()
+        except Exception as e:
+            self.stats['summary_errors'] += 1
+            logger.warning("⚠️  History summarization failed: %s", e)
+            return False
+
+        history = chat.history
+        # The session may have been trimmed or rebuilt since the snapshot
+        if len(history) < len(snapshot) or any(a is not b for a, b in zip(history, snapshot)):
+            self.stats['summaries_discarded'] += 1
+            return False
+
+        chat.history = self._summary_turns(summary) + list(history[len(snapshot):])
+        self.stats['summaries'] += 1
+        return True
+
+    def _save_summary(self, session_id, chat, position):
+        if self.store is None or position is None:
+            return
+        summary = content_text(chat.history[0])[len(SUMMARY_PREFIX):]
+        try:
+            self.store.save_summary(session_id, summary, *position)
+        except Exception as e:
+            # The session keeps it; a rebuild would resend the older turns
+            logger.warning("⚠️  Could not store history summary: %s", e)
+
+    def _enforce_budget(self, chat):
+        history = list(chat.history)
+        tokens = history_tokens(history)
+        if tokens <= self.token_budget:
+            return
+
+        head = history[:2] if history and is_summary(history[0]) else []
+        body = history[len(head):]
+        dropped = 0
+        while len(body) > 2 and tokens > self.token_budget:
+            tokens -= history_tokens(body[:2])
+            body = body[2:]
+            dropped += 1
+        if dropped:
+            chat.history = head + body
+            self.stats['truncated_turns'] += dropped
+
+
+def create_context_manager(summarize, store=None):
+    """
+    Build the context window manager from environment variables
+
+    CONTEXT_KEEP_TURNS      recent turns always kept verbatim
+    CONTEXT_COMPACT_AFTER   extra turns allowed to pile up before summarizing
+    CONTEXT_TOKEN_BUDGET    hard cap on estimated history tokens per request
+    CONTEXT_SUMMARY_WORKERS background summarization threads
+
+    Args:
+        summarize: Callable turning a transcript into a summary
+        store: ConversationHistory the summaries are saved in (optional)
+    """
+    return ContextWindowManager(
+        summarize,
+        keep_turns=int(os.getenv('CONTEXT_KEEP_TURNS', 6)),
+        compact_after=int(os.getenv('CONTEXT_COMPACT_AFTER', 4)),
+        token_budget=int(os.getenv('CONTEXT_TOKEN_BUDGET', 4000)),
+        max_workers=int(os.getenv('CONTEXT_SUMMARY_WORKERS', 2)),
+        store=store
+    )
@@ -0,0 +1,453 @@
+"""
+Conversation Export Utility
+Appends finished turns to rotating columnar segments for offline analytics
+
+Turns are queued by the request thread and written in batches by a
+background thread to append-only Arrow IPC (default) or Parquet segment
+files, one row per message. A segment is written as `*.partial` and
+renamed when it rotates, so readers only ever see complete files, which
+they can memory-map. Each process writes its own segments (the pid is in
+the file name), so gunicorn workers never share a writer.
+
+The same segments can be imported back into the conversation history
+store, e.g. to rebuild a fresh Redis or SQLite store at startup. History
+clears are exported too (a 'clear' row), so a cleared conversation is
+not brought back.
+"""
+
+import atexit
+import glob
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+try:
+    import pyarrow as pa
+except ImportError:  # export is optional
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+# File extension per segment format
+EXTENSIONS = {'arrow': '.arrow', 'parquet': '.parquet'}
+
+# One row per message: the user's turn, then the model's reply. A history
+# clear is a single row of kind 'clear' with no role or text
+COLUMNS = ['uid', 'ts', 'kind', 'role', 'text', 'latency_ms', 'emotion', 'cached']
+
+
+def turn_schema():
+    """Arrow schema of an exported segment"""
+    return pa.schema([
+        ('uid', pa.string()),
+        ('ts', pa.timestamp('ms', tz='UTC')),
+        ('kind', pa.string()),          # chat, speech, camera, clear
+        ('role', pa.string()),          # user, model
+        ('text', pa.string()),
+        ('latency_ms', pa.float32()),   # model rows: time to the full reply
+        ('emotion', pa.string()),       # camera turns
+        ('cached', pa.bool_())          # reply served from a cache / reused
+    ])
+
+
+class TurnExporter:
+    def __init__(self, directory, fmt='arrow', segment_rows=100000, segment_seconds=3600,
+                 flush_rows=512, flush_seconds=2.0, max_queue=20000):
+        """
+        Args:
+            directory: Where segments are written
+            fmt: 'arrow' (IPC file) or 'parquet'
+            segment_rows: Rotate a segment after this many rows
+            segment_seconds: Rotate a segment after this long
+            flush_rows: Rows that trigger a write before flush_seconds is up
+            flush_seconds: Longest a queued row waits to be written
+            max_queue: Rows allowed to wait; beyond this new turns are dropped
+        """
+        if fmt not in EXTENSIONS:
+            raise ValueError(f"Unknown export format {fmt!r}")
+        self.directory = directory
+        self.fmt = fmt
+        self.segment_rows = segment_rows
+        self.segment_seconds = segment_seconds
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.max_queue = max_queue
+        self.schema = turn_schema()
+        os.makedirs(directory, exist_ok=True)
+
+        self._queue = deque()  # row tuples in COLUMNS order
+        self._cond = threading.Condition()
+        self._closed = False
+        self._segment = None  # [path, writer, sink, opened_at, rows]
+        self._write_lock = threading.Lock()  # the writer thread and flush()/close()
+        self._sequence = 0
+        self.stats = {'rows': 0, 'batches': 0, 'segments': 0, 'dropped': 0, 'errors': 0}
+        self._worker = threading.Thread(target=self._run, name='turn-exporter', daemon=True)
+        self._worker.start()
+        # Seal the open segment on a clean shutdown
+        atexit.register(self.close)
+
+    def record(self, uid, kind, user_text, reply, latency=None, emotion=None, cached=False):
+        """
+        Queue one finished turn (never blocks on I/O)
+        Args:
+            uid: Firebase user UID
+            kind: 'chat', 'speech' or 'camera'
+            user_text: What the user said
+            reply: The model's reply
+            latency: Seconds the reply took, if measured
+            emotion: Emotion the reply was based on (camera)
+            cached: The reply came from a cache / was reused
+        Returns:
+            bool: False if the turn was dropped because the queue is full
+        """
+        now = time.time()
+        latency_ms = latency * 1000 if latency is not None else None
+        # The user's row is stamped when the turn started, so rows sort in order
+        started = now - latency if latency else now
+        rows = (
+            (uid, int(started * 1000), kind, 'user', user_text, None, emotion, cached),
+            (uid, int(now * 1000), kind, 'model', reply, latency_ms, emotion, cached)
+        )
+        return self._enqueue(rows)
+
+    def record_clear(self, uid):
+        """Queue a history clear, so importing the segments doesn't restore older turns"""
+        return self._enqueue(((uid, int(time.time() * 1000), 'clear', None, None, None, None, False),))
+
+    def _enqueue(self, rows):
+        with self._cond:
+            if self._closed or len(self._queue) + len(rows) > self.max_queue:
+                self.stats['dropped'] += len(rows)
+                return False
+            self._queue.extend(rows)
+            if len(self._queue) >= self.flush_rows:
+                self._cond.notify()
+        return True
+
+    def flush(self):
+        """Write everything queued so far (blocking)"""
+        with self._cond:
+            rows = list(self._queue)
+            self._queue.clear()
+        self._write(rows)
+
+    def close(self):
+        """Write queued turns and seal the current segment"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join()
+        self._seal()
+
+    def snapshot(self):
+        """Counters plus the current queue depth for /health"""
+        with self._cond:
+            return dict(self.stats, queue_depth=len(self._queue), format=self.fmt)
+
+    # ---- writer thread ----
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._queue) < self.flush_rows:
+                    self._cond.wait(self.flush_seconds)
+                rows = list(self._queue)
+                self._queue.clear()
+                closed = self._closed
+            self._write(rows)
+            if self._segment and time.monotonic() - self._segment[3] >= self.segment_seconds:
+                self._seal()
+            if closed:
+                return
+
+    def _write(self, rows):
+        if not rows:
+            return
+        with self._write_lock:
+            self._write_rows(rows)
+
+    def _write_rows(self, rows):
+        try:
+            columns = list(zip(*rows))
+            batch = pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+                schema=self.schema
+            )
+            if self._segment is None:
+                self._open()
+            self._segment[1].write_batch(batch)
+            self._segment[4] += len(rows)
+            self.stats['rows'] += len(rows)
+            self.stats['batches'] += 1
+            if self._segment[4] >= self.segment_rows:
+                self._seal_segment()
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.warning("❌ Conversation export failed, %d rows lost: %s", len(rows), e)
+
+    def _open(self):
+        self._sequence += 1
+        name = f"turns-{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{os.getpid()}-{self._sequence:04d}"
+        path = os.path.join(self.directory, name + EXTENSIONS[self.fmt] + '.partial')
+        if self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            sink, writer = None, pq.ParquetWriter(path, self.schema, compression='zstd')
+        else:
+            sink = pa.OSFile(path, 'wb')
+            writer = pa.ipc.new_file(sink, self.schema)
+        self._segment = [path, writer, sink, time.monotonic(), 0]
+
+    def _seal(self):
+        with self._write_lock:
+            self._seal_segment()
+
+    def _seal_segment(self):
+        """Finish the current segment and publish it under its final name"""
+        if self._segment is None:
+            return
+        path, writer, sink = self._segment[:3]
+        self._segment = None
+        try:
+            writer.close()
+            if sink is not None:
+                sink.close()
+            os.replace(path, path[:-len('.partial')])
+            self.stats['segments'] += 1
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.warning("❌ Could not seal export segment %s: %s", path, e)
+
+
+# ============================================
+# READING / IMPORT
+# ============================================
+def segment_paths(directory):
+    """Sealed segments in write order (names start with a UTC timestamp)"""
+    paths = []
+    for extension in EXTENSIONS.values():
+        paths.extend(glob.glob(os.path.join(directory, '*' + extension)))
+    return sorted(paths, key=os.path.basename)
+
+
+def read_segment(path):
+    """
+    Load one segment as an Arrow table, memory-mapped where possible
+    """
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.read_table(path, memory_map=True)
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def iter_segment_batches(path, columns=None):
+    """
+    Record batches of one segment, one at a time (Arrow files are
+    memory-mapped, so nothing beyond the batch in use is loaded)
+    """
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        yield from pq.ParquetFile(path, memory_map=True).iter_batches(columns=columns)
+        return
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            yield batch.select(columns) if columns else batch
+
+
+def read_turns(directory, columns=None):
+    """
+    All exported turns as one Arrow table (for analytics; loads every segment)
+    Args:
+        directory: Export directory
+        columns: Subset of COLUMNS to load (default: all)
+    """
+    tables = [read_segment(path) for path in segment_paths(directory)]
+    if not tables:
+        return turn_schema().empty_table().select(columns or COLUMNS)
+    table = pa.concat_tables(tables)
+    return table.select(columns) if columns else table
+
+
+def import_history(history, directory, kinds=('chat', 'speech')):
+    """
+    Rebuild conversation history from exported segments
+
+    Only users the store has never seen are filled in (a cleared history
+    still has a version), so importing into a live store never duplicates
+    or restores turns. Turns from before a user's last exported clear are
+    dropped. Camera turns are not part of the chat history and are skipped
+    by default.
+
+    Segments are read one record batch at a time, and only each user's
+    newest turns (as many as the store keeps) are held until the end.
+
+    Args:
+        history: ConversationHistory to fill
+        directory: Export directory
+        kinds: Turn kinds to import
+    Returns:
+        dict: {'users': imported, 'turns': imported, 'skipped': users with history}
+    """
+    keep = history.max_records // 2
+    newest = {}   # uid -> min-heap of (ts, seq, user_text, model_text), at most `keep`
+    cleared = {}  # uid -> ts of the last clear
+    seq = 0
+
+    for path in segment_paths(directory):
+        # A turn's two rows are always written next to each other in one batch
+        for batch in iter_segment_batches(path, ['uid', 'ts', 'kind', 'role', 'text']):
+            previous = None
+            for row in zip(*(column.to_pylist() for column in batch.columns)):
+                uid, ts, kind, role, text = row
+                if kind == 'clear':
+                    cleared[uid] = max(ts, cleared.get(uid, ts))
+                    if uid in newest:
+                        # Segments of different workers overlap in time; drop
+                        # anything already kept that the clear came after
+                        newest[uid] = [turn for turn in newest[uid] if turn[0] > cleared[uid]]
+                        heapq.heapify(newest[uid])
+                elif (role == 'model' and previous and previous[3] == 'user'
+                        and previous[0] == uid and kind in kinds
+                        and (uid not in cleared or previous[1] > cleared[uid])):
+                    seq += 1
+                    turns = newest.setdefault(uid, [])
+                    turn = (previous[1], seq, previous[4], text)
+                    if len(turns) < keep:
+                        heapq.heappush(turns, turn)
+                    elif turn > turns[0]:
+                        heapq.heapreplace(turns, turn)
+                previous = row
+
+    result = {'users': 0, 'turns': 0, 'skipped': 0}
+    for uid, turns in newest.items():
+        if not turns:
+            continue
+        if history.version(uid):
+            result['skipped'] += 1
+            continue
+        turns.sort()
+        result['turns'] += history.import_turns(uid, [turn[2:] for turn in turns])
+        result['users'] += 1
+    return result
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def seal_orphans(directory):
+    """
+    Publish the segments of processes that died without closing them
+
+    An Arrow IPC file is a stream plus a footer, so every batch written
+    before the crash is recovered; unfinished Parquet files can't be read
+    and are left in place.
+    Returns:
+        int: Segments sealed
+    """
+    sealed = 0
+    for path in glob.glob(os.path.join(directory, '*.arrow.partial')):
+        try:
+            pid = int(os.path.basename(path).split('-')[2])
+        except (IndexError, ValueError):
+            continue
+        if pid != os.getpid() and _pid_alive(pid):
+            continue
+        batches = []
+        with pa.memory_map(path) as source:
+            buffer = source.read_buffer()
+            try:
+                # Skip the 8-byte file magic; a torn last message ends the read
+                for batch in pa.ipc.open_stream(pa.BufferReader(buffer.slice(8))):
+                    batches.append(batch)
+            except (pa.ArrowInvalid, OSError):
+                pass
+        if batches:
+            final = path[:-len('.partial')]
+            with pa.OSFile(final + '.tmp', 'wb') as sink, pa.ipc.new_file(sink, turn_schema()) as writer:
+                for batch in batches:
+                    writer.write_batch(batch)
+            os.replace(final + '.tmp', final)
+            sealed += 1
+        os.remove(path)
+    if sealed:
+        logger.info("✅ Sealed %d export segments left by stopped processes", sealed)
+    return sealed
+
+
+def import_on_startup():
+    """
+    Seal segments of stopped processes, then import exported turns into the
+    history store when EXPORT_IMPORT_ON_START=1
+
+    Run once per deployment, before workers start taking traffic (the
+    gunicorn master or `python app.py`).
+    Returns:
+        dict: import_history() result, or None if not importing
+    """
+    directory = os.getenv('EXPORT_DIR')
+    if not directory or not os.path.isdir(directory):
+        return None
+    importing = os.getenv('EXPORT_IMPORT_ON_START', '0') == '1'
+    if pa is None:
+        if importing:
+            logger.warning("⚠️  EXPORT_IMPORT_ON_START set but pyarrow not installed - skipping import")
+        return None
+
+    seal_orphans(directory)
+    if not importing:
+        return None
+
+    from .history_store import create_history_store
+    start = time.perf_counter()
+    result = import_history(create_history_store(), directory)
+    logger.info("✅ Imported exported conversations", extra=dict(
+        result, seconds=round(time.perf_counter() - start, 2)
+    ))
+    return result
+
+
+def create_turn_exporter():
+    """
+    Build the conversation exporter from environment variables
+
+    EXPORT_DIR              directory for segments (export is off when unset)
+    EXPORT_FORMAT           arrow (IPC file, default) or parquet
+    EXPORT_SEGMENT_ROWS     rows per segment before rotating
+    EXPORT_SEGMENT_SECONDS  max segment age before rotating
+    EXPORT_FLUSH_ROWS       queued rows that trigger a write
+    EXPORT_FLUSH_SECONDS    max time a turn waits to be written
+    Returns:
+        TurnExporter, or None when disabled / pyarrow is missing
+    """
+    directory = os.getenv('EXPORT_DIR')
+    if not directory:
+        return None
+    if pa is None:
+        logger.warning("⚠️  EXPORT_DIR set but pyarrow not installed - conversation export disabled")
+        return None
+
+    exporter = TurnExporter(
+        directory,
+        fmt=os.getenv('EXPORT_FORMAT', 'arrow').lower(),
+        segment_rows=int(os.getenv('EXPORT_SEGMENT_ROWS', 100000)),
+        segment_seconds=float(os.getenv('EXPORT_SEGMENT_SECONDS', 3600)),
+        flush_rows=int(os.getenv('EXPORT_FLUSH_ROWS', 512)),
+        flush_seconds=float(os.getenv('EXPORT_FLUSH_SECONDS', 2))
+    )
+    logger.info("✅ Conversation export: %s segments in %s", exporter.fmt, directory)
+    return exporter
@@ -1,12 +1,202 @@
 """
 Emotion Detection Utility
 Handles emotion recognition from images and video frames
+
+Inference runs on the CPU. Each stage uses an ONNX Runtime model when one
+is configured (an UltraFace-style face detector and a FER+ style
+expression classifier) and otherwise falls back to NumPy (skin-tone face
+localisation and a linear expression classifier loaded from .npz).
+Models are loaded once, when the detector is created.
 """
 
+import base64
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:  # emotion detection is optional
+    np = None
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'models')
+
+# Detector input size (width, height) - UltraFace RFB-320 layout
+DETECT_SIZE = (320, 240)
+# Classifier input edge - FER+ layout (64x64 grayscale)
+FACE_SIZE = 64
+
+# FER+ output order, folded onto TalkBot's emotion names (contempt -> disgusted)
+FERPLUS_LABELS = ['neutral', 'happy', 'surprised', 'sad', 'angry', 'disgusted', 'fearful', 'disgusted']
+
+
+def _softmax(logits):
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def _session(path, threads):
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+
+def _run_batched(session, batch):
+    """Run an ONNX session over a batch, splitting it if the model has a fixed batch of 1"""
+    model_input = session.get_inputs()[0]
+    if model_input.shape[0] == 1 and len(batch) > 1:
+        results = [session.run(None, {model_input.name: batch[i:i + 1]}) for i in range(len(batch))]
+        return [np.concatenate(parts, axis=0) for parts in zip(*results)]
+    return session.run(None, {model_input.name: batch})
+
+
+# ========================================
+# FACE DETECTORS
+# ========================================
+class OnnxFaceDetector:
+    """UltraFace-style detector: outputs (scores [N,K,2], boxes [N,K,4] normalized)"""
+
+    name = 'onnx'
+
+    def __init__(self, path, threads, threshold=0.7):
+        self.session = _session(path, threads)
+        self.threshold = threshold
+
+    def detect(self, batch):
+        """
+        Args:
+            batch: uint8 array [N, H, W, 3] at DETECT_SIZE
+        Returns:
+            list: (x0, y0, x1, y1) pixel box of the most confident face, or None, per image
+        """
+        tensor = (batch.astype(np.float32) - 127.0) / 128.0
+        tensor = np.ascontiguousarray(tensor.transpose(0, 3, 1, 2))
+        scores, boxes = _run_batched(self.session, tensor)[:2]
+
+        width, height = DETECT_SIZE
+        best = scores[:, :, 1].argmax(axis=1)
+        faces = []
+        for i, k in enumerate(best):
+            if scores[i, k, 1] < self.threshold:
+                faces.append(None)
+                continue
+            x0, y0, x1, y1 = (np.clip(boxes[i, k], 0.0, 1.0) * [width, height, width, height]).astype(int)
+            faces.append((x0, y0, x1, y1) if x1 - x0 > 1 and y1 - y0 > 1 else None)
+        return faces
+
+
+class NumpyFaceDetector:
+    """
+    Lightweight skin-tone localiser (YCbCr thresholds, vectorized over the batch)
+
+    Good enough to find the dominant face in a webcam frame; configure an
+    ONNX detector for crowded or poorly lit scenes.
+    """
+
+    name = 'numpy'
+
+    def __init__(self, min_fraction=0.02):
+        self.min_fraction = min_fraction
+
+    def detect(self, batch):
+        rgb = batch.astype(np.float32)
+        r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+        cb = 128.0 - 0.168736 * r - 0.331264 * g + 0.5 * b
+        cr = 128.0 + 0.5 * r - 0.418688 * g - 0.081312 * b
+        mask = (cb >= 77) & (cb <= 127) & (cr >= 133) & (cr <= 173)
+
+        faces = []
+        height, width = mask.shape[1:]
+        for image_mask in mask:
+            if image_mask.mean() < self.min_fraction:
+                faces.append(None)
+                continue
+            # Keep rows/columns with a meaningful share of skin pixels
+            rows = np.flatnonzero(image_mask.mean(axis=1) > 0.1)
+            cols = np.flatnonzero(image_mask.mean(axis=0) > 0.1)
+            if len(rows) == 0 or len(cols) == 0:
+                faces.append(None)
+                continue
+            y0, y1 = rows[0], rows[-1] + 1
+            x0, x1 = cols[0], cols[-1] + 1
+            # Faces are roughly as tall as they are wide; drop necks/shoulders
+            y1 = min(y1, y0 + int((x1 - x0) * 1.3))
+            faces.append((int(x0), int(y0), int(min(x1, width)), int(min(y1, height))))
+        return faces
+
+
+# ========================================
+# EXPRESSION CLASSIFIERS
+# ========================================
+class OnnxExpressionClassifier:
+    """FER+ style classifier: input [N,1,64,64] grayscale 0-255, output 8 logits"""
+
+    name = 'onnx'
+
+    def __init__(self, path, threads, emotions):
+        self.session = _session(path, threads)
+        self.emotions = emotions
+        self._fold = np.zeros((len(FERPLUS_LABELS), len(emotions)), dtype=np.float32)
+        for i, label in enumerate(FERPLUS_LABELS):
+            self._fold[i, emotions.index(label)] = 1.0
+
+    def classify(self, faces):
+        """
+        Args:
+            faces: float32 array [N, 64, 64] grayscale 0-255
+        Returns:
+            float32 array [N, len(emotions)] of probabilities
+        """
+        logits = _run_batched(self.session, faces[:, None, :, :])[0]
+        return _softmax(logits.astype(np.float32)) @ self._fold
+
+
+class NumpyExpressionClassifier:
+    """
+    Linear softmax classifier loaded from an .npz file
+
+    Expected arrays: W [4096, C], b [C], labels [C] (emotion names), and
+    optionally mean/std used to standardize the flattened 64x64 face.
+    """
+
+    name = 'numpy'
+
+    def __init__(self, path, emotions):
+        weights = np.load(path)
+        self.W = weights['W'].astype(np.float32)
+        self.b = weights['b'].astype(np.float32)
+        self.mean = float(weights['mean']) if 'mean' in weights else 0.0
+        self.std = float(weights['std']) if 'std' in weights else 255.0
+        labels = [str(label) for label in weights['labels']] if 'labels' in weights else emotions
+        self._fold = np.zeros((len(labels), len(emotions)), dtype=np.float32)
+        for i, label in enumerate(labels):
+            self._fold[i, emotions.index(label)] = 1.0
+
+    def classify(self, faces):
+        x = (faces.reshape(len(faces), -1) - self.mean) / self.std
+        return _softmax(x @ self.W + self.b) @ self._fold
+
+
+# ========================================
+# DETECTOR
+# ========================================
 class EmotionDetector:
-    def __init__(self):
+    def __init__(self, face_model=None, classifier_model=None, threads=None):
         self.emotions = [
-            'happy', 'sad', 'angry', 'surprised', 
+            'happy', 'sad', 'angry', 'surprised',
             'neutral', 'fearful', 'disgusted'
         ]
         self.emotion_emojis = {
@@ -18,7 +208,114 @@ class EmotionDetector:
             'fearful': '😨',
             'disgusted': '🤢'
         }
-    
+        self.threads = threads or os.cpu_count() or 1
+        self.face_detector = None
+        self.classifier = None
+        self._pool = None
+
+        if np is None:
+            logger.warning("⚠️  NumPy not installed - server-side emotion detection disabled")
+            return
+        try:
+            self.face_detector = self._load_face_detector(face_model)
+            self.classifier = self._load_classifier(classifier_model)
+        except Exception as e:
+            logger.error("❌ Error loading emotion models: %s", e)
+            self.classifier = None
+
+        if self.classifier is not None:
+            # Decode/resize work runs here; PIL releases the GIL while resizing
+            self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='emotion')
+            logger.info(
+                "✅ Emotion detector ready: %s face detector, %s classifier, %d threads",
+                self.face_detector.name, self.classifier.name, self.threads
+            )
+
+    def _load_face_detector(self, path):
+        if path and path.endswith('.onnx') and os.path.exists(path):
+            if ort is None:
+                logger.warning("⚠️  onnxruntime not installed - using NumPy face detector")
+            else:
+                return OnnxFaceDetector(path, self.threads)
+        return NumpyFaceDetector()
+
+    def _load_classifier(self, path):
+        if not path or not os.path.exists(path):
+            return None
+        if path.endswith('.onnx'):
+            if ort is None:
+                logger.warning("⚠️  onnxruntime not installed - cannot load expression classifier")
+                return None
+            return OnnxExpressionClassifier(path, self.threads, self.emotions)
+        return NumpyExpressionClassifier(path, self.emotions)
+
+    @property
+    def available(self):
+        """Whether a real expression classifier is loaded"""
+        return self.classifier is not None
+
+    @staticmethod
+    def _to_array(image):
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            image = Image.open(io.BytesIO(image))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return np.asarray(image.resize(DETECT_SIZE, Image.BILINEAR), dtype=np.uint8)
+
+    def detect_emotions(self, images):
+        """
+        Detect emotions for a batch of images in one pass
+        Args:
+            images: List of PIL Images or encoded image bytes
+        Returns:
+            list: One result dict per image (see detect_emotion)
+        """
+        if not images:
+            return []
+        if not self.available:
+            return [self._no_face_result() for _ in images]
+
+        batch = np.stack(list(self._pool.map(self._to_array, images)))
+        boxes = self.face_detector.detect(batch)
+
+        face_indices = [i for i, box in enumerate(boxes) if box is not None]
+        probabilities = {}
+        if face_indices:
+            faces = np.empty((len(face_indices), FACE_SIZE, FACE_SIZE), dtype=np.float32)
+            for row, i in enumerate(face_indices):
+                x0, y0, x1, y1 = boxes[i]
+                crop = Image.fromarray(batch[i, y0:y1, x0:x1]).convert('L')
+                faces[row] = np.asarray(crop.resize((FACE_SIZE, FACE_SIZE), Image.BILINEAR), dtype=np.float32)
+            for row, scores in zip(face_indices, self.classifier.classify(faces)):
+                probabilities[row] = scores
+
+        results = []
+        for i, box in enumerate(boxes):
+            if box is None:
+                results.append(self._no_face_result())
+                continue
+            scores = probabilities[i]
+            best = int(scores.argmax())
+            results.append({
+                'emotion': self.emotions[best],
+                'confidence': round(float(scores[best]), 4),
+                'all_emotions': {
+                    emotion: round(float(score), 4) for emotion, score in zip(self.emotions, scores)
+                },
+                'face_detected': True,
+                'box': [int(v) for v in box]
+            })
+        return results
+
+    @staticmethod
+    def _no_face_result():
+        return {
+            'emotion': 'neutral',
+            'confidence': 0.0,
+            'all_emotions': {},
+            'face_detected': False
+        }
+
     def detect_emotion(self, image):
         """
         Detect emotion from image
@@ -27,22 +324,12 @@ class EmotionDetector:
         Returns:
             dict: Emotion probabilities
         """
-        # Placeholder for actual emotion detection
-        # In production, integrate with TensorFlow/PyTorch model
-        return {
-            'emotion': 'happy',
-            'confidence': 0.85,
-            'all_emotions': {
-                'happy': 0.85,
-                'neutral': 0.10,
-                'surprised': 0.05
-            }
-        }
-    
+        return self.detect_emotions([image])[0]
+
     def get_emoji(self, emotion):
         """Get emoji for emotion"""
         return self.emotion_emojis.get(emotion, '😐')
-    
+
     def analyze_frame(self, frame_data):
         """
         Analyze video frame for emotions
@@ -51,9 +338,32 @@ class EmotionDetector:
         Returns:
             dict: Analysis results
         """
+        try:
+            encoded = frame_data.split(',', 1)[1] if ',' in frame_data else frame_data
+            result = self.detect_emotion(base64.b64decode(encoded))
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
         return {
-            'success': True,
-            'emotion': 'happy',
-            'emoji': '😊',
-            'confidence': 0.85
-        }
\ No newline at end of file
+            'success': result['face_detected'],
+            'emotion': result['emotion'],
+            'emoji': self.get_emoji(result['emotion']),
+            'confidence': result['confidence']
+        }
+
+
+def create_emotion_detector():
+    """
+    Build the emotion detector from environment variables
+
+    EMOTION_FACE_MODEL         face detector .onnx (default: models/face_detector.onnx,
+                               NumPy skin-tone detector if missing)
+    EMOTION_CLASSIFIER_MODEL   expression classifier .onnx or .npz
+                               (default: models/emotion_classifier.onnx)
+    EMOTION_THREADS            inference/preprocessing threads (default: CPU count)
+    """
+    threads = os.getenv('EMOTION_THREADS')
+    return EmotionDetector(
+        face_model=os.getenv('EMOTION_FACE_MODEL', os.path.join(MODELS_DIR, 'face_detector.onnx')),
+        classifier_model=os.getenv('EMOTION_CLASSIFIER_MODEL', os.path.join(MODELS_DIR, 'emotion_classifier.onnx')),
+        threads=int(threads) if threads else None
+    )
@@ -4,21 +4,38 @@ Firebase Authentication Helper for TalkBot Backend
 Verifies Firebase ID tokens sent from the frontend
 """
 
-import firebase_admin
-from firebase_admin import credentials, auth
 from functools import wraps
 from flask import request, jsonify
+from collections import OrderedDict
+import asyncio
+import hashlib
+import logging
 import os
+import threading
+import time
+
+from .metrics import AUTH_LATENCY
+from .services import LazyService
+from .user_directory import create_user_directory
+
+logger = logging.getLogger(__name__)
+
+# Public keys used to sign Firebase ID tokens
+ID_TOKEN_CERT_URL = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
 
 # ========================================
 # INITIALIZE FIREBASE ADMIN SDK
 # ========================================
 def initialize_firebase():
     """Initialize Firebase Admin SDK with service account"""
+    # The Admin SDK (and google-auth under it) is imported on first use
+    import firebase_admin
+    from firebase_admin import credentials
     try:
         # Check if already initialized
         firebase_admin.get_app()
-        print("✅ Firebase Admin SDK already initialized")
+        logger.info("✅ Firebase Admin SDK already initialized")
+        start_public_key_refresher()
         return True
     except ValueError:
         # Not initialized yet, so initialize it
@@ -26,20 +43,148 @@ def initialize_firebase():
             # Path to service account key
             cred_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'serviceAccountKey.json')
             
+            if not os.path.exists(cred_path) and os.getenv('FIREBASE_AUTH_EMULATOR_HOST'):
+                # The Auth emulator needs no credentials, only a project id
+                firebase_admin.initialize_app(options={
+                    'projectId': os.getenv('FIREBASE_PROJECT_ID', 'demo-talkbot')
+                })
+                logger.warning("⚠️  Using Firebase Auth emulator at %s", os.getenv('FIREBASE_AUTH_EMULATOR_HOST'))
+                return True
+            
             if not os.path.exists(cred_path):
-                print("⚠️  WARNING: serviceAccountKey.json not found!")
-                print(f"   Expected location: {cred_path}")
-                print("   Download it from Firebase Console > Project Settings > Service Accounts")
+                logger.warning(
+                    "⚠️  serviceAccountKey.json not found at %s - download it from "
+                    "Firebase Console > Project Settings > Service Accounts", cred_path
+                )
                 return False
             
             cred = credentials.Certificate(cred_path)
             firebase_admin.initialize_app(cred)
-            print("✅ Firebase Admin SDK initialized successfully")
+            logger.info("✅ Firebase Admin SDK initialized successfully")
+            start_public_key_refresher()
             return True
         except Exception as e:
-            print(f"❌ Error initializing Firebase: {str(e)}")
+            logger.error("❌ Error initializing Firebase: %s", e)
             return False
 
+# Initialized on first token verification (or by warm_services), not at import
+firebase_app = LazyService('firebase', initialize_firebase)
+
+def ensure_firebase():
+    """
+    Initialize Firebase once per process, on first use
+    
+    Returns:
+        bool: True if the Admin SDK is ready
+    """
+    ready = firebase_app.get()
+    if ready:
+        # A worker forked from a preloaded master needs its own refresher
+        start_public_key_refresher()
+    return ready
+
+# ========================================
+# PUBLIC KEY (JWKS) REFRESH
+# ========================================
+# Seconds between forced refreshes of the token-signing certificates.
+# Google serves them with a multi-hour max-age, so refreshing well inside
+# that window means no request ever waits on the key fetch.
+PUBLIC_KEY_REFRESH_INTERVAL = int(os.getenv('PUBLIC_KEY_REFRESH_INTERVAL', 1800))
+
+_refresher_pid = None  # process running the refresher thread
+_refresher_lock = threading.Lock()
+
+def refresh_public_keys():
+    """
+    Re-fetch the token-signing certificates into the Admin SDK's HTTP cache
+    
+    Returns:
+        bool: True if the certificates were fetched
+    """
+    from firebase_admin import auth
+    try:
+        # The SDK verifier fetches certs through a cache-control aware session;
+        # a no-cache request bypasses the stale entry and stores a fresh one
+        verifier = auth._get_client(None)._token_verifier
+        verifier.request(ID_TOKEN_CERT_URL, headers={'Cache-Control': 'no-cache'})
+        return True
+    except Exception as e:
+        logger.warning("⚠️  Could not refresh Firebase public keys: %s", e)
+        return False
+
+def start_public_key_refresher():
+    """Warm the public key cache now and keep it warm from a daemon thread"""
+    global _refresher_pid
+    if _refresher_pid == os.getpid():
+        return
+    with _refresher_lock:
+        # Threads do not survive fork: each process starts its own
+        if _refresher_pid == os.getpid():
+            return
+        _refresher_pid = os.getpid()
+
+    def refresh_loop():
+        while True:
+            refresh_public_keys()
+            time.sleep(PUBLIC_KEY_REFRESH_INTERVAL)
+
+    threading.Thread(target=refresh_loop, name='firebase-key-refresh', daemon=True).start()
+
+# ========================================
+# VERIFIED TOKEN CACHE
+# ========================================
+# Max verified tokens kept in memory (LRU beyond this)
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+# Treat cached tokens as expired this many seconds before their `exp` claim
+TOKEN_CACHE_EXPIRY_MARGIN = 5
+
+_token_cache = OrderedDict()  # sha256(token) -> (user, exp)
+_token_cache_lock = threading.Lock()
+_token_cache_stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+
+def _token_key(id_token):
+    return hashlib.sha256(id_token.encode('utf-8')).digest()
+
+def _cached_user(key):
+    with _token_cache_lock:
+        entry = _token_cache.get(key)
+        if entry is None:
+            _token_cache_stats['misses'] += 1
+            return None
+        user, exp = entry
+        if time.time() >= exp - TOKEN_CACHE_EXPIRY_MARGIN:
+            del _token_cache[key]
+            _token_cache_stats['expired'] += 1
+            _token_cache_stats['misses'] += 1
+            return None
+        _token_cache.move_to_end(key)
+        _token_cache_stats['hits'] += 1
+        return user
+
+def _cache_user(key, user, exp):
+    with _token_cache_lock:
+        _token_cache[key] = (user, exp)
+        _token_cache.move_to_end(key)
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+            _token_cache_stats['evicted'] += 1
+
+def get_token_cache_stats():
+    """Get verified-token cache size and hit/miss counters"""
+    with _token_cache_lock:
+        lookups = _token_cache_stats['hits'] + _token_cache_stats['misses']
+        return {
+            'size': len(_token_cache),
+            'max_size': TOKEN_CACHE_SIZE,
+            'hit_rate': round(_token_cache_stats['hits'] / lookups, 4) if lookups else 0.0,
+            **_token_cache_stats
+        }
+
+def clear_token_cache():
+    """Drop all cached verified tokens"""
+    with _token_cache_lock:
+        _token_cache.clear()
+
 # ========================================
 # VERIFY FIREBASE ID TOKEN
 # ========================================
@@ -47,30 +192,55 @@ def verify_firebase_token(id_token):
     """
     Verify a Firebase ID token
     
+    Verified tokens are cached by hash until shortly before their `exp`
+    claim, so repeat requests with the same token skip signature checks.
+    
     Args:
         id_token (str): The ID token to verify
         
     Returns:
         dict: Decoded token with user info, or None if invalid
     """
+    start = time.perf_counter()
+    key = _token_key(id_token)
+    user = _cached_user(key)
+    if user is not None:
+        AUTH_LATENCY.observe(time.perf_counter() - start, result='cached')
+        return user
+    
+    from firebase_admin import auth
+    result = 'invalid'
     try:
+        ensure_firebase()
         decoded_token = auth.verify_id_token(id_token)
-        return {
+        user = {
             'uid': decoded_token['uid'],
             'email': decoded_token.get('email'),
             'name': decoded_token.get('name'),
             'picture': decoded_token.get('picture'),
-            'email_verified': decoded_token.get('email_verified', False)
+            'email_verified': decoded_token.get('email_verified', False),
+            # Long-lived connections re-check this (utils/live_session.py)
+            'exp': decoded_token.get('exp')
         }
-    except auth.InvalidIdTokenError:
-        print("❌ Invalid Firebase ID token")
-        return None
+        _cache_user(key, user, decoded_token.get('exp', 0))
+        # A new token is how profile changes reach us; drop older cached profiles
+        directory = user_directory.peek()
+        if directory:
+            directory.invalidate(user['uid'], issued_at=decoded_token.get('iat'))
+        result = 'verified'
+        return user
     except auth.ExpiredIdTokenError:
-        print("❌ Expired Firebase ID token")
+        logger.info("❌ Expired Firebase ID token")
+        return None
+    except auth.InvalidIdTokenError:
+        logger.info("❌ Invalid Firebase ID token")
         return None
     except Exception as e:
-        print(f"❌ Error verifying token: {str(e)}")
+        result = 'error'
+        logger.warning("❌ Error verifying token: %s", e)
         return None
+    finally:
+        AUTH_LATENCY.observe(time.perf_counter() - start, result=result)
 
 # ========================================
 # DECORATOR TO REQUIRE AUTHENTICATION
@@ -106,6 +276,70 @@ def require_auth(f):
     
     return decorated_function
 
+# ========================================
+# ASYNC AUTH (ASGI SERVING PATH)
+# ========================================
+async def verify_firebase_token_async(id_token):
+    """
+    Verify a Firebase ID token without blocking the event loop
+    
+    Args:
+        id_token (str): The ID token to verify
+        
+    Returns:
+        dict: Decoded token with user info, or None if invalid
+    """
+    return await asyncio.to_thread(verify_firebase_token, id_token)
+
+async def authenticate_async(request):
+    """
+    Check an async request's Authorization header
+    
+    Only needs the headers, so callers can reject a request before
+    reading its body.
+    
+    Args:
+        request: Anything with a `headers` mapping (lowercase keys)
+        
+    Returns:
+        tuple: (user, None), or (None, (error payload, 401))
+    """
+    auth_header = request.headers.get('authorization', '')
+    
+    if not auth_header.startswith('Bearer '):
+        return None, ({'error': 'No token provided'}, 401)
+    
+    id_token = auth_header.replace('Bearer ', '')
+    
+    user = await verify_firebase_token_async(id_token)
+    
+    if not user:
+        return None, ({'error': 'Invalid or expired token'}, 401)
+    
+    return user, None
+
+def require_auth_async(f):
+    """
+    Decorator to protect async handlers with Firebase authentication
+    
+    The handler receives the request object (anything with a `headers`
+    mapping) and returns a (payload, status) tuple.
+    
+    Usage:
+        @require_auth_async
+        async def protected_handler(request, current_user):
+            return {'message': f'Hello {current_user["email"]}!'}, 200
+    """
+    @wraps(f)
+    async def decorated_function(request, *args, **kwargs):
+        user, error = await authenticate_async(request)
+        if error:
+            return error
+        
+        return await f(request, current_user=user, *args, **kwargs)
+    
+    return decorated_function
+
 # ========================================
 # OPTIONAL AUTH DECORATOR
 # ========================================
@@ -135,8 +369,12 @@ def optional_auth(f):
     return decorated_function
 
 # ========================================
-# GET USER BY UID
+# USER LOOKUPS
 # ========================================
+# Profiles come from a cached directory that batches concurrent lookups
+# into bulk get_users calls (utils/user_directory.py)
+user_directory = LazyService('user_directory', create_user_directory)
+
 def get_user_by_uid(uid):
     """
     Get user information by Firebase UID
@@ -148,22 +386,11 @@ def get_user_by_uid(uid):
         dict: User information or None
     """
     try:
-        user = auth.get_user(uid)
-        return {
-            'uid': user.uid,
-            'email': user.email,
-            'display_name': user.display_name,
-            'photo_url': user.photo_url,
-            'email_verified': user.email_verified,
-            'disabled': user.disabled
-        }
+        return user_directory.get_by_uid(uid)
     except Exception as e:
-        print(f"❌ Error getting user: {str(e)}")
+        logger.warning("❌ Error getting user: %s", e)
         return None
 
-# ========================================
-# GET USER BY EMAIL
-# ========================================
 def get_user_by_email(email):
     """
     Get user information by email
@@ -175,16 +402,25 @@ def get_user_by_email(email):
         dict: User information or None
     """
     try:
-        user = auth.get_user_by_email(email)
-        return {
-            'uid': user.uid,
-            'email': user.email,
-            'display_name': user.display_name,
-            'photo_url': user.photo_url,
-            'email_verified': user.email_verified
-        }
+        return user_directory.get_by_email(email)
+    except Exception as e:
+        logger.warning("❌ Error getting user: %s", e)
+        return None
+
+def get_users_by_uid(uids):
+    """
+    Get many users at once (100 per Firebase call)
+    
+    Args:
+        uids (list): Firebase user UIDs
+        
+    Returns:
+        dict: {uid: user information or None}, or None on error
+    """
+    try:
+        return user_directory.get_many(uids)
     except Exception as e:
-        print(f"❌ Error getting user: {str(e)}")
+        logger.warning("❌ Error getting users: %s", e)
         return None
 
 # ========================================
@@ -201,9 +437,11 @@ def create_custom_token(uid, additional_claims=None):
     Returns:
         str: Custom token
     """
+    from firebase_admin import auth
     try:
+        ensure_firebase()
         custom_token = auth.create_custom_token(uid, additional_claims)
         return custom_token.decode('utf-8')
     except Exception as e:
-        print(f"❌ Error creating custom token: {str(e)}")
+        logger.warning("❌ Error creating custom token: %s", e)
         return None
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""
+Frame Executor Utility
+Runs camera frame decoding, resizing and emotion inference in worker processes
+
+Frame bytes are copied once into a shared memory block that the worker
+attaches to by name, so the upload itself is never pickled; only the small
+re-encoded frame and the emotion result travel back.
+"""
+
+import base64
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+from .frame_processor import create_frame_processor
+from .logging_setup import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# Per-process pipeline, built once by the pool initializer
+_worker = {}
+
+
+def _init_worker():
+    # No-op after fork; spawned workers need their own log listener
+    configure_logging()
+    # Parallelism comes from the processes; one inference thread each
+    os.environ['EMOTION_THREADS'] = '1'
+    # Imported here so the parent process never loads onnxruntime for it
+    from .emotion_detector import create_emotion_detector
+    _worker['processor'] = create_frame_processor()
+    _worker['detector'] = create_emotion_detector()
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _process_frame(shm_name, size, is_base64):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        view = shm.buf[:size]
+        try:
+            data = base64.b64decode(view) if is_base64 else bytes(view)
+        finally:
+            view.release()
+    finally:
+        shm.close()
+
+    frame = _worker['processor'].process(data)
+    detector = _worker['detector']
+    analysis = detector.detect_emotion(frame.image) if detector.available else None
+    # The decoded image stays in the worker; pixels are not worth pickling back
+    return frame._replace(image=None, analysis=analysis)
+
+
+class FrameExecutor:
+    def __init__(self, workers, timeout=10.0, start_method=None):
+        """
+        Args:
+            workers: Number of worker processes
+            timeout: Seconds to wait for one frame before giving up
+            start_method: multiprocessing start method (default: platform default)
+        """
+        self.workers = workers
+        self.timeout = timeout
+        context = multiprocessing.get_context(start_method)
+        # Workers must share the parent's resource tracker; one of their own
+        # would "clean up" every block they attached to when they exit
+        resource_tracker.ensure_running()
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=_init_worker
+        )
+        self.stats = {'frames': 0, 'errors': 0}
+
+    def warm_up(self):
+        """Start every worker and load its models before the first request"""
+        futures = [self._pool.submit(_warm_up) for _ in range(self.workers)]
+        pids = {future.result() for future in futures}
+        logger.info("✅ Frame executor ready: %d worker processes", len(pids))
+
+    def process(self, data, is_base64=False):
+        """
+        Decode, preprocess and analyze one frame in a worker process
+        Args:
+            data: Encoded image bytes, or base64 text when is_base64 is set
+            is_base64: Whether data still needs base64 decoding
+        Returns:
+            ProcessedFrame: Re-encoded frame (image=None) with its emotion analysis
+        """
+        size = len(data)
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        try:
+            shm.buf[:size] = data
+            future = self._pool.submit(_process_frame, shm.name, size, is_base64)
+            frame = future.result(timeout=self.timeout)
+            self.stats['frames'] += 1
+            return frame
+        except Exception:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def create_frame_executor():
+    """
+    Build the frame worker pool from environment variables
+
+    FRAME_WORKERS          worker processes for decode/resize/inference
+                           (0 = process frames on the request thread)
+    FRAME_WORKER_TIMEOUT   seconds to wait for one frame
+    FRAME_WORKER_START     multiprocessing start method (fork, spawn, forkserver)
+    Returns:
+        FrameExecutor, warmed up, or None when disabled
+    """
+    workers = int(os.getenv('FRAME_WORKERS', 0))
+    if workers <= 0:
+        return None
+    executor = FrameExecutor(
+        workers,
+        timeout=float(os.getenv('FRAME_WORKER_TIMEOUT', 10)),
+        start_method=os.getenv('FRAME_WORKER_START') or None
+    )
+    executor.warm_up()
+    return executor
@@ -0,0 +1,195 @@
+"""
+Frame Processor Utility
+Downscales, normalizes and re-encodes camera frames before they reach
+Gemini Vision, and spots near-identical consecutive frames per user
+"""
+
+import io
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from PIL import Image, ImageOps
+
+# Result of preprocessing one frame
+#   data       re-encoded image bytes sent to the model
+#   mime_type  MIME type of data
+#   size       (width, height) after resizing
+#   phash      64-bit perceptual (difference) hash of the frame
+#   image      resized RGB PIL image (for server-side analysis)
+#   analysis   emotion result when inference already ran in a frame worker
+ProcessedFrame = namedtuple(
+    'ProcessedFrame', ['data', 'mime_type', 'size', 'phash', 'image', 'analysis'], defaults=(None,)
+)
+
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp'
+}
+
+
+class FrameProcessor:
+    def __init__(self, max_edge=768, image_format='JPEG', quality=75):
+        self.max_edge = max_edge
+        self.image_format = image_format.upper()
+        self.quality = quality
+        if self.image_format not in MIME_TYPES:
+            raise ValueError(f"Unsupported frame format: {image_format}")
+
+    def process(self, source):
+        """
+        Preprocess a camera frame
+        Args:
+            source: Encoded image bytes, a binary file-like object or a PIL Image
+        Returns:
+            ProcessedFrame: Compact re-encoded frame plus its perceptual hash
+        """
+        if isinstance(source, Image.Image):
+            image = source
+        else:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                source = io.BytesIO(source)
+            image = Image.open(source)
+            # Let the JPEG decoder scale down in the DCT domain (1/2, 1/4, 1/8)
+            # instead of decoding full resolution and resizing afterwards
+            if image.format == 'JPEG':
+                image.draft('RGB', (self.max_edge, self.max_edge))
+
+        image = self.normalize(image)
+        image.thumbnail((self.max_edge, self.max_edge), Image.BILINEAR, reducing_gap=2.0)
+
+        buffer = io.BytesIO()
+        if self.image_format == 'WEBP':
+            image.save(buffer, 'WEBP', quality=self.quality, method=2)
+        else:
+            image.save(buffer, 'JPEG', quality=self.quality, optimize=False)
+
+        return ProcessedFrame(
+            data=buffer.getvalue(),
+            mime_type=MIME_TYPES[self.image_format],
+            size=image.size,
+            phash=self.dhash(image),
+            image=image
+        )
+
+    @staticmethod
+    def normalize(image):
+        """Apply EXIF orientation and flatten alpha/palette images onto white RGB"""
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            return background
+        if image.mode != 'RGB':
+            return image.convert('RGB')
+        return image
+
+    @staticmethod
+    def dhash(image, hash_size=8):
+        """
+        Difference hash: compares neighbouring pixels of a tiny grayscale copy
+        Returns:
+            int: hash_size * hash_size bit fingerprint
+        """
+        small = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+        pixels = small.tobytes()
+        value = 0
+        for row in range(hash_size):
+            offset = row * (hash_size + 1)
+            for col in range(hash_size):
+                value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+        return value
+
+
+def hamming_distance(a, b):
+    """Number of differing bits between two perceptual hashes"""
+    return bin(a ^ b).count('1')
+
+
+class FrameDeduplicator:
+    """
+    Remembers each user's last frame hash and reply
+
+    When the next frame from the same user is within `max_distance` bits of
+    the previous one (and the emotion/message context is unchanged), the
+    previous reply can be reused instead of calling the model again.
+    """
+
+    def __init__(self, max_distance=6, reuse_ttl=15, max_users=10000):
+        self.max_distance = max_distance
+        self.reuse_ttl = reuse_ttl
+        self.max_users = max_users
+        self._last = OrderedDict()  # uid -> (phash, context, reply, timestamp)
+        self._lock = threading.Lock()
+        self.stats = {'reused': 0, 'fresh': 0}
+
+    def lookup(self, uid, phash, context):
+        """
+        Find a reusable reply for a near-identical frame
+        Args:
+            uid: User the frame came from
+            phash: Perceptual hash of the new frame
+            context: Hashable prompt context (e.g. (emotion, message))
+        Returns:
+            str: Previous reply, or None if the model must be called
+        """
+        with self._lock:
+            entry = self._last.get(uid)
+            if entry is not None and self.max_distance >= 0:
+                last_hash, last_context, reply, timestamp = entry
+                if (last_context == context
+                        and time.monotonic() - timestamp <= self.reuse_ttl
+                        and hamming_distance(last_hash, phash) <= self.max_distance):
+                    self.stats['reused'] += 1
+                    return reply
+            self.stats['fresh'] += 1
+            return None
+
+    def remember(self, uid, phash, context, reply):
+        """Store the reply generated for a user's latest frame"""
+        with self._lock:
+            self._last[uid] = (phash, context, reply, time.monotonic())
+            self._last.move_to_end(uid)
+            while len(self._last) > self.max_users:
+                self._last.popitem(last=False)
+
+    def last_reply(self, uid):
+        """A user's most recent reply regardless of frame or age, or None"""
+        with self._lock:
+            entry = self._last.get(uid)
+            return entry[2] if entry is not None else None
+
+    def forget(self, uid):
+        """Drop a user's remembered frame"""
+        with self._lock:
+            self._last.pop(uid, None)
+
+
+def create_frame_processor():
+    """
+    Build the frame processor from environment variables
+
+    FRAME_MAX_EDGE     longest edge in pixels after resizing
+    FRAME_FORMAT       JPEG or WEBP
+    FRAME_QUALITY      encoder quality (1-100)
+    """
+    return FrameProcessor(
+        max_edge=int(os.getenv('FRAME_MAX_EDGE', 768)),
+        image_format=os.getenv('FRAME_FORMAT', 'JPEG'),
+        quality=int(os.getenv('FRAME_QUALITY', 75))
+    )
+
+
+def create_frame_deduplicator():
+    """
+    Build the near-duplicate frame detector from environment variables
+
+    FRAME_DEDUP_DISTANCE   max differing hash bits to count as the same frame (-1 disables)
+    FRAME_DEDUP_TTL        seconds a previous reply may be reused
+    """
+    return FrameDeduplicator(
+        max_distance=int(os.getenv('FRAME_DEDUP_DISTANCE', 6)),
+        reuse_ttl=float(os.getenv('FRAME_DEDUP_TTL', 15))
+    )
@@ -0,0 +1,406 @@
+"""
+History Store Utility
+Shared, persistent conversation history so any worker can serve any user
+
+Turns are stored as compact role/text records in a list per user. The
+storage client only needs a small Redis-compatible subset (rpush, lrange,
+llen, ltrim, delete, incr, get and transactional pipelines), so a real
+Redis server or the bundled SQLite stand-in can back it.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Compact role codes used in stored records
+ROLE_CODES = {'user': 'u', 'model': 'm'}
+CODE_ROLES = {code: role for role, code in ROLE_CODES.items()}
+
+
+class SQLiteListClient:
+    """
+    Local stand-in for the Redis list/counter commands used by ConversationHistory
+
+    Backed by a single SQLite file in WAL mode so several gunicorn workers on
+    one host can share it. Each thread gets its own connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS list_items ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " key TEXT NOT NULL,"
+                " value BLOB NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS list_items_key ON list_items (key, id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " expires_at REAL)"
+            )
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _encode(value):
+        return value.encode('utf-8') if isinstance(value, str) else bytes(value)
+
+    def _live_kv(self, conn, key):
+        row = conn.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] <= time.time():
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+            return None
+        return row[0]
+
+    # ---------- list commands ----------
+
+    def rpush(self, key, *values):
+        return self._transaction(self._rpush, key, *values)
+
+    def _rpush(self, conn, key, *values):
+        conn.executemany(
+            "INSERT INTO list_items (key, value) VALUES (?, ?)",
+            [(key, self._encode(v)) for v in values]
+        )
+        return conn.execute("SELECT COUNT(*) FROM list_items WHERE key = ?", (key,)).fetchone()[0]
+
+    def llen(self, key):
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM list_items WHERE key = ?", (key,)
+        ).fetchone()[0]
+
+    def _slice(self, conn, key, start, end):
+        """Translate Redis inclusive (possibly negative) indices to LIMIT/OFFSET"""
+        length = conn.execute("SELECT COUNT(*) FROM list_items WHERE key = ?", (key,)).fetchone()[0]
+        if start < 0:
+            start = max(length + start, 0)
+        if end < 0:
+            end = length + end
+        end = min(end, length - 1)
+        return length, start, end
+
+    def lrange(self, key, start, end):
+        conn = self._conn()
+        _, start, end = self._slice(conn, key, start, end)
+        if start > end:
+            return []
+        rows = conn.execute(
+            "SELECT value FROM list_items WHERE key = ? ORDER BY id LIMIT ? OFFSET ?",
+            (key, end - start + 1, start)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def ltrim(self, key, start, end):
+        return self._transaction(self._ltrim, key, start, end)
+
+    def _ltrim(self, conn, key, start, end):
+        length, start, end = self._slice(conn, key, start, end)
+        if start > end:
+            conn.execute("DELETE FROM list_items WHERE key = ?", (key,))
+            return True
+        ids = conn.execute(
+            "SELECT id FROM list_items WHERE key = ? ORDER BY id LIMIT ? OFFSET ?",
+            (key, end - start + 1, start)
+        ).fetchall()
+        conn.execute(
+            "DELETE FROM list_items WHERE key = ? AND (id < ? OR id > ?)",
+            (key, ids[0][0], ids[-1][0])
+        )
+        return True
+
+    # ---------- key/counter commands ----------
+
+    def get(self, key):
+        return self._live_kv(self._conn(), key)
+
+    def set(self, key, value, ex=None):
+        expires_at = time.time() + ex if ex else None
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, self._encode(str(value) if isinstance(value, (int, float)) else value), expires_at)
+            )
+        return True
+
+    def incr(self, key, amount=1):
+        return self._transaction(self._incr, key, amount)
+
+    def _incr(self, conn, key, amount=1):
+        current = self._live_kv(conn, key)
+        value = int(current or 0) + amount
+        conn.execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, NULL)",
+            (key, str(value).encode('utf-8'))
+        )
+        return value
+
+    def delete(self, *keys):
+        return self._transaction(self._delete, *keys)
+
+    def _delete(self, conn, *keys):
+        removed = 0
+        for key in keys:
+            removed += conn.execute("DELETE FROM list_items WHERE key = ?", (key,)).rowcount > 0
+            removed += conn.execute("DELETE FROM kv WHERE key = ?", (key,)).rowcount > 0
+        return removed
+
+    # ---------- transactions ----------
+
+    def pipeline(self, transaction=True):
+        """Queue commands and run them in one transaction, like a Redis MULTI/EXEC pipeline"""
+        return SQLitePipeline(self)
+
+    def _transaction(self, command, *args):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            return command(conn, *args)
+
+
+class SQLitePipeline:
+    """The pipeline subset ConversationHistory uses: queued rpush/ltrim/incr/delete"""
+
+    def __init__(self, client):
+        self.client = client
+        self._commands = []
+
+    def rpush(self, key, *values):
+        self._commands.append((self.client._rpush, (key,) + values))
+        return self
+
+    def ltrim(self, key, start, end):
+        self._commands.append((self.client._ltrim, (key, start, end)))
+        return self
+
+    def incr(self, key, amount=1):
+        self._commands.append((self.client._incr, (key, amount)))
+        return self
+
+    def delete(self, *keys):
+        self._commands.append((self.client._delete, keys))
+        return self
+
+    def execute(self):
+        """Run every queued command atomically; returns their results in order"""
+        commands, self._commands = self._commands, []
+        conn = self.client._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            return [command(conn, *args) for command, args in commands]
+
+
+class ConversationHistory:
+    """
+    Per-user conversation history on top of a Redis-compatible client
+
+    Each user has a list of JSON records ({"r": "u"|"m", "t": text}) and a
+    version counter that is bumped on every write, clears included, so a
+    worker can tell when its in-memory chat session is stale and rebuild it
+    lazily. The counter never goes back: a cleared history that grows to
+    the same length again still gets a new version.
+
+    The running summary of older turns is stored next to the list, with
+    the position of the last record it covers (counted over every record
+    ever appended, so trimming the list doesn't shift it) and the clear
+    count it was made under, so a summary of a cleared conversation is
+    never loaded.
+    """
+
+    def __init__(self, client, prefix='talkbot:', max_turns=50):
+        self.client = client
+        self.prefix = prefix
+        self.max_records = max_turns * 2
+
+    def _list_key(self, uid):
+        return f"{self.prefix}history:{uid}"
+
+    def _version_key(self, uid):
+        return f"{self.prefix}version:{uid}"
+
+    def _count_key(self, uid):
+        return f"{self.prefix}records:{uid}"
+
+    def _clears_key(self, uid):
+        return f"{self.prefix}clears:{uid}"
+
+    def _summary_key(self, uid):
+        return f"{self.prefix}summary:{uid}"
+
+    def append_turn(self, uid, user_text, model_text):
+        """
+        Store one user/model exchange
+        Args:
+            uid: Firebase user UID
+            user_text: Message sent by the user
+            model_text: Reply from the model
+        Returns:
+            int: New history version for this user
+        """
+        records = [
+            json.dumps({'r': ROLE_CODES['user'], 't': user_text}, separators=(',', ':')),
+            json.dumps({'r': ROLE_CODES['model'], 't': model_text}, separators=(',', ':'))
+        ]
+        return self._write(uid, records)
+
+    def import_turns(self, uid, turns):
+        """
+        Bulk-append past user/model exchanges (oldest first)
+        Args:
+            uid: Firebase user UID
+            turns: [(user_text, model_text), ...]
+        Returns:
+            int: Exchanges kept after trimming to max_turns
+        """
+        turns = list(turns)[-(self.max_records // 2):]
+        if not turns:
+            return 0
+        records = []
+        for user_text, model_text in turns:
+            records.append(json.dumps({'r': ROLE_CODES['user'], 't': user_text}, separators=(',', ':')))
+            records.append(json.dumps({'r': ROLE_CODES['model'], 't': model_text}, separators=(',', ':')))
+        self._write(uid, records)
+        return len(turns)
+
+    def _write(self, uid, records):
+        """Append, trim and bump the counters in one transaction; returns the new version"""
+        key = self._list_key(uid)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpush(key, *records)
+        pipe.ltrim(key, -self.max_records, -1)
+        pipe.incr(self._count_key(uid), len(records))
+        pipe.incr(self._version_key(uid))
+        return pipe.execute()[-1]
+
+    def load(self, uid):
+        """
+        Load a user's history in Gemini start_chat() format
+        Returns:
+            list: [{'role': 'user'|'model', 'parts': [text]}, ...]
+        """
+        history = []
+        for raw in self.client.lrange(self._list_key(uid), 0, -1):
+            record = json.loads(raw)
+            history.append({'role': CODE_ROLES[record['r']], 'parts': [record['t']]})
+        return history
+
+    def position(self, uid):
+        """
+        Where a user's history stands, for marking what a summary covers
+        Returns:
+            tuple: (records appended so far, clears so far)
+        """
+        clears = self.client.get(self._clears_key(uid))
+        return self._records_total(uid, self.client.llen(self._list_key(uid))), int(clears or 0)
+
+    def _records_total(self, uid, length):
+        total = int(self.client.get(self._count_key(uid)) or 0)
+        if total < length:
+            # History written before records were counted: count what is there
+            total = self.client.incr(self._count_key(uid), length - total)
+        return total
+
+    def save_summary(self, uid, summary, covers, clears):
+        """
+        Store the running summary of a user's older turns
+        Args:
+            uid: Firebase user UID
+            summary: Summary text
+            covers: Records it covers, as position() counts them
+            clears: Clear count from the same position() call
+        """
+        record = json.dumps({'t': summary, 'n': covers, 'c': clears}, separators=(',', ':'))
+        self.client.set(self._summary_key(uid), record)
+
+    def load_context(self, uid):
+        """
+        Load the stored summary and the turns it doesn't cover
+        Returns:
+            tuple: (summary text or None, history in load() format)
+        """
+        raw_summary = self.client.get(self._summary_key(uid))
+        history = self.load(uid)
+        if raw_summary is None:
+            return None, history
+        summary = json.loads(raw_summary)
+        total, clears = self.position(uid)
+        if summary['c'] != clears:
+            # Made before the history was cleared
+            return None, history
+        first = total - len(history)
+        covered = min(len(history), max(0, summary['n'] - first))
+        # Never split an exchange
+        covered -= covered % 2
+        return summary['t'], history[covered:]
+
+    def version(self, uid):
+        """Current write counter for a user's history (0 if none)"""
+        value = self.client.get(self._version_key(uid))
+        return int(value) if value else 0
+
+    def exists(self, uid):
+        """Whether the user has any stored history"""
+        return self.client.llen(self._list_key(uid)) > 0
+
+    def clear(self, uid):
+        """
+        Delete a user's stored turns and summary. The version is bumped, not
+        reset, so sessions cached by other workers are rebuilt
+        Returns:
+            bool: True if anything was removed
+        """
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(self._list_key(uid), self._summary_key(uid))
+        pipe.incr(self._version_key(uid))
+        pipe.incr(self._clears_key(uid))
+        removed, _, _ = pipe.execute()
+        return removed > 0
+
+
+def create_history_store():
+    """
+    Build the shared conversation history store from environment variables
+
+    HISTORY_REDIS_URL     use a Redis server (requires the redis package)
+    HISTORY_DB_PATH       SQLite file used when no Redis URL is set
+    SESSION_MAX_TURNS     max turns kept per user
+    """
+    max_turns = int(os.getenv('SESSION_MAX_TURNS', 50))
+    redis_url = os.getenv('HISTORY_REDIS_URL')
+
+    if redis_url:
+        try:
+            import redis
+            client = redis.Redis.from_url(redis_url)
+            logger.info("✅ Conversation history: Redis (%s)", redis_url.split('@')[-1])
+            return ConversationHistory(client, max_turns=max_turns)
+        except ImportError:
+            logger.warning("⚠️  HISTORY_REDIS_URL set but redis package not installed - using SQLite")
+
+    path = os.getenv(
+        'HISTORY_DB_PATH',
+        os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'history.sqlite3')
+    )
+    logger.info("✅ Conversation history: SQLite (%s)", path)
+    return ConversationHistory(SQLiteListClient(path), max_turns=max_turns)
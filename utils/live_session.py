@@ -0,0 +1,432 @@
+"""
+Live Session Utility
+Persistent WebSocket camera sessions with latest-frame backpressure,
+streaming speech sessions and server-driven avatar sessions
+
+A session authenticates once, with the ID token in its first event, and
+can outlive that token. Each analyzed frame or utterance (and, for an
+avatar, each update) first checks the token's `exp`; once it has passed,
+the client gets a "token_expired" error and the connection is closed
+with code 1008, so it must reconnect with a fresh token.
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+
+from .avatar_state import pack_update, KEYFRAME
+from .metrics import AVATAR_UPDATE_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+class UserCallGate:
+    """Allows at most one in-flight model call per user across connections"""
+
+    def __init__(self):
+        self._active = set()
+        self._cond = threading.Condition()
+
+    def acquire(self, uid):
+        with self._cond:
+            while uid in self._active:
+                self._cond.wait()
+            self._active.add(uid)
+
+    def release(self, uid):
+        with self._cond:
+            self._active.discard(uid)
+            self._cond.notify_all()
+
+
+# Shared by every live session in this process
+user_call_gate = UserCallGate()
+
+# WebSocket close code for a session whose token expired (policy violation)
+CLOSE_TOKEN_EXPIRED = 1008
+
+
+def token_expires_in(user):
+    """Seconds until the session's ID token expires (None: no `exp` claim)"""
+    exp = user.get('exp')
+    return None if exp is None else exp - time.time()
+
+
+def token_expired(user):
+    remaining = token_expires_in(user)
+    return remaining is not None and remaining <= 0
+
+
+def close_expired(ws, send, uid):
+    """Tell the client its token has expired and close the connection"""
+    logger.info("🔒 Live session token expired", extra={"uid": uid})
+    try:
+        send({'type': 'error', 'error': 'Token expired', 'code': 'token_expired'})
+        ws.close(reason=CLOSE_TOKEN_EXPIRED, message='Token expired')
+    except Exception:
+        # Already gone
+        pass
+
+
+class LiveCameraSession:
+    """
+    One authenticated WebSocket camera session
+
+    The connection's receive loop only stores the newest frame; a worker
+    thread analyzes it once the previous model call has finished. Frames
+    that arrive while the model is busy replace the pending one, so a slow
+    call never builds a queue of stale frames.
+
+    Client -> server:
+        binary                                  JPEG frame
+        {"type": "emotion", "emotion": "..."}   emotion used for later frames
+        {"type": "message", "message": "..."}   sent with the next analyzed frame
+        {"type": "ping"}
+    Server -> client:
+        {"type": "reply", "frame": seq, "reply": ..., "emotion": ..., "reused": ...}
+        {"type": "error", "error": ...}
+        {"type": "pong", "stats": {...}}
+    """
+
+    def __init__(self, ws, user, analyze, max_frame_bytes=4 * 1024 * 1024):
+        self.ws = ws
+        self.user = user
+        self.analyze = analyze
+        self.max_frame_bytes = max_frame_bytes
+
+        self.emotion = 'neutral'
+        self.message = ''
+        self.stats = {'received': 0, 'analyzed': 0, 'dropped': 0, 'errors': 0}
+
+        self._pending = None  # (seq, frame bytes)
+        self._seq = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._send_lock = threading.Lock()
+
+    def send(self, payload):
+        """Send a JSON event (safe to call from the worker thread)"""
+        with self._send_lock:
+            self.ws.send(json.dumps(payload))
+
+    def run(self):
+        """Receive loop; returns when the client disconnects"""
+        worker = threading.Thread(
+            target=self._work, name=f"live-{self.user['uid'][:8]}", daemon=True
+        )
+        worker.start()
+        try:
+            while True:
+                data = self.ws.receive()
+                if data is None:
+                    break
+                if isinstance(data, (bytes, bytearray)):
+                    self._push_frame(data)
+                else:
+                    self._handle_event(data)
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+            worker.join(timeout=1)
+
+    def _handle_event(self, text):
+        try:
+            event = json.loads(text)
+        except ValueError:
+            event = None
+        if not isinstance(event, dict):
+            self.send({'type': 'error', 'error': 'Invalid JSON event'})
+            return
+
+        event_type = event.get('type')
+        if event_type == 'emotion':
+            with self._cond:
+                self.emotion = str(event.get('emotion') or 'neutral')
+        elif event_type == 'message':
+            with self._cond:
+                self.message = str(event.get('message') or '')
+        elif event_type == 'ping':
+            self.send({'type': 'pong', 'stats': dict(self.stats)})
+        else:
+            self.send({'type': 'error', 'error': f"Unknown event type: {event_type}"})
+
+    def _push_frame(self, data):
+        if len(data) > self.max_frame_bytes:
+            self.send({'type': 'error', 'error': 'Frame too large'})
+            return
+        with self._cond:
+            self._seq += 1
+            self.stats['received'] += 1
+            if self._pending is not None:
+                # Model still busy with an older frame - drop the stale one
+                self.stats['dropped'] += 1
+            self._pending = (self._seq, data)
+            self._cond.notify()
+
+    def _work(self):
+        uid = self.user['uid']
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                seq, data = self._pending
+                self._pending = None
+                emotion, message = self.emotion, self.message
+                self.message = ''
+
+            if token_expired(self.user):
+                close_expired(self.ws, self.send, uid)
+                return
+            user_call_gate.acquire(uid)
+            try:
+                result = self.analyze(self.user, data, emotion, message)
+                self.stats['analyzed'] += 1
+                self.send({'type': 'reply', 'frame': seq, **result})
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.exception("❌ Live session error: %s", e)
+                try:
+                    self.send({
+                        'type': 'error',
+                        'frame': seq,
+                        'error': str(e),
+                        'reply': "Sorry, I had trouble processing that. Try again!"
+                    })
+                except Exception:
+                    return
+            finally:
+                user_call_gate.release(uid)
+
+
+class LiveSpeechSession:
+    """
+    One authenticated WebSocket speech session
+
+    The receive loop feeds audio to a SpeechStream and pushes partial
+    transcripts straight back. Each finished utterance is handed to a worker
+    thread that runs `respond`, so audio keeps flowing (and the next
+    utterance keeps being recognized) while the model answers.
+
+    Client -> server:
+        binary                       16-bit mono PCM at the session's sample rate
+        {"type": "end"}              close the current utterance now
+        {"type": "ping"}
+    Server -> client:
+        {"type": "partial", "text": ...}
+        {"type": "final", "text": ..., "confidence": ...}
+        whatever `respond` sends (chunk / reply events)
+        {"type": "pong", "stats": {...}}
+    """
+
+    def __init__(self, ws, user, stream, respond, max_chunk_bytes=256 * 1024):
+        self.ws = ws
+        self.user = user
+        self.stream = stream
+        self.respond = respond
+        self.max_chunk_bytes = max_chunk_bytes
+        self.stats = {'audio_bytes': 0, 'utterances': 0, 'errors': 0}
+
+        self._utterances = queue.Queue()
+        self._send_lock = threading.Lock()
+
+    def send(self, payload):
+        """Send a JSON event (safe to call from the worker thread)"""
+        with self._send_lock:
+            self.ws.send(json.dumps(payload))
+
+    def run(self):
+        """Receive loop; returns when the client disconnects"""
+        worker = threading.Thread(
+            target=self._work, name=f"speech-{self.user['uid'][:8]}", daemon=True
+        )
+        worker.start()
+        try:
+            while True:
+                data = self.ws.receive()
+                if data is None:
+                    break
+                if isinstance(data, (bytes, bytearray)):
+                    if len(data) > self.max_chunk_bytes:
+                        self.send({'type': 'error', 'error': 'Audio chunk too large'})
+                        continue
+                    self.stats['audio_bytes'] += len(data)
+                    for event in self.stream.feed(data):
+                        self._emit(event)
+                else:
+                    self._handle_event(data)
+        finally:
+            self._utterances.put(None)
+            worker.join(timeout=1)
+
+    def _handle_event(self, text):
+        try:
+            event = json.loads(text)
+        except ValueError:
+            event = None
+        if not isinstance(event, dict):
+            self.send({'type': 'error', 'error': 'Invalid JSON event'})
+            return
+
+        event_type = event.get('type')
+        if event_type == 'end':
+            final = self.stream.flush()
+            if final:
+                self._emit(final)
+        elif event_type == 'ping':
+            self.send({'type': 'pong', 'stats': dict(self.stats)})
+        else:
+            self.send({'type': 'error', 'error': f"Unknown event type: {event_type}"})
+
+    def _emit(self, event):
+        self.send(event)
+        if event['type'] == 'final':
+            self.stats['utterances'] += 1
+            self._utterances.put(event['text'])
+
+    def _work(self):
+        while True:
+            text = self._utterances.get()
+            if text is None:
+                return
+            if token_expired(self.user):
+                close_expired(self.ws, self.send, self.user['uid'])
+                return
+            try:
+                self.respond(self.user, text, self.send)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.exception("❌ Speech session error: %s", e)
+                try:
+                    self.send({'type': 'error', 'error': str(e)})
+                except Exception:
+                    return
+
+
+class LiveAvatarSession:
+    """
+    One authenticated WebSocket avatar session
+
+    The engine hands every state change to deliver(); a worker thread sends
+    the newest one as a binary delta against what this connection last
+    received. A slow client skips intermediate ticks instead of building a
+    backlog, like frames in a LiveCameraSession.
+
+    Client -> server:
+        {"type": "style", "style": "..."}   switch this user's avatar style
+        {"type": "sync"}                    resend every field (keyframe)
+        {"type": "ping"}
+    Server -> client:
+        binary                               update frame (utils/avatar_state.py)
+        {"type": "error", "error": ...}
+        {"type": "pong", "stats": {...}}
+    """
+
+    def __init__(self, ws, user, engine, style=None):
+        self.ws = ws
+        self.user = user
+        self.engine = engine
+        self.style = style
+        self.stats = {'frames': 0, 'keyframes': 0, 'bytes': 0, 'skipped': 0}
+
+        self._pending = None  # (tick, values) not sent yet
+        self._current = None  # latest (tick, values) from the engine
+        self._sent = None     # values this client has
+        self._closed = False
+        self._cond = threading.Condition()
+        self._send_lock = threading.Lock()
+
+    def send(self, payload):
+        """Send a JSON event (safe to call from the worker thread)"""
+        with self._send_lock:
+            self.ws.send(json.dumps(payload))
+
+    def deliver(self, tick, values):
+        """Engine callback: keep only the newest state"""
+        with self._cond:
+            if self._pending is not None:
+                self.stats['skipped'] += 1
+            self._pending = self._current = (tick, values)
+            self._cond.notify()
+
+    def run(self):
+        """Receive loop; returns when the client disconnects"""
+        uid = self.user['uid']
+        worker = threading.Thread(target=self._work, name=f"avatar-{uid[:8]}", daemon=True)
+        worker.start()
+        self.engine.subscribe(uid, self.deliver, self.style)
+        try:
+            while True:
+                data = self.ws.receive()
+                if data is None:
+                    break
+                if isinstance(data, (bytes, bytearray)):
+                    self.send({'type': 'error', 'error': 'Binary messages are not accepted'})
+                else:
+                    self._handle_event(data)
+        finally:
+            self.engine.unsubscribe(uid, self.deliver)
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+            worker.join(timeout=1)
+
+    def _handle_event(self, text):
+        try:
+            event = json.loads(text)
+        except ValueError:
+            event = None
+        if not isinstance(event, dict):
+            self.send({'type': 'error', 'error': 'Invalid JSON event'})
+            return
+
+        event_type = event.get('type')
+        if event_type == 'style':
+            if not self.engine.set_style(self.user['uid'], event.get('style')):
+                self.send({'type': 'error', 'error': f"Unknown style: {event.get('style')}"})
+        elif event_type == 'sync':
+            with self._cond:
+                self._sent = None
+                self._pending = self._current
+                self._cond.notify()
+        elif event_type == 'ping':
+            self.send({'type': 'pong', 'stats': dict(self.stats)})
+        else:
+            self.send({'type': 'error', 'error': f"Unknown event type: {event_type}"})
+
+    def _work(self):
+        while True:
+            with self._cond:
+                # An idle avatar sends nothing; wake up when the token expires anyway
+                while self._pending is None and not self._closed and not token_expired(self.user):
+                    self._cond.wait(token_expires_in(self.user))
+                if self._closed:
+                    return
+                expired = token_expired(self.user)
+                if not expired:
+                    tick, values = self._pending
+                    self._pending = None
+                    frame = pack_update(tick, values, self._sent)
+                    self._sent = values
+            if expired:
+                close_expired(self.ws, self.send, self.user['uid'])
+                return
+            if frame is None:
+                continue
+
+            kind = 'keyframe' if frame[0] == KEYFRAME else 'delta'
+            try:
+                with self._send_lock:
+                    self.ws.send(frame)
+            except Exception:
+                # Connection is gone; the receive loop will notice
+                return
+            self.stats['frames'] += 1
+            self.stats['bytes'] += len(frame)
+            if kind == 'keyframe':
+                self.stats['keyframes'] += 1
+            AVATAR_UPDATE_BYTES.inc(len(frame), kind=kind)
@@ -0,0 +1,113 @@
+"""
+Logging Setup Utility
+Structured, level-gated logging that never writes to stdout on a request thread
+
+Records are put on an in-memory queue by a QueueHandler; one listener
+thread formats them and writes them out, so a slow terminal or log pipe
+cannot stall a request. Fields passed with `extra=` are kept as
+key=value pairs (or JSON fields with LOG_FORMAT=json).
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+_handler = None
+_setup_lock = threading.Lock()
+
+
+def record_fields(record):
+    """Structured fields attached to a record with `extra=`"""
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+
+class KeyValueFormatter(logging.Formatter):
+    """`time LEVEL logger message key=value ...` lines"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = record_fields(record)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **record_fields(record)
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def _restart_after_fork():
+    # The listener thread did not survive the fork; give the child its own
+    # queue (the parent's lock may have been held mid-fork) and thread
+    if _listener is not None:
+        _listener.queue = _handler.queue = queue.SimpleQueue()
+        _listener._thread = None
+        _listener.start()
+
+
+def configure_logging(level=None, fmt=None):
+    """
+    Route all logging through a queue drained by a background thread
+
+    LOG_LEVEL    DEBUG, INFO (default), WARNING, ERROR
+    LOG_FORMAT   text (key=value, default) or json
+
+    Safe to call more than once; only the first call installs handlers.
+    Returns:
+        QueueListener: The thread writing records to stdout
+    """
+    global _listener, _handler
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+
+        level = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+        fmt = (fmt or os.getenv('LOG_FORMAT', 'text')).lower()
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter() if fmt == 'json' else KeyValueFormatter())
+
+        records = queue.SimpleQueue()
+        _handler = logging.handlers.QueueHandler(records)
+        _listener = logging.handlers.QueueListener(records, output, respect_handler_level=False)
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_handler)
+        root.setLevel(level)
+
+        _listener.start()
+        os.register_at_fork(after_in_child=_restart_after_fork)
+        atexit.register(stop_logging)
+        return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the listener (at shutdown)"""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
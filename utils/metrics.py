@@ -0,0 +1,247 @@
+"""
+Metrics Utility
+Counters, gauges and latency histograms exported in the Prometheus text format
+
+Instruments are cheap enough for the hot path: one lock and a few
+additions per update. Values are per process; scrape each worker (or run
+one process with threads / the ASGI server) for a complete picture.
+"""
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds (seconds) for latency histograms: sub-millisecond parsing
+# up to long model calls
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        """Yield (name suffix, label values, extra label pairs, value)"""
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield '', key, (), value
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labels, key, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down; optionally read from a callback at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn, **labels):
+        """Report fn() for these labels whenever metrics are scraped"""
+        self._functions[self._key(labels)] = fn
+
+    def samples(self):
+        yield from super().samples()
+        for key, fn in list(self._functions.items()):
+            try:
+                yield '', key, (), fn()
+            except Exception:
+                continue
+
+
+class Histogram(_Metric):
+    """Distribution of observations (latencies) in cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # First bucket the value fits in; len(buckets) is the +Inf bucket
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with-block, even when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                yield '_bucket', key, (('le', _format_value(bound)),), cumulative
+            yield '_sum', key, (), total
+            yield '_count', key, (), count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def register_collector(self, collect):
+        """
+        Add metrics computed at scrape time
+        Args:
+            collect: Callable returning an iterable of metrics (usually
+                Counters/Gauges filled from a component's stats dict)
+        """
+        with self._lock:
+            self._collectors.append(collect)
+
+    def expose(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for collect in collectors:
+            try:
+                metrics.extend(collect())
+            except Exception:
+                continue
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labels=()):
+    return REGISTRY.register(Counter(name, documentation, labels))
+
+
+def gauge(name, documentation, labels=()):
+    return REGISTRY.register(Gauge(name, documentation, labels))
+
+
+def histogram(name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labels, buckets))
+
+
+# ============================================
+# TALKBOT METRICS
+# ============================================
+# Shared by app.py, asgi.py and the utils that sit on the request path
+HTTP_REQUESTS = counter('talkbot_http_requests_total', 'HTTP requests by route and status', ('route', 'status'))
+HTTP_ERRORS = counter('talkbot_http_errors_total', 'Failed requests (4xx/5xx or broken streams) by route', ('route', 'status'))
+HTTP_LATENCY = histogram('talkbot_http_request_seconds', 'Time to the response headers by route', ('route',))
+AUTH_LATENCY = histogram('talkbot_auth_verify_seconds', 'Firebase ID token verification time', ('result',))
+PARSE_LATENCY = histogram('talkbot_request_parse_seconds', 'Request body parse/decode time', ('route', 'format'))
+IMAGE_DECODE_LATENCY = histogram('talkbot_image_decode_seconds', 'Camera frame decode and preprocess time', ('path',))
+MODEL_TTFB = histogram('talkbot_model_ttfb_seconds', 'Model call time to first byte (first chunk when streaming)', ('call',))
+MODEL_LATENCY = histogram('talkbot_model_seconds', 'Model call total time (last chunk when streaming)', ('call',))
+MODEL_ERRORS = counter('talkbot_model_errors_total', 'Model calls that failed after the resilience policy', ('call', 'error'))
+ACTIVE_SESSIONS = gauge('talkbot_active_sessions', 'Open sessions by kind', ('kind',))
+SCHEDULER_WAIT = histogram('talkbot_scheduler_queue_seconds', 'Time a model call waited for a scheduler slot', ('class',))
+SCHEDULER_DROPPED = counter('talkbot_scheduler_dropped_total', 'Model calls dropped by the scheduler', ('class', 'reason'))
+SCHEDULER_DEPTH = gauge('talkbot_scheduler_queue_depth', 'Model calls waiting for a slot', ('class',))
+SCHEDULER_IN_FLIGHT = gauge('talkbot_scheduler_in_flight', 'Model calls holding a scheduler slot', ('class',))
+AVATAR_UPDATE_BYTES = counter('talkbot_avatar_update_bytes_total', 'Avatar update frame bytes sent by kind', ('kind',))
+
+
+def hit_miss_counters(name, documentation, stats_by_cache):
+    """
+    Build hit/miss counters from components' stats dicts at scrape time
+    Args:
+        stats_by_cache: {cache label: dict with 'hits' and 'misses'}
+    Returns:
+        list: [hits Counter, misses Counter]
+    """
+    hits = Counter(f"{name}_hits_total", f"{documentation} hits", ('cache',))
+    misses = Counter(f"{name}_misses_total", f"{documentation} misses", ('cache',))
+    for cache, stats in stats_by_cache.items():
+        hits.inc(stats.get('hits', 0), cache=cache)
+        misses.inc(stats.get('misses', 0), cache=cache)
+    return [hits, misses]
@@ -0,0 +1,420 @@
+"""
+Model Client Utility
+Deadlines, retries, hedging, concurrency limits and a circuit breaker
+around upstream Gemini calls
+
+Wraps any callable (model.generate_content, chat.send_message, their async
+variants, or a fake in tests), so the resilience policy lives in one place.
+Blocking and async calls draw on the same concurrency limit.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .metrics import MODEL_TTFB, MODEL_LATENCY, MODEL_ERRORS
+
+try:
+    from google.api_core import exceptions as api_exceptions
+    RETRYABLE_API_ERRORS = (
+        api_exceptions.ServiceUnavailable,
+        api_exceptions.InternalServerError,
+        api_exceptions.DeadlineExceeded,
+        api_exceptions.TooManyRequests,
+        api_exceptions.ResourceExhausted,
+        api_exceptions.Aborted,
+        api_exceptions.BadGateway,
+        api_exceptions.GatewayTimeout,
+        api_exceptions.Unknown
+    )
+except ImportError:
+    RETRYABLE_API_ERRORS = ()
+
+
+class ModelUnavailableError(RuntimeError):
+    """The call was refused locally without reaching the model"""
+
+
+class CircuitOpenError(ModelUnavailableError):
+    """Upstream has been failing; calls fail fast until the breaker resets"""
+
+
+class ModelOverloadedError(ModelUnavailableError):
+    """No concurrency slot freed up before the call's deadline"""
+
+
+class ModelTimeoutError(TimeoutError):
+    """The model did not answer before the deadline"""
+
+
+def is_retryable(error):
+    """Transient upstream failures worth another attempt"""
+    return isinstance(error, RETRYABLE_API_ERRORS + (ModelTimeoutError, ConnectionError))
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive upstream failures; while
+    open every call fails fast. After `reset_timeout` seconds one trial call
+    is let through (half-open): success closes the breaker, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+        self.stats = {'opened': 0, 'rejected': 0}
+
+    def allow(self):
+        """Whether a call may go upstream now"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            now = time.monotonic()
+            if now - self._opened_at >= self.reset_timeout:
+                # One trial per reset period, even if its outcome never arrives
+                self.state = 'half_open'
+                self._opened_at = now
+                return True
+            self.stats['rejected'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.stats['opened'] += 1
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+
+class ModelClient:
+    def __init__(self, timeout=30.0, attempt_timeout=None, retries=2, backoff=0.25,
+                 max_backoff=2.0, hedge_delay=None, max_concurrency=64, breaker=None):
+        """
+        Args:
+            timeout: Deadline for a whole call, retries included (seconds)
+            attempt_timeout: Deadline for a single attempt (default: timeout)
+            retries: Extra attempts after a retryable failure
+            backoff: Base of the exponential, fully jittered retry delay
+            max_backoff: Cap on one retry delay
+            hedge_delay: Send a duplicate request when a hedged call has not
+                answered after this many seconds (None disables hedging)
+            max_concurrency: Upstream calls allowed in flight per process,
+                blocking and async calls together
+            breaker: CircuitBreaker shared by all calls
+        """
+        self.timeout = timeout
+        self.attempt_timeout = attempt_timeout or timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_delay = hedge_delay
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker or CircuitBreaker()
+
+        # A slot is held until the upstream call really returns, even when
+        # the caller gave up at its deadline, so abandoned calls can't pile up.
+        # Async calls take their slots from the same semaphore.
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='model')
+        self.stats = {
+            'calls': 0, 'failures': 0, 'retries': 0, 'timeouts': 0,
+            'hedged': 0, 'hedge_wins': 0, 'overloaded': 0
+        }
+
+    def snapshot(self):
+        """Counters plus breaker state for /health"""
+        return {**self.stats, 'breaker': self.breaker.state, **self.breaker.stats}
+
+    # ---------- sync ----------
+
+    def call(self, fn, *args, hedge=False, hedge_slot=None, stateful=False, label='model', **kwargs):
+        """
+        Call the model with the resilience policy
+        Args:
+            fn: Blocking model call, e.g. model.generate_content
+            hedge: Allow a duplicate request for tail latency; only for
+                stateless calls (never for chat.send_message, which
+                appends to the session history)
+            hedge_slot: Takes the caller's scheduler slot for the duplicate
+                without waiting; returns a function releasing it, or None
+                to skip the hedge (ModelScheduler.try_admit)
+            stateful: fn changes state when it completes (chat.send_message
+                appends to the session history). A timed-out attempt keeps
+                running and may still do so, so timeouts are not retried;
+                errors the call raised are.
+            label: Name the call is reported under in the latency metrics;
+                for stream=True calls the caller observes the total itself
+        Returns:
+            Whatever fn returns
+        Raises:
+            ModelUnavailableError: Breaker open or no slot before the deadline
+            ModelTimeoutError: No answer before the deadline
+            Exception: The last upstream error once retries are exhausted
+        """
+        self.stats['calls'] += 1
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        attempt = 0
+        while True:
+            try:
+                self._check_breaker()
+                result = self._attempt(fn, args, kwargs, deadline, hedge and not stateful, hedge_slot)
+            except ModelUnavailableError as e:
+                MODEL_ERRORS.inc(call=label, error=type(e).__name__)
+                raise
+            except Exception as e:
+                delay = self._on_failure(e, attempt, deadline, stateful)
+                if delay is None:
+                    MODEL_ERRORS.inc(call=label, error=type(e).__name__)
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            self._observe(label, start, kwargs)
+            return result
+
+    def _submit(self, fn, args, kwargs, timeout, release=None):
+        if not self._slots.acquire(timeout=max(0.0, timeout)):
+            self.stats['overloaded'] += 1
+            raise ModelOverloadedError("Too many model calls in flight")
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._release(release))
+        return future
+
+    def _release(self, release=None):
+        self._slots.release()
+        if release:
+            release()
+
+    def _take_hedge_slot(self, hedge_slot):
+        """
+        Returns:
+            tuple: (whether a duplicate may run, its scheduler release or None)
+        """
+        if hedge_slot is None:
+            return True, None
+        release = hedge_slot()
+        return release is not None, release
+
+    def _attempt(self, fn, args, kwargs, deadline, hedge, hedge_slot=None):
+        attempt_deadline = min(deadline, time.monotonic() + self.attempt_timeout)
+        primary = self._submit(fn, args, kwargs, attempt_deadline - time.monotonic())
+        pending = {primary}
+
+        if hedge and self.hedge_delay is not None:
+            done, _ = wait(pending, timeout=min(self.hedge_delay, attempt_deadline - time.monotonic()))
+            if not done and time.monotonic() < attempt_deadline:
+                # Hedges only use spare capacity, here and in the scheduler
+                allowed, release = self._take_hedge_slot(hedge_slot)
+                if allowed:
+                    try:
+                        pending.add(self._submit(fn, args, kwargs, 0, release))
+                        self.stats['hedged'] += 1
+                    except ModelOverloadedError:
+                        if release:
+                            release()
+
+        error = None
+        while pending:
+            done, pending = wait(
+                pending, timeout=max(0.0, attempt_deadline - time.monotonic()),
+                return_when=FIRST_COMPLETED
+            )
+            if not done:
+                self.stats['timeouts'] += 1
+                raise ModelTimeoutError("Model call timed out")
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self.stats['hedge_wins'] += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    # ---------- async ----------
+
+    async def call_async(self, fn, *args, hedge=False, hedge_slot=None, stateful=False, label='model', **kwargs):
+        """
+        Async variant of call()
+        Args:
+            fn: Coroutine function, e.g. model.generate_content_async;
+                timed-out attempts are cancelled, but a request already
+                sent may still complete upstream, so stateful calls are
+                not retried after a timeout either
+        """
+        self.stats['calls'] += 1
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        attempt = 0
+        while True:
+            try:
+                self._check_breaker()
+                result = await self._attempt_async(fn, args, kwargs, deadline, hedge and not stateful, hedge_slot)
+            except ModelUnavailableError as e:
+                MODEL_ERRORS.inc(call=label, error=type(e).__name__)
+                raise
+            except Exception as e:
+                delay = self._on_failure(e, attempt, deadline, stateful)
+                if delay is None:
+                    MODEL_ERRORS.inc(call=label, error=type(e).__name__)
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            self._observe(label, start, kwargs)
+            return result
+
+    async def _acquire_async(self, timeout):
+        """
+        Take a slot from the shared semaphore without blocking the event loop
+        Returns:
+            bool: False if none freed up within timeout seconds
+        """
+        deadline = time.monotonic() + timeout
+        delay = 0.005
+        # Slots are released from executor threads too, so poll rather than wait
+        while not self._slots.acquire(blocking=False):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.05)
+        return True
+
+    def _start_async(self, fn, args, kwargs, release=None):
+        """Run fn as a task in a slot already taken; the slot goes back when the task ends"""
+        try:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+        except BaseException:
+            self._release(release)
+            raise
+        task.add_done_callback(lambda _: self._release(release))
+        return task
+
+    async def _attempt_async(self, fn, args, kwargs, deadline, hedge, hedge_slot=None):
+        attempt_deadline = min(deadline, time.monotonic() + self.attempt_timeout)
+        if not await self._acquire_async(max(0.0, attempt_deadline - time.monotonic())):
+            self.stats['overloaded'] += 1
+            raise ModelOverloadedError("Too many model calls in flight")
+        primary = self._start_async(fn, args, kwargs)
+        tasks = {primary}
+        try:
+            if hedge and self.hedge_delay is not None:
+                done, _ = await asyncio.wait(
+                    tasks, timeout=min(self.hedge_delay, attempt_deadline - time.monotonic())
+                )
+                if not done and self._slots.acquire(blocking=False):
+                    # Hedges only use spare capacity, here and in the scheduler
+                    allowed, release = self._take_hedge_slot(hedge_slot)
+                    if allowed:
+                        tasks.add(self._start_async(fn, args, kwargs, release))
+                        self.stats['hedged'] += 1
+                    else:
+                        self._slots.release()
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, attempt_deadline - time.monotonic()),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    self.stats['timeouts'] += 1
+                    raise ModelTimeoutError("Model call timed out")
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.stats['hedge_wins'] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    # ---------- shared policy ----------
+
+    def _observe(self, label, start, kwargs):
+        # A streamed call returns at its first chunk; the rest is the caller's
+        elapsed = time.perf_counter() - start
+        MODEL_TTFB.observe(elapsed, call=label)
+        if not kwargs.get('stream'):
+            MODEL_LATENCY.observe(elapsed, call=label)
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError("Model temporarily unavailable")
+
+    def _on_failure(self, error, attempt, deadline, stateful=False):
+        """
+        Record a failed attempt
+        Returns:
+            float: Seconds to sleep before retrying, or None to give up
+        """
+        if not is_retryable(error):
+            # The model answered (bad request, blocked prompt...) - upstream is healthy
+            self.breaker.record_success()
+            return None
+        self.stats['failures'] += 1
+        self.breaker.record_failure()
+        if stateful and isinstance(error, ModelTimeoutError):
+            # The abandoned attempt may still land in the session; a retry
+            # would send the message twice
+            return None
+        if attempt >= self.retries:
+            return None
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if time.monotonic() + delay >= deadline:
+            return None
+        self.stats['retries'] += 1
+        return delay
+
+
+def create_model_client():
+    """
+    Build the upstream model client from environment variables
+
+    MODEL_TIMEOUT            deadline for a whole model call in seconds (retries included)
+    MODEL_ATTEMPT_TIMEOUT    deadline for one attempt (default: MODEL_TIMEOUT)
+    MODEL_RETRIES            extra attempts on retryable errors
+    MODEL_RETRY_BACKOFF      base retry delay in seconds (exponential, jittered)
+    MODEL_HEDGE_DELAY        seconds before a hedged duplicate request (unset disables)
+    MODEL_MAX_CONCURRENCY    upstream calls in flight per process
+    BREAKER_FAILURES         consecutive failures that open the circuit breaker
+    BREAKER_RESET            seconds before an open breaker lets a trial call through
+    """
+    attempt_timeout = os.getenv('MODEL_ATTEMPT_TIMEOUT')
+    hedge_delay = os.getenv('MODEL_HEDGE_DELAY')
+    return ModelClient(
+        timeout=float(os.getenv('MODEL_TIMEOUT', 30)),
+        attempt_timeout=float(attempt_timeout) if attempt_timeout else None,
+        retries=int(os.getenv('MODEL_RETRIES', 2)),
+        backoff=float(os.getenv('MODEL_RETRY_BACKOFF', 0.25)),
+        hedge_delay=float(hedge_delay) if hedge_delay else None,
+        max_concurrency=int(os.getenv('MODEL_MAX_CONCURRENCY', 64)),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv('BREAKER_FAILURES', 5)),
+            reset_timeout=float(os.getenv('BREAKER_RESET', 30))
+        )
+    )
@@ -0,0 +1,202 @@
+"""
+Rate Limiter Utility
+Per-user token-bucket admission control for the model-bound endpoints
+
+Each (scope, uid) pair has a bucket holding up to `burst` tokens that
+refills at `rate` tokens per second; a request spends one token or is
+refused. Buckets live in process memory (the default), or in a shared
+SQLite file so every worker on the host enforces the same limit at the
+cost of one write transaction per request.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def refill(tokens, updated, now, rate, burst):
+    """Bucket level at `now`, given its level at `updated`"""
+    return min(burst, tokens + max(0.0, now - updated) * rate)
+
+
+class MemoryBucketStore:
+    """Buckets for a single process (LRU-bounded)"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1.0):
+        """
+        Spend `cost` tokens from a bucket if it has them
+        Returns:
+            float: 0 if admitted, otherwise seconds until enough tokens refill
+        """
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = refill(tokens, updated, now, rate, burst)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class SQLiteBucketStore:
+    """
+    Buckets shared by every worker on one host
+
+    Each take() is one short IMMEDIATE transaction on a WAL-mode SQLite
+    file, so concurrent workers never double-spend a token. Every row keeps
+    the time its bucket will be full again; a full bucket is the same as no
+    row, so rows past that time are deleted every `prune_interval` seconds
+    and the table only holds users who were active recently.
+    """
+
+    def __init__(self, path, prune_interval=60.0):
+        self.path = path
+        self.prune_interval = prune_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        self._next_prune = time.time() + prune_interval
+        self._prune_lock = threading.Lock()
+        self.stats = {'pruned': 0}
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " key TEXT PRIMARY KEY,"
+                " tokens REAL NOT NULL,"
+                " updated REAL NOT NULL,"
+                " full_at REAL NOT NULL DEFAULT 0)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(buckets)")]
+            if 'full_at' not in columns:
+                # Table from before pruning: old rows count as full and go first
+                conn.execute("ALTER TABLE buckets ADD COLUMN full_at REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS buckets_full_at ON buckets (full_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst, cost=1.0):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = refill(row[0], row[1], now, rate, burst) if row else burst
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            conn.execute(
+                "INSERT INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens,"
+                " updated = excluded.updated, full_at = excluded.full_at",
+                (key, tokens, now, now + (burst - tokens) / rate)
+            )
+        if now >= self._next_prune:
+            self.prune(now)
+        return wait
+
+    def prune(self, now=None):
+        """
+        Delete buckets that have refilled completely
+        Returns:
+            int: Rows deleted (0 if another thread is already pruning)
+        """
+        if not self._prune_lock.acquire(blocking=False):
+            return 0
+        try:
+            now = now or time.time()
+            self._next_prune = now + self.prune_interval
+            conn = self._conn()
+            with conn:
+                deleted = conn.execute("DELETE FROM buckets WHERE full_at <= ?", (now,)).rowcount
+            self.stats['pruned'] += deleted
+            return deleted
+        finally:
+            self._prune_lock.release()
+
+
+class RateLimiter:
+    def __init__(self, store, limits):
+        """
+        Args:
+            store: MemoryBucketStore or SQLiteBucketStore
+            limits: {scope: (rate per second, burst)}; a scope that is
+                missing or has rate <= 0 is not limited
+        """
+        self.store = store
+        self.limits = limits
+        self.stats = {scope: {'admitted': 0, 'limited': 0} for scope in limits}
+
+    def check(self, scope, uid, cost=1.0):
+        """
+        Admit or refuse one request
+        Args:
+            scope: Limit to apply ('chat', 'camera')
+            uid: Firebase user id the bucket belongs to
+        Returns:
+            float: 0 if admitted, otherwise seconds until the user may retry
+        """
+        limit = self.limits.get(scope)
+        if not limit or limit[0] <= 0:
+            return 0.0
+        rate, burst = limit
+        try:
+            wait = self.store.take(f"{scope}:{uid}", rate, burst, cost)
+        except sqlite3.Error as e:
+            # Fail open: a broken limiter must not take the API down
+            logger.warning("⚠️  Rate limiter error: %s", e)
+            return 0.0
+        self.stats[scope]['limited' if wait else 'admitted'] += 1
+        return wait
+
+
+def create_rate_limiter():
+    """
+    Build the per-user rate limiter from environment variables
+
+    RATE_LIMIT_CHAT          chat requests per second per user (0 disables)
+    RATE_LIMIT_CHAT_BURST    chat requests allowed back to back
+    RATE_LIMIT_CAMERA        camera frames per second per user (0 disables)
+    RATE_LIMIT_CAMERA_BURST  camera frames allowed back to back
+    RATE_LIMIT_BACKEND       memory (per process, default) or sqlite (shared by workers)
+    RATE_LIMIT_DB_PATH       SQLite file for the shared backend
+    RATE_LIMIT_PRUNE_INTERVAL  seconds between deletions of full SQLite buckets
+    """
+    limits = {
+        'chat': (float(os.getenv('RATE_LIMIT_CHAT', 1)), float(os.getenv('RATE_LIMIT_CHAT_BURST', 5))),
+        'camera': (float(os.getenv('RATE_LIMIT_CAMERA', 0.5)), float(os.getenv('RATE_LIMIT_CAMERA_BURST', 3)))
+    }
+    backend = os.getenv('RATE_LIMIT_BACKEND', 'memory').lower()
+    if backend == 'sqlite':
+        path = os.getenv(
+            'RATE_LIMIT_DB_PATH',
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'ratelimit.sqlite3')
+        )
+        store = SQLiteBucketStore(path, float(os.getenv('RATE_LIMIT_PRUNE_INTERVAL', 60)))
+    else:
+        store = MemoryBucketStore()
+    return RateLimiter(store, limits)
@@ -0,0 +1,116 @@
+"""
+Response Cache Utility
+TTL/LRU cache of model replies for deterministic prompts
+
+Entries are grouped by endpoint namespace ('chat', 'camera'), and each
+namespace must be switched on explicitly, since a cached reply is shared
+between users.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_prompt(text):
+    """Canonical form of a prompt for cache keys (case, whitespace, trailing punctuation)"""
+    return _WHITESPACE.sub(' ', text).strip().lower().rstrip('.!?')
+
+
+def cache_key(*parts):
+    """Compact fixed-size key for any mix of str/int key parts"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.digest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=5000, ttl=300, namespaces=()):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.namespaces = set(namespaces)
+        self._entries = OrderedDict()  # (namespace, key) -> (value, expires_at)
+        self._lock = threading.Lock()
+        self._counters = {ns: {'hits': 0, 'misses': 0, 'stores': 0} for ns in self.namespaces}
+        self._evicted = 0
+
+    def enabled(self, namespace):
+        """Whether caching is switched on for an endpoint namespace"""
+        return namespace in self.namespaces
+
+    def get(self, namespace, key):
+        """
+        Look up a cached reply
+        Args:
+            namespace: Endpoint namespace ('chat', 'camera')
+            key: Key from cache_key()
+        Returns:
+            Cached value, or None on miss / disabled namespace
+        """
+        if namespace not in self.namespaces:
+            return None
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end((namespace, key))
+                self._counters[namespace]['hits'] += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[(namespace, key)]
+            self._counters[namespace]['misses'] += 1
+            return None
+
+    def put(self, namespace, key, value):
+        """Store a reply (no-op for disabled namespaces)"""
+        if namespace not in self.namespaces:
+            return
+        with self._lock:
+            self._entries[(namespace, key)] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end((namespace, key))
+            self._counters[namespace]['stores'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evicted += 1
+
+    def stats(self):
+        """Size, evictions and per-namespace hit rates"""
+        with self._lock:
+            namespaces = {}
+            for ns, counters in self._counters.items():
+                lookups = counters['hits'] + counters['misses']
+                namespaces[ns] = {
+                    **counters,
+                    'hit_rate': round(counters['hits'] / lookups, 4) if lookups else 0.0
+                }
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'evicted': self._evicted,
+                'namespaces': namespaces
+            }
+
+
+def create_response_cache():
+    """
+    Build the response cache from environment variables
+
+    RESPONSE_CACHE_ENDPOINTS   comma-separated namespaces to enable: chat, camera
+    RESPONSE_CACHE_SIZE        max cached replies (LRU beyond this)
+    RESPONSE_CACHE_TTL         seconds a cached reply stays valid
+    """
+    namespaces = [
+        ns.strip() for ns in os.getenv('RESPONSE_CACHE_ENDPOINTS', '').split(',') if ns.strip()
+    ]
+    return ResponseCache(
+        max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', 5000)),
+        ttl=float(os.getenv('RESPONSE_CACHE_TTL', 300)),
+        namespaces=namespaces
+    )
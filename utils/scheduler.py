@@ -0,0 +1,348 @@
+"""
+Scheduler Utility
+Priority and fair-share admission for upstream model calls
+
+Model calls take a slot from a shared pool before they run. When no slot
+is free they wait in a queue per traffic class (chat, camera, summary).
+Classes share slots by weight, and inside a class every uid gets an equal
+(or weighted) share, so a few users streaming camera frames can't crowd
+out anyone's chat. A class can be capped to a fraction of the slots so
+interactive traffic always finds one free. Calls that wait past their
+deadline are dropped instead of run late - a camera frame from a second
+ago is not worth a model call.
+
+Both orders use start-time fair queuing: each queue carries a virtual
+time that advances by 1/weight per call it is granted, and the queue with
+the lowest virtual time goes next.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from .metrics import SCHEDULER_WAIT, SCHEDULER_DROPPED, SCHEDULER_DEPTH, SCHEDULER_IN_FLIGHT
+from .model_client import ModelOverloadedError
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(ModelOverloadedError):
+    """Too many calls of this class are already waiting"""
+
+
+class StaleRequestError(ModelOverloadedError):
+    """The call waited past its deadline and was dropped unrun"""
+
+
+class _Ticket:
+    __slots__ = ('cls', 'uid', 'deadline', 'enqueued', 'state', '_event', '_future', '_loop')
+
+    def __init__(self, cls, uid, deadline, loop=None):
+        self.cls = cls
+        self.uid = uid
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+        self.state = 'waiting'  # waiting -> granted | dropped | cancelled
+        self._loop = loop
+        self._event = None if loop else threading.Event()
+        self._future = loop.create_future() if loop else None
+
+    def wake(self):
+        if self._loop is None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self._future.done():
+            self._future.set_result(None)
+
+
+class _ClassQueue:
+    """One traffic class: per-uid FIFOs served in fair-share order"""
+
+    def __init__(self, name, weight, max_wait, max_share, max_queue):
+        self.name = name
+        self.weight = weight
+        self.max_wait = max_wait
+        self.max_share = max_share
+        self.max_queue = max_queue
+        self.vtime = 0.0      # class virtual time (across classes)
+        self.clock = 0.0      # virtual time of the last uid served (within the class)
+        self.in_flight = 0
+        self.depth = 0
+        self._users = {}      # uid -> deque of tickets
+        self._user_vtime = {}  # uid -> virtual time
+        self._user_weight = {}
+        self._heap = []       # (vtime, seq, uid) for uids with waiting tickets
+        self._seq = itertools.count()
+
+    def push(self, ticket, weight):
+        queue = self._users.get(ticket.uid)
+        if queue is None:
+            queue = self._users[ticket.uid] = deque()
+        if not queue:
+            # A uid returning from idle starts at the current clock: no
+            # credit for the time it was away
+            vtime = max(self._user_vtime.get(ticket.uid, 0.0), self.clock)
+            self._user_vtime[ticket.uid] = vtime
+            heapq.heappush(self._heap, (vtime, next(self._seq), ticket.uid))
+        self._user_weight[ticket.uid] = weight
+        queue.append(ticket)
+        self.depth += 1
+
+    def pop(self):
+        """Next ticket in fair-share order (cancelled ones are skipped)"""
+        while self._heap:
+            vtime, _, uid = heapq.heappop(self._heap)
+            queue = self._users[uid]
+            ticket = queue.popleft()
+            self.clock = vtime
+            if queue:
+                vtime += 1.0 / self._user_weight.get(uid, 1.0)
+                self._user_vtime[uid] = vtime
+                heapq.heappush(self._heap, (vtime, next(self._seq), uid))
+            else:
+                self._user_vtime[uid] = vtime + 1.0 / self._user_weight.get(uid, 1.0)
+                del self._users[uid]
+                self._user_weight.pop(uid, None)
+                if len(self._user_vtime) > 4 * len(self._users) + 1024:
+                    self._forget_idle()
+            if ticket.state == 'waiting':
+                self.depth -= 1
+                return ticket
+        return None
+
+    def _forget_idle(self):
+        # Idle uids at or behind the clock would restart there anyway
+        self._user_vtime = {
+            uid: vtime for uid, vtime in self._user_vtime.items()
+            if uid in self._users or vtime > self.clock
+        }
+
+
+class ModelScheduler:
+    def __init__(self, slots=64, classes=None):
+        """
+        Args:
+            slots: Model calls allowed to run at once
+            classes: {name: {'weight', 'max_wait', 'max_share', 'max_queue'}}
+                weight     share of slots relative to other classes
+                max_wait   seconds a call may wait before it is dropped
+                max_share  fraction of slots this class may hold (1.0 = all)
+                max_queue  calls allowed to wait
+        """
+        self.slots = slots
+        self._free = slots
+        self._lock = threading.Lock()
+        self._classes = {}
+        for name, options in (classes or {'default': {}}).items():
+            self._classes[name] = _ClassQueue(
+                name,
+                weight=options.get('weight', 1.0),
+                max_wait=options.get('max_wait', 30.0),
+                max_share=options.get('max_share', 1.0),
+                max_queue=options.get('max_queue', 1000)
+            )
+            SCHEDULER_DEPTH.set_function(lambda queue=self._classes[name]: queue.depth, **{'class': name})
+            SCHEDULER_IN_FLIGHT.set_function(lambda queue=self._classes[name]: queue.in_flight, **{'class': name})
+        self.stats = {'granted': 0, 'queued': 0, 'stale': 0, 'rejected': 0}
+
+    # ---------- public API ----------
+
+    @contextmanager
+    def admit(self, cls, uid, weight=1.0, max_wait=None):
+        """
+        Hold a slot for the duration of a model call
+
+        Usage:
+            with model_scheduler.admit("chat", uid):
+                model_client.call(...)
+        Args:
+            cls: Traffic class name
+            uid: User the call is made for (fair share key)
+            weight: This user's share relative to others in the class
+            max_wait: Override of the class's max_wait (seconds)
+        Raises:
+            QueueFullError: The class queue is full
+            StaleRequestError: No slot was granted before the deadline
+        """
+        ticket = self._enqueue(cls, uid, weight, max_wait)
+        if ticket.state != 'granted':
+            ticket._event.wait(max(0.0, ticket.deadline - time.monotonic()))
+            self._settle(ticket)
+        try:
+            yield
+        finally:
+            self._release(ticket)
+
+    @asynccontextmanager
+    async def admit_async(self, cls, uid, weight=1.0, max_wait=None):
+        """admit() for coroutines: waits without blocking the event loop"""
+        ticket = self._enqueue(cls, uid, weight, max_wait, loop=asyncio.get_running_loop())
+        if ticket.state != 'granted':
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(ticket._future), max(0.0, ticket.deadline - time.monotonic())
+                )
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                self._abandon(ticket)
+                raise
+            self._settle(ticket)
+        try:
+            yield
+        finally:
+            self._release(ticket)
+
+    def try_admit(self, cls, uid):
+        """
+        Take a free slot without waiting (for hedged duplicate requests)
+
+        Only succeeds when nobody in the class is queued and the class is
+        under its share, so a duplicate never jumps ahead of a waiting call.
+        Returns:
+            callable: Releases the slot, or None if none was free
+        """
+        queue = self._classes[cls]
+        with self._lock:
+            if queue.depth or not self._free or not self._has_room(queue):
+                return None
+            ticket = _Ticket(cls, uid, time.monotonic())
+            self._grant(ticket, queue, ticket.enqueued)
+        return lambda: self._release(ticket)
+
+    def snapshot(self):
+        """Slots, counters and per-class queue state for /health"""
+        with self._lock:
+            return dict(self.stats, slots=self.slots, free=self._free, classes={
+                name: {'waiting': queue.depth, 'in_flight': queue.in_flight, 'weight': queue.weight}
+                for name, queue in self._classes.items()
+            })
+
+    # ---------- internals ----------
+
+    def _enqueue(self, cls, uid, weight, max_wait, loop=None):
+        queue = self._classes[cls]
+        now = time.monotonic()
+        ticket = _Ticket(cls, uid, now + (queue.max_wait if max_wait is None else max_wait), loop)
+        with self._lock:
+            if queue.depth >= queue.max_queue:
+                self.stats['rejected'] += 1
+                SCHEDULER_DROPPED.inc(**{'class': cls, 'reason': 'full'})
+                raise QueueFullError(f"Too many {cls} model calls waiting")
+            if not queue.depth and self._free and self._has_room(queue):
+                # Fast path: nothing ahead of us
+                self._grant(ticket, queue, now)
+                return ticket
+            queue.push(ticket, weight)
+            self.stats['queued'] += 1
+            self._dispatch(now)
+        return ticket
+
+    def _settle(self, ticket):
+        """After waking up: proceed if granted, otherwise give up the place"""
+        with self._lock:
+            if ticket.state == 'granted':
+                return
+            if ticket.state == 'waiting':
+                ticket.state = 'dropped'
+                self._classes[ticket.cls].depth -= 1
+                self._count_stale(ticket)
+        raise StaleRequestError(f"{ticket.cls} call dropped after waiting {ticket.deadline - ticket.enqueued:.1f}s")
+
+    def _abandon(self, ticket):
+        with self._lock:
+            if ticket.state == 'waiting':
+                ticket.state = 'cancelled'
+                self._classes[ticket.cls].depth -= 1
+            elif ticket.state == 'granted':
+                # Granted as the caller was cancelled: hand the slot on
+                self._free_slot(ticket)
+
+    def _release(self, ticket):
+        with self._lock:
+            self._free_slot(ticket)
+
+    def _free_slot(self, ticket):
+        ticket.state = 'released'
+        self._free += 1
+        self._classes[ticket.cls].in_flight -= 1
+        self._dispatch(time.monotonic())
+
+    def _has_room(self, queue):
+        return queue.in_flight < max(1, int(self.slots * queue.max_share))
+
+    def _grant(self, ticket, queue, now):
+        ticket.state = 'granted'
+        self._free -= 1
+        queue.in_flight += 1
+        queue.vtime += 1.0 / queue.weight
+        self.stats['granted'] += 1
+        SCHEDULER_WAIT.observe(now - ticket.enqueued, **{'class': queue.name})
+
+    def _count_stale(self, ticket):
+        self.stats['stale'] += 1
+        SCHEDULER_DROPPED.inc(**{'class': ticket.cls, 'reason': 'stale'})
+
+    def _dispatch(self, now):
+        """Hand free slots to waiting calls, lowest class virtual time first"""
+        while self._free:
+            ready = [queue for queue in self._classes.values() if queue.depth and self._has_room(queue)]
+            if not ready:
+                return
+            queue = min(ready, key=lambda q: q.vtime)
+            ticket = queue.pop()
+            if ticket is None:
+                continue
+            # Classes that sat idle don't bank credit
+            floor = min(q.vtime for q in ready)
+            for idle in self._classes.values():
+                if not idle.depth and not idle.in_flight:
+                    idle.vtime = max(idle.vtime, floor)
+            if ticket.deadline <= now:
+                ticket.state = 'dropped'
+                self._count_stale(ticket)
+            else:
+                self._grant(ticket, queue, now)
+            ticket.wake()
+
+
+def create_model_scheduler():
+    """
+    Build the model call scheduler from environment variables
+
+    SCHED_SLOTS               model calls running at once (default: MODEL_MAX_CONCURRENCY)
+    SCHED_CHAT_WEIGHT         chat share when both classes are waiting
+    SCHED_CAMERA_WEIGHT       camera share when both classes are waiting
+    SCHED_CAMERA_MAX_SHARE    fraction of slots camera frames may hold
+    SCHED_CAMERA_MAX_WAIT     seconds before a queued frame is stale and dropped
+    SCHED_CHAT_MAX_WAIT       seconds a chat/speech message may wait for a slot
+    SCHED_QUEUE_MAX           calls allowed to wait per class
+    """
+    slots = int(os.getenv('SCHED_SLOTS', os.getenv('MODEL_MAX_CONCURRENCY', 64)))
+    max_queue = int(os.getenv('SCHED_QUEUE_MAX', 1000))
+    scheduler = ModelScheduler(slots, classes={
+        'chat': {
+            'weight': float(os.getenv('SCHED_CHAT_WEIGHT', 8)),
+            'max_wait': float(os.getenv('SCHED_CHAT_MAX_WAIT', 10)),
+            'max_queue': max_queue
+        },
+        'camera': {
+            'weight': float(os.getenv('SCHED_CAMERA_WEIGHT', 1)),
+            'max_wait': float(os.getenv('SCHED_CAMERA_MAX_WAIT', 1.0)),
+            'max_share': float(os.getenv('SCHED_CAMERA_MAX_SHARE', 0.5)),
+            'max_queue': max_queue
+        },
+        # Background history summaries use whatever is left
+        'summary': {'weight': 0.5, 'max_wait': 30.0, 'max_share': 0.25, 'max_queue': max_queue}
+    })
+    logger.info("✅ Model scheduler: %d slots", slots)
+    return scheduler
@@ -0,0 +1,119 @@
+"""
+Services Utility
+Lazily built, thread-safe process singletons
+
+Heavy services (Gemini client, Firebase app, emotion and speech models,
+worker pools) are created on first use instead of at import, so importing
+the app - in every gunicorn worker, test or tool - stays cheap. Services
+can be built ahead of traffic with warm_services(), e.g. once in a
+preloading gunicorn master for read-only state that forked workers share.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class LazyService:
+    """
+    Builds its instance on first use, exactly once, from any thread
+
+    Attribute access (reads and writes) is forwarded to the instance, so a LazyService can
+    stand in where the service object itself used to be. Services whose
+    factory may return None are read with get().
+    """
+
+    def __init__(self, name, factory):
+        """
+        Args:
+            name: Name used by warm_services() and in logs
+            factory: Zero-argument callable building the service
+        """
+        self._name = name
+        self._factory = factory
+        self._instance = None
+        self._ready = False
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def ready(self):
+        """Whether the service has been built (without building it)"""
+        return self._ready
+
+    def get(self):
+        """
+        The service instance, built on the first call
+        Raises:
+            Exception: Whatever the factory raised; the next call retries
+        """
+        if self._ready:
+            return self._instance
+        with self._lock:
+            if not self._ready:
+                start = time.perf_counter()
+                self._instance = self._factory()
+                self._ready = True
+                logger.debug("⚡ Service %s ready in %.1f ms", self._name, (time.perf_counter() - start) * 1000)
+        return self._instance
+
+    def peek(self):
+        """The instance if already built, else None (never builds)"""
+        return self._instance if self._ready else None
+
+    def reset(self):
+        """Forget the instance; the next get() builds a new one"""
+        with self._lock:
+            self._instance = None
+            self._ready = False
+
+    def __getattr__(self, attr):
+        # Only reached for names LazyService itself does not define
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        return getattr(self.get(), attr)
+
+    def __setattr__(self, attr, value):
+        # Own state is underscore-prefixed; anything else goes to the instance
+        if attr.startswith('_'):
+            object.__setattr__(self, attr, value)
+        else:
+            setattr(self.get(), attr, value)
+
+    def __repr__(self):
+        return f"<LazyService {self._name} ({'ready' if self._ready else 'not built'})>"
+
+
+def warm_services(names=None):
+    """
+    Build services now instead of on first use
+    Args:
+        names: Service names (default: every registered service); unknown
+            names are ignored
+    Returns:
+        dict: {name: seconds spent building} for services built by this call
+    """
+    timings = {}
+    for name in (names if names is not None else list(_registry)):
+        service = _registry.get(name.strip())
+        if service is None or service.ready:
+            continue
+        start = time.perf_counter()
+        service.get()
+        timings[service.name] = round(time.perf_counter() - start, 4)
+    if timings:
+        logger.info("✅ Services warmed", extra={'services': timings})
+    return timings
+
+
+def service_status():
+    """{name: built yet} for /health"""
+    return {name: service.ready for name, service in _registry.items()}
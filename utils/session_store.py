@@ -0,0 +1,294 @@
+"""
+Session Store Utility
+Bounded, evicting storage for per-user Gemini chat sessions
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Rough characters-per-token ratio used for history budgeting
+CHARS_PER_TOKEN = 4
+
+
+def content_text(content):
+    """
+    Extract the plain text of a chat history entry
+    Args:
+        content: glm.Content object or {'role', 'parts'} dict
+    Returns:
+        str: Concatenated text of all text parts
+    """
+    parts = content.get('parts', []) if isinstance(content, dict) else content.parts
+    texts = []
+    for part in parts:
+        if isinstance(part, str):
+            texts.append(part)
+        else:
+            text = part.get('text') if isinstance(part, dict) else getattr(part, 'text', '')
+            if text:
+                texts.append(text)
+    return ''.join(texts)
+
+
+def content_role(content):
+    """Get the role ('user' or 'model') of a chat history entry"""
+    return content.get('role', 'user') if isinstance(content, dict) else content.role
+
+
+def estimate_tokens(text):
+    """Cheap token estimate for budgeting (no tokenizer round-trip)"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class SessionStore:
+    """
+    Base class for chat session storage backends
+
+    Backends hold one chat session per session ID (the user's UID) and
+    must be safe to call from concurrent request threads.
+    """
+
+    def get(self, session_id):
+        """Return the session for session_id, or None"""
+        raise NotImplementedError
+
+    def get_or_create(self, session_id, factory):
+        """
+        Return the session for session_id, creating it with factory() if missing
+
+        factory() may be slow (it loads the stored history); it must not
+        hold up requests for other sessions, and concurrent misses for the
+        same session_id must build it only once.
+        """
+        raise NotImplementedError
+
+    def record_turn(self, session_id):
+        """Re-account a session after a turn was added to its history"""
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        """Remove a session. Returns True if it existed"""
+        raise NotImplementedError
+
+    def stats(self):
+        """Return a dict of size and eviction counters"""
+        raise NotImplementedError
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process session store with LRU + idle-TTL eviction
+
+    Sessions are kept in access order, so idle sessions always sit at the
+    front of the map and expiry is a cheap scan from the oldest entry.
+    Each session's history is capped by turn count (and optionally by
+    estimated tokens; the per-request token budget is normally left to the
+    context window manager), and the total history size is tracked for
+    memory-based eviction.
+
+    Sessions are built outside the store lock, under a lock per session ID,
+    so a slow history load only delays requests for that same session.
+    """
+
+    def __init__(self, max_sessions=1000, idle_ttl=1800, max_turns=50,
+                 max_tokens=None, max_bytes=64 * 1024 * 1024):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.max_bytes = max_bytes
+
+        self._sessions = OrderedDict()  # session_id -> [session, last_access, size_bytes]
+        self._lock = threading.RLock()
+        self._creating = {}  # session_id -> [lock, waiters] while a session is being built
+        self._total_bytes = 0
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'created': 0,
+            'deleted': 0,
+            'evicted_lru': 0,
+            'evicted_idle': 0,
+            'evicted_memory': 0,
+            'trimmed_turns': 0
+        }
+
+    # ---------- public API ----------
+
+    def get(self, session_id):
+        with self._lock:
+            self._expire_idle()
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            entry[1] = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return entry[0]
+
+    def get_or_create(self, session_id, factory):
+        with self._lock:
+            session = self.get(session_id)
+            if session is not None:
+                self._counters['hits'] += 1
+                return session
+            build = self._creating.setdefault(session_id, [threading.Lock(), 0])
+            build[1] += 1
+
+        try:
+            with build[0]:
+                with self._lock:
+                    # Built by the request we waited for
+                    session = self.get(session_id)
+                    if session is not None:
+                        self._counters['hits'] += 1
+                        return session
+                    self._counters['misses'] += 1
+
+                session = factory()
+
+                with self._lock:
+                    self._counters['created'] += 1
+                    self._sessions[session_id] = [session, time.monotonic(), 0]
+                    self._account(session_id)
+                    self._evict_overflow()
+                    return session
+        finally:
+            with self._lock:
+                build[1] -= 1
+                if not build[1]:
+                    del self._creating[session_id]
+
+    def record_turn(self, session_id):
+        with self._lock:
+            if session_id not in self._sessions:
+                return
+            self._trim_history(session_id)
+            self._account(session_id)
+            self._evict_overflow()
+
+    def delete(self, session_id):
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is None:
+                return False
+            self._total_bytes -= entry[2]
+            self._counters['deleted'] += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            self._expire_idle()
+            return {
+                'backend': 'memory',
+                'size': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'idle_ttl': self.idle_ttl,
+                'history_bytes': self._total_bytes,
+                'history_tokens_est': self._total_bytes // CHARS_PER_TOKEN,
+                'max_bytes': self.max_bytes,
+                **self._counters
+            }
+
+    def __contains__(self, session_id):
+        with self._lock:
+            self._expire_idle()
+            return session_id in self._sessions
+
+    def __len__(self):
+        with self._lock:
+            self._expire_idle()
+            return len(self._sessions)
+
+    # ---------- internals (caller holds the lock) ----------
+
+    def _history(self, session_id):
+        session = self._sessions[session_id][0]
+        return getattr(session, 'history', None) or []
+
+    def _account(self, session_id):
+        """Recompute the stored size of one session's history"""
+        entry = self._sessions[session_id]
+        size = sum(len(content_text(c).encode('utf-8')) for c in self._history(session_id))
+        self._total_bytes += size - entry[2]
+        entry[2] = size
+
+    def _trim_history(self, session_id):
+        """Drop the oldest user/model pairs until the turn and token caps hold"""
+        session = self._sessions[session_id][0]
+        history = list(self._history(session_id))
+        if not history:
+            return
+
+        tokens = sum(estimate_tokens(content_text(c)) for c in history)
+        dropped = 0
+        while len(history) > 2 and (
+            len(history) // 2 > self.max_turns or (self.max_tokens and tokens > self.max_tokens)
+        ):
+            for content in history[:2]:
+                tokens -= estimate_tokens(content_text(content))
+            history = history[2:]
+            dropped += 1
+
+        if dropped:
+            session.history = history
+            self._counters['trimmed_turns'] += dropped
+
+    def _expire_idle(self):
+        if not self.idle_ttl:
+            return
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if entry[1] > cutoff:
+                break
+            self._pop_oldest('evicted_idle')
+
+    def _evict_overflow(self):
+        while len(self._sessions) > self.max_sessions:
+            self._pop_oldest('evicted_lru')
+        while self.max_bytes and self._total_bytes > self.max_bytes and len(self._sessions) > 1:
+            self._pop_oldest('evicted_memory')
+
+    def _pop_oldest(self, counter):
+        _, entry = self._sessions.popitem(last=False)
+        self._total_bytes -= entry[2]
+        self._counters[counter] += 1
+
+
+# Registered session store backends, selected with SESSION_STORE
+SESSION_STORES = {
+    'memory': MemorySessionStore
+}
+
+
+def create_session_store():
+    """
+    Build the configured session store from environment variables
+
+    SESSION_STORE         backend name (default: memory)
+    SESSION_MAX           max live sessions before LRU eviction
+    SESSION_IDLE_TTL      seconds of inactivity before a session expires
+    SESSION_MAX_TURNS     max user/model turns kept per session
+    SESSION_MAX_BYTES     max total history bytes across all sessions
+
+    The token budget per session is CONTEXT_TOKEN_BUDGET (utils/context_manager.py).
+    """
+    backend = os.getenv('SESSION_STORE', 'memory')
+    store_class = SESSION_STORES.get(backend)
+    if store_class is None:
+        raise ValueError(f"Unknown SESSION_STORE backend: {backend}")
+
+    return store_class(
+        max_sessions=int(os.getenv('SESSION_MAX', 1000)),
+        idle_ttl=float(os.getenv('SESSION_IDLE_TTL', 1800)),
+        max_turns=int(os.getenv('SESSION_MAX_TURNS', 50)),
+        max_bytes=int(os.getenv('SESSION_MAX_BYTES', 64 * 1024 * 1024))
+    )
@@ -3,11 +3,441 @@ Speech Handler Utility
 Handles text-to-speech and speech-to-text operations
 """
 
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import wave
+from array import array
+from collections import deque
+
+# vosk (and the requests stack it pulls in) is imported by VoskRecognizer,
+# so importing this module stays cheap until recognition is set up
+vosk = None
+
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'models')
+
+# Sentence boundaries for sentence-by-sentence synthesis
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n+')
+
+# eSpeak NG voice per supported language
+ESPEAK_VOICES = {
+    'en-US': 'en-us',
+    'es-ES': 'es',
+    'fr-FR': 'fr-fr',
+    'de-DE': 'de'
+}
+
+
+def split_sentences(text):
+    """Split text into sentences, dropping empty ones"""
+    return [s.strip() for s in _SENTENCE_END.split(text) if s.strip()]
+
+
+def wav_stream_header(sample_rate, channels, sample_width):
+    """
+    WAV header for a stream of unknown length
+    Players read until the connection closes when the sizes are maxed out
+    """
+    byte_rate = sample_rate * channels * sample_width
+    return b''.join([
+        b'RIFF', struct.pack('<I', 0xFFFFFFFF), b'WAVE',
+        b'fmt ', struct.pack('<IHHIIHH', 16, 1, channels, sample_rate, byte_rate,
+                             channels * sample_width, sample_width * 8),
+        b'data', struct.pack('<I', 0xFFFFFFFF)
+    ])
+
+
+class EspeakEngine:
+    """Offline synthesis through the eSpeak NG command line (no network)"""
+
+    name = 'espeak-ng'
+
+    def __init__(self, binary='espeak-ng', timeout=30):
+        self.binary = shutil.which(binary)
+        self.timeout = timeout
+
+    @property
+    def available(self):
+        return self.binary is not None
+
+    def synthesize(self, text, language, rate, pitch):
+        """
+        Args:
+            text: One sentence
+            language: Supported language code
+            rate: Speech rate (0.5 to 2.0)
+            pitch: Voice pitch (0.5 to 2.0)
+        Returns:
+            bytes: WAV clip (16-bit PCM)
+        """
+        result = subprocess.run(
+            [
+                self.binary, '--stdout',
+                '-v', ESPEAK_VOICES.get(language, 'en-us'),
+                '-s', str(int(175 * rate)),          # words per minute
+                '-p', str(min(99, int(50 * pitch)))  # 0-99, 50 is normal
+            ],
+            input=text.encode('utf-8'),
+            capture_output=True,
+            timeout=self.timeout,
+            check=True
+        )
+        return result.stdout
+
+
+class AudioCache:
+    """
+    Content-addressed on-disk cache of synthesized clips
+
+    Clips live at <directory>/<key[:2]>/<key>.wav, keyed by a hash of
+    (text, language, rate, pitch, engine); writes are atomic, so several
+    workers can share one directory.
+
+    A hit touches the clip's mtime, so mtimes order clips by last use for
+    every worker. Sweeps delete clips unused for max_age, then the least
+    recently used ones until the cache is back under max_bytes. A sweep runs
+    when this process's running total passes max_bytes, and at least every
+    sweep_interval seconds to catch what other workers stored.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, max_age=7 * 86400, sweep_interval=600):
+        """
+        Args:
+            directory: Cache directory (created on first store)
+            max_bytes: Size the cache is trimmed to, LRU first (0: no limit)
+            max_age: Seconds since last use before a clip is deleted (0: no limit)
+            sweep_interval: Longest time between sweeps in seconds
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self._size = None  # bytes on disk as of the last sweep, plus our stores since
+        self._swept_at = 0.0
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evicted': 0, 'bytes': 0}
+
+    @staticmethod
+    def key(*parts):
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.wav')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.stats['misses'] += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # Evicted by another worker meanwhile; the data is still good
+            pass
+        self.stats['hits'] += 1
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self.stats['stores'] += 1
+
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+            due = (
+                self._size is None
+                or (self.max_bytes and self._size > self.max_bytes)
+                or time.monotonic() - self._swept_at > self.sweep_interval
+            )
+        if due:
+            self.sweep()
+
+    def sweep(self):
+        """
+        Delete expired clips, then the least recently used until under max_bytes
+        Returns:
+            int: Clips deleted
+        """
+        if not self._sweep_lock.acquire(blocking=False):
+            # Another thread is sweeping
+            return 0
+        try:
+            now = time.time()
+            clips = []
+            evicted = 0
+            for shard in self._scandir(self.directory):
+                for entry in self._scandir(shard.path):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    age = now - stat.st_mtime
+                    # Temp files older than an hour were left by a crashed write
+                    expired = (self.max_age and age > self.max_age) if entry.name.endswith('.wav') else age > 3600
+                    if expired:
+                        evicted += self._remove(entry.path)
+                    elif entry.name.endswith('.wav'):
+                        clips.append((stat.st_mtime, stat.st_size, entry.path))
+
+            size = sum(clip[1] for clip in clips)
+            if self.max_bytes and size > self.max_bytes:
+                # Trim below the limit so the next sweep isn't right behind
+                target = self.max_bytes * 0.9
+                clips.sort()
+                for _, clip_size, path in clips:
+                    if size <= target:
+                        break
+                    if self._remove(path):
+                        size -= clip_size
+                        evicted += 1
+
+            with self._lock:
+                self._size = size
+                self._swept_at = time.monotonic()
+            self.stats['evicted'] += evicted
+            self.stats['bytes'] = size
+            if evicted:
+                logger.info("🧹 Audio cache: evicted %d clips, %.1f MiB left", evicted, size / 2 ** 20)
+            return evicted
+        finally:
+            self._sweep_lock.release()
+
+    @staticmethod
+    def _scandir(path):
+        try:
+            with os.scandir(path) as entries:
+                return [entry for entry in entries if entry.is_dir() or entry.is_file()]
+        except OSError:
+            return []
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
+
+
+class VoskRecognizer:
+    """Offline streaming speech recognition on CPU (Vosk/Kaldi)"""
+
+    name = 'vosk'
+
+    def __init__(self, model_path, language='en-US'):
+        self.language = language
+        self.model = None
+        global vosk
+        if vosk is None:
+            try:
+                import vosk
+            except ImportError:
+                pass
+        if vosk is None:
+            logger.warning("⚠️  vosk not installed - server-side speech recognition disabled")
+            return
+        if not os.path.isdir(model_path):
+            return
+        vosk.SetLogLevel(-1)
+        # Loaded once; every recognizer created below shares it
+        self.model = vosk.Model(model_path)
+        logger.info("✅ Speech recognition: Vosk model %s", model_path)
+
+    @property
+    def available(self):
+        return self.model is not None
+
+    def new_recognizer(self, sample_rate):
+        """Fresh recognizer for one utterance (16-bit mono PCM at sample_rate)"""
+        recognizer = vosk.KaldiRecognizer(self.model, sample_rate)
+        recognizer.SetWords(True)
+        return recognizer
+
+
+def pcm_rms(frame):
+    """RMS level of 16-bit little-endian mono PCM"""
+    samples = array('h', frame)
+    if not samples:
+        return 0.0
+    return math.sqrt(sum(s * s for s in samples) / len(samples))
+
+
+def recognizer_text(result_json):
+    """
+    Text and mean word confidence from a Vosk Result()/FinalResult()
+    Returns:
+        tuple: (text, confidence)
+    """
+    result = json.loads(result_json)
+    words = result.get('result') or []
+    confidence = sum(w.get('conf', 0.0) for w in words) / len(words) if words else 0.0
+    return result.get('text', ''), confidence
+
+
+class SpeechStream:
+    """
+    Incremental recognition of one audio stream, split by voice activity
+
+    feed() takes 16-bit mono PCM chunks of any size and returns events:
+        {"type": "partial", "text": ...}            hypothesis so far
+        {"type": "final", "text": ..., "confidence": ...}
+    Audio is only decoded while someone is talking: an utterance opens after
+    `start_ms` of audio above `threshold` (with `preroll_ms` of audio before
+    it), and closes after `silence_ms` of quiet or `max_utterance_ms`, so
+    the final transcript is ready as soon as the speaker stops.
+    """
+
+    def __init__(self, recognizer, sample_rate=16000, threshold=500, start_ms=90,
+                 silence_ms=700, max_utterance_ms=15000, preroll_ms=300,
+                 partial_interval_ms=200, frame_ms=30):
+        self.recognizer = recognizer
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.frame_ms = frame_ms
+        self.frame_bytes = sample_rate * frame_ms // 1000 * 2
+        self.start_frames = max(1, start_ms // frame_ms)
+        self.silence_ms = silence_ms
+        self.max_utterance_ms = max_utterance_ms
+        self.partial_frames = max(1, partial_interval_ms // frame_ms)
+
+        self._buffer = bytearray()
+        self._preroll = deque(maxlen=max(1, preroll_ms // frame_ms))
+        self._active = None  # recognizer of the open utterance
+        self._voiced = 0
+        self._reset_utterance()
+
+    def _reset_utterance(self):
+        self._active = None
+        self._segments = []
+        self._confidences = []
+        self._utterance_ms = 0
+        self._silent_ms = 0
+        self._frames = 0
+        self._last_partial = ''
+
+    def feed(self, pcm):
+        """
+        Args:
+            pcm: 16-bit little-endian mono samples at sample_rate
+        Returns:
+            list: Events produced by this chunk
+        """
+        self._buffer.extend(pcm)
+        events = []
+        while len(self._buffer) >= self.frame_bytes:
+            frame = bytes(self._buffer[:self.frame_bytes])
+            del self._buffer[:self.frame_bytes]
+            event = self._frame(frame)
+            if event:
+                events.append(event)
+        return events
+
+    def flush(self):
+        """Close any open utterance (client stopped sending); returns a final event or None"""
+        self._buffer.clear()
+        return self._finish() if self._active is not None else None
+
+    def _frame(self, frame):
+        loud = pcm_rms(frame) >= self.threshold
+
+        if self._active is None:
+            self._preroll.append(frame)
+            self._voiced = self._voiced + 1 if loud else 0
+            if self._voiced < self.start_frames:
+                return None
+            # Speech started - decode from the pre-roll so the first word isn't clipped
+            self._active = self.recognizer.new_recognizer(self.sample_rate)
+            self._voiced = 0
+            frames, self._preroll = list(self._preroll), deque(maxlen=self._preroll.maxlen)
+            for buffered in frames:
+                self._accept(buffered)
+            self._utterance_ms = len(frames) * self.frame_ms
+            return None
+
+        self._accept(frame)
+        self._utterance_ms += self.frame_ms
+        self._silent_ms = 0 if loud else self._silent_ms + self.frame_ms
+        if self._silent_ms >= self.silence_ms or self._utterance_ms >= self.max_utterance_ms:
+            return self._finish()
+
+        self._frames += 1
+        if self._frames % self.partial_frames == 0:
+            partial = json.loads(self._active.PartialResult()).get('partial', '')
+            text = ' '.join(self._segments + [partial]).strip()
+            if text != self._last_partial:
+                self._last_partial = text
+                return {'type': 'partial', 'text': text}
+        return None
+
+    def _accept(self, frame):
+        # The recognizer may close a segment on its own pauses; keep collecting
+        if self._active.AcceptWaveform(frame):
+            self._add_segment(self._active.Result())
+
+    def _add_segment(self, result_json):
+        text, confidence = recognizer_text(result_json)
+        if text:
+            self._segments.append(text)
+            self._confidences.append(confidence)
+
+    def _finish(self):
+        self._add_segment(self._active.FinalResult())
+        text = ' '.join(self._segments)
+        confidence = sum(self._confidences) / len(self._confidences) if self._confidences else 0.0
+        self._reset_utterance()
+        if not text:
+            return None
+        return {'type': 'final', 'text': text, 'confidence': round(confidence, 3)}
+
+
 class SpeechHandler:
-    def __init__(self):
+    def __init__(self, engine=None, cache=None, recognizer=None, vad_options=None):
         self.supported_languages = ['en-US', 'es-ES', 'fr-FR', 'de-DE']
         self.default_language = 'en-US'
-    
+        self.engine = engine
+        self.cache = cache
+        self.recognizer = recognizer
+        self.vad_options = vad_options or {}
+
+    @property
+    def can_synthesize(self):
+        """Whether server-side synthesis is available"""
+        return self.engine is not None and self.engine.available
+
+    @property
+    def can_recognize(self):
+        """Whether server-side speech recognition is available"""
+        return self.recognizer is not None and self.recognizer.available
+
+    def speech_stream(self, sample_rate=16000):
+        """Streaming recognizer with voice-activity detection for one connection"""
+        return SpeechStream(self.recognizer, sample_rate=sample_rate, **self.vad_options)
+
     def text_to_speech_config(self, text, language='en-US', rate=1.0, pitch=1.0):
         """
         Generate TTS configuration
@@ -26,24 +456,93 @@ class SpeechHandler:
             'pitch': max(0.5, min(2.0, pitch)),
             'volume': 1.0
         }
-    
-    def process_speech_input(self, audio_data):
+
+    def synthesize(self, config):
+        """
+        Synthesize one sentence, using the audio cache
+        Args:
+            config: Dict from text_to_speech_config
+        Returns:
+            bytes: WAV clip
+        """
+        args = (config['text'], config['language'], config['rate'], config['pitch'])
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(self.engine.name, *args)
+            clip = self.cache.get(key)
+            if clip is not None:
+                return clip
+        clip = self.engine.synthesize(*args)
+        if key is not None:
+            self.cache.put(key, clip)
+        return clip
+
+    def stream_speech(self, config):
+        """
+        Synthesize text sentence by sentence
+        The first sentence is synthesized before returning, so its audio format
+        is known and synthesis errors surface before any audio is sent
+        Args:
+            config: Dict from text_to_speech_config
+        Returns:
+            tuple: ((sample_rate, channels, sample_width), iterator of PCM bytes
+                with one sentence per item, synthesized as the iterator advances)
+        """
+        sentences = split_sentences(config['text'])
+        if not sentences:
+            raise ValueError("Nothing to synthesize")
+        audio_format, first = self._sentence_pcm(config, sentences[0])
+
+        def frames():
+            yield first
+            for sentence in sentences[1:]:
+                yield self._sentence_pcm(config, sentence)[1]
+
+        return audio_format, frames()
+
+    def _sentence_pcm(self, config, sentence):
+        clip = self.synthesize({**config, 'text': sentence})
+        with wave.open(io.BytesIO(clip)) as w:
+            audio_format = (w.getframerate(), w.getnchannels(), w.getsampwidth())
+            return audio_format, w.readframes(w.getnframes())
+
+    def process_speech_input(self, audio_data, sample_rate=16000):
         """
         Process speech input
         Args:
-            audio_data: Audio data from microphone
+            audio_data: WAV clip, or 16-bit mono PCM at sample_rate
+            sample_rate: Sample rate of raw PCM input
         Returns:
             dict: Transcription result
         """
-        # Placeholder for actual speech recognition
-        # In production, integrate with Google Speech API or similar
+        if not self.can_recognize:
+            return {'success': False, 'error': 'Speech recognition is not available'}
+
+        if audio_data[:4] == b'RIFF':
+            with wave.open(io.BytesIO(audio_data)) as w:
+                sample_rate = w.getframerate()
+                audio_data = w.readframes(w.getnframes())
+
+        recognizer = self.recognizer.new_recognizer(sample_rate)
+        segments, confidences = [], []
+        chunk = sample_rate // 4 * 2  # 250 ms
+        for i in range(0, len(audio_data), chunk):
+            if recognizer.AcceptWaveform(audio_data[i:i + chunk]):
+                text, confidence = recognizer_text(recognizer.Result())
+                if text:
+                    segments.append(text)
+                    confidences.append(confidence)
+        text, confidence = recognizer_text(recognizer.FinalResult())
+        if text:
+            segments.append(text)
+            confidences.append(confidence)
         return {
-            'success': True,
-            'transcript': 'Sample transcribed text',
-            'confidence': 0.92,
-            'language': 'en-US'
+            'success': bool(segments),
+            'transcript': ' '.join(segments),
+            'confidence': round(sum(confidences) / len(confidences), 3) if confidences else 0.0,
+            'language': self.recognizer.language
         }
-    
+
     def get_supported_voices(self):
         """Get list of supported voices"""
         return {
@@ -51,4 +550,47 @@ class SpeechHandler:
             'es-ES': ['male', 'female'],
             'fr-FR': ['male', 'female'],
             'de-DE': ['male', 'female']
-        }
\ No newline at end of file
+        }
+
+
+def create_speech_handler():
+    """
+    Build the speech handler from environment variables
+
+    TTS_ENGINE          eSpeak NG binary used for offline synthesis
+    TTS_CACHE_DIR       directory of cached clips (empty disables the cache)
+    TTS_CACHE_MAX_MB    size the cache is trimmed to, least recently used first
+    TTS_CACHE_MAX_AGE   seconds since a clip was last used before it is deleted
+    STT_MODEL           Vosk model directory (default: models/vosk)
+    STT_LANGUAGE        language of the Vosk model
+    STT_VAD_THRESHOLD   RMS level (16-bit PCM) counted as speech
+    STT_SILENCE_MS      silence that ends an utterance
+    STT_MAX_UTTERANCE_MS longest utterance before it is closed anyway
+    """
+    engine = EspeakEngine(os.getenv('TTS_ENGINE', 'espeak-ng'))
+    if engine.available:
+        logger.info("✅ Speech synthesis: %s", engine.binary)
+    else:
+        logger.warning("⚠️  eSpeak NG not found - /api/tts disabled, browsers synthesize speech")
+    cache_dir = os.getenv(
+        'TTS_CACHE_DIR',
+        os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'tts_cache')
+    )
+    recognizer = VoskRecognizer(
+        os.getenv('STT_MODEL', os.path.join(MODELS_DIR, 'vosk')),
+        language=os.getenv('STT_LANGUAGE', 'en-US')
+    )
+    return SpeechHandler(
+        engine=engine,
+        cache=AudioCache(
+            cache_dir,
+            max_bytes=int(float(os.getenv('TTS_CACHE_MAX_MB', 256)) * 1024 * 1024),
+            max_age=float(os.getenv('TTS_CACHE_MAX_AGE', 7 * 86400))
+        ) if cache_dir else None,
+        recognizer=recognizer,
+        vad_options={
+            'threshold': float(os.getenv('STT_VAD_THRESHOLD', 500)),
+            'silence_ms': int(os.getenv('STT_SILENCE_MS', 700)),
+            'max_utterance_ms': int(os.getenv('STT_MAX_UTTERANCE_MS', 15000))
+        }
+    )
@@ -0,0 +1,314 @@
+"""
+User Directory Utility
+Cached, batched Firebase user lookups
+
+Concurrent lookups are coalesced by a MicroBatcher into bulk
+auth.get_users calls (up to 100 identifiers each) and profiles are kept in
+a TTL/LRU cache addressable by uid and email. A profile fetched before the
+user's latest ID token was issued is dropped when that token is verified,
+so profile edits show up on the next token refresh rather than after the TTL.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from .batch_scheduler import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+# auth.get_users accepts at most 100 identifiers per call
+MAX_LOOKUP_BATCH = 100
+
+
+def user_profile(record):
+    """Plain dict for a firebase_admin UserRecord"""
+    return {
+        'uid': record.uid,
+        'email': record.email,
+        'display_name': record.display_name,
+        'photo_url': record.photo_url,
+        'email_verified': record.email_verified,
+        'disabled': record.disabled
+    }
+
+
+def firebase_lookup(keys):
+    """
+    Default UserDirectory backend: one auth.get_users call
+
+    Works against the Auth emulator when FIREBASE_AUTH_EMULATOR_HOST is set.
+
+    Args:
+        keys: Up to MAX_LOOKUP_BATCH ('uid', value) / ('email', value) tuples
+    Returns:
+        list: Profile dicts for the users that exist, in any order
+    """
+    from firebase_admin import auth
+    from .firebase_auth import ensure_firebase
+
+    ensure_firebase()
+    identifiers = [
+        auth.UidIdentifier(value) if kind == 'uid' else auth.EmailIdentifier(value)
+        for kind, value in keys
+    ]
+    return [user_profile(record) for record in auth.get_users(identifiers).users]
+
+
+def _key(kind, value):
+    # Firebase matches emails case-insensitively
+    return (kind, value.strip().lower()) if kind == 'email' else (kind, value)
+
+
+class UserDirectory:
+    def __init__(self, lookup=firebase_lookup, ttl=300, negative_ttl=30, max_entries=10000,
+                 batch_wait_ms=5, max_queue=10000):
+        """
+        Args:
+            lookup: Callable taking a list of ('uid'|'email', value) keys and
+                returning the profile dicts found (firebase_lookup, or a
+                local fake)
+            ttl: Seconds a profile stays cached
+            negative_ttl: Seconds a "no such user" answer stays cached
+            max_entries: Cache size (LRU beyond this)
+            batch_wait_ms: Longest a lookup waits for others to share its call
+            max_queue: Lookups allowed to wait for a batch
+        """
+        self.lookup = lookup
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (profile or None, fetched_at, expires_at)
+        self._pending = {}  # key -> Future of a lookup in flight
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0, 'misses': 0, 'expired': 0, 'invalidated': 0,
+            'evicted': 0, 'lookups': 0, 'not_found': 0, 'errors': 0
+        }
+        self._batcher = MicroBatcher(
+            self._fetch_batch, max_batch_size=MAX_LOOKUP_BATCH, max_wait_ms=batch_wait_ms,
+            max_queue=max_queue, name='user-directory'
+        )
+
+    # ---- lookups ----
+
+    def get_by_uid(self, uid, timeout=None):
+        """
+        Profile for a uid
+        Returns:
+            dict: Profile, or None if the user does not exist
+        Raises:
+            Exception: Whatever the backend raised for this lookup
+        """
+        return self._submit([_key('uid', uid)])[0].result(timeout)
+
+    def get_by_email(self, email, timeout=None):
+        """Profile for an email address, or None if no user has it"""
+        return self._submit([_key('email', email)])[0].result(timeout)
+
+    def cached(self, uid):
+        """
+        Profile for a uid only if it is already cached (never looks it up)
+        Returns:
+            dict: Profile, or None if it isn't cached, has expired or the
+                user does not exist
+        """
+        with self._lock:
+            entry = self._entries.get(_key('uid', uid))
+            if entry is None or entry[2] <= time.monotonic():
+                return None
+            self._entries.move_to_end(_key('uid', uid))
+            self.stats['hits'] += 1
+            return entry[0]
+
+    def prefetch(self, uids):
+        """
+        Start fetching many profiles without waiting for them
+
+        Cached profiles are served immediately; the rest are looked up in
+        as few get_users calls as the batch size allows. Call it early
+        (e.g. as a dashboard page starts rendering) and collect the result
+        later.
+
+        Args:
+            uids: Iterable of uids
+        Returns:
+            Future: Resolves to {uid: profile or None}
+        """
+        uids = list(dict.fromkeys(uids))
+        futures = self._submit([_key('uid', uid) for uid in uids])
+        combined = Future()
+        if not uids:
+            combined.set_result({})
+            return combined
+
+        remaining = [len(futures)]
+        remaining_lock = threading.Lock()
+
+        def on_done(_):
+            with remaining_lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            try:
+                combined.set_result({uid: future.result() for uid, future in zip(uids, futures)})
+            except Exception as e:
+                combined.set_exception(e)
+
+        for future in futures:
+            future.add_done_callback(on_done)
+        return combined
+
+    def get_many(self, uids, timeout=None):
+        """Blocking prefetch(): {uid: profile or None}"""
+        return self.prefetch(uids).result(timeout)
+
+    async def get_many_async(self, uids):
+        """prefetch() for async handlers: await {uid: profile or None}"""
+        return await asyncio.wrap_future(self.prefetch(uids))
+
+    # ---- invalidation ----
+
+    def invalidate(self, uid, issued_at=None):
+        """
+        Drop a cached profile
+        Args:
+            uid: User id
+            issued_at: `iat` of a freshly verified ID token; the profile is
+                only dropped if it was fetched before then (default: always)
+        Returns:
+            bool: True if an entry was dropped
+        """
+        with self._lock:
+            entry = self._entries.get(('uid', uid))
+            if entry is None or (issued_at is not None and entry[1] >= issued_at):
+                return False
+            del self._entries[('uid', uid)]
+            if entry[0] and entry[0].get('email'):
+                self._entries.pop(_key('email', entry[0]['email']), None)
+            self.stats['invalidated'] += 1
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self):
+        """Cache counters plus batching stats for /health"""
+        batcher = self._batcher.stats()
+        with self._lock:
+            return dict(
+                self.stats, size=len(self._entries),
+                avg_batch_size=batcher['avg_batch_size'], queue_depth=batcher['queue_depth']
+            )
+
+    def close(self):
+        self._batcher.close()
+
+    # ---- internals ----
+
+    def _submit(self, keys):
+        """One Future per key: cached, already in flight, or newly queued"""
+        futures = []
+        queued = []
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[2] > now:
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    future = Future()
+                    future.set_result(entry[0])
+                    futures.append(future)
+                    continue
+                if entry is not None:
+                    del self._entries[key]
+                    self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                future = self._pending.get(key)
+                if future is None:
+                    future = Future()
+                    self._pending[key] = future
+                    queued.append(key)
+                futures.append(future)
+
+        for key in queued:
+            try:
+                self._batcher.submit(key).add_done_callback(
+                    lambda done, key=key: self._resolve(key, done)
+                )
+            except Exception as e:
+                self._resolve(key, None, e)
+        return futures
+
+    def _resolve(self, key, done, error=None):
+        with self._lock:
+            future = self._pending.pop(key, None)
+        if future is None:
+            return
+        if error is None:
+            error = done.exception()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(done.result())
+
+    def _fetch_batch(self, keys):
+        """MicroBatcher callback: one backend call for up to MAX_LOOKUP_BATCH keys"""
+        try:
+            profiles = self.lookup(list(keys))
+        except Exception as e:
+            with self._lock:
+                self.stats['errors'] += 1
+            logger.warning("❌ User lookup failed for %d keys: %s", len(keys), e)
+            raise
+
+        found = {}
+        for profile in profiles:
+            found[('uid', profile['uid'])] = profile
+            if profile.get('email'):
+                found[_key('email', profile['email'])] = profile
+
+        fetched_at = time.time()
+        now = time.monotonic()
+        results = [found.get(key) for key in keys]
+        with self._lock:
+            self.stats['lookups'] += 1
+            for key, profile in zip(keys, results):
+                if profile is None:
+                    self.stats['not_found'] += 1
+                    self._store(key, None, fetched_at, now + self.negative_ttl)
+            # Found profiles are reachable by uid and by email
+            for key, profile in found.items():
+                self._store(key, profile, fetched_at, now + self.ttl)
+        return results
+
+    def _store(self, key, profile, fetched_at, expires_at):
+        self._entries[key] = (profile, fetched_at, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evicted'] += 1
+
+
+def create_user_directory(lookup=None):
+    """
+    Build the user directory from environment variables
+
+    USER_CACHE_TTL            seconds a profile stays cached
+    USER_CACHE_NEGATIVE_TTL   seconds an unknown uid/email stays cached
+    USER_CACHE_SIZE           max cached profiles (LRU)
+    USER_LOOKUP_WAIT_MS       max time a lookup waits to share a get_users call
+    """
+    return UserDirectory(
+        lookup=lookup or firebase_lookup,
+        ttl=float(os.getenv('USER_CACHE_TTL', 300)),
+        negative_ttl=float(os.getenv('USER_CACHE_NEGATIVE_TTL', 30)),
+        max_entries=int(os.getenv('USER_CACHE_SIZE', 10000)),
+        batch_wait_ms=float(os.getenv('USER_LOOKUP_WAIT_MS', 5))
+    )